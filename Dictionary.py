@@ -10,6 +10,9 @@ EN_to_CN = {
     "Account:": "账号：",
     "Password:": "密码：",
     "Start Generating": "开始生成",
+    "Export Import Files": "导出批量导入文件",
+    "Joint Extraction": "联合抽取",
+    "Asynchronous Requests": "异步请求",
     "Back to Home": "返回首页",
     "Select Language": "选择语言",
     "English": "English",
@@ -41,6 +44,9 @@ CN_to_EN = {
     "Account:": "账户:",
     "Password:": "密码:",
     "Start Generation": "开始生成",
+    "Export Import Files": "导出批量导入文件",
+    "Joint Extraction": "联合抽取",
+    "Asynchronous Requests": "异步请求",
     "Back to Home": "返回首页",
     "Select Language": "选择语言",
     "English": "英文",
@@ -0,0 +1,192 @@
+# Import related packages
+from knowledge_graph_builder import Document
+from KGCache import llm_settings
+from KGMatcher import estimate_tokens
+from KGScheduler import TokenBucket, DEFAULT_MAX_RETRIES, DEFAULT_COMPLETION_TOKENS
+import threading
+import datetime
+import asyncio
+import time
+
+
+# Chunks in flight at once from the single event loop
+DEFAULT_MAX_IN_FLIGHT = 64
+# Keep-alive connections of the shared HTTP pool
+DEFAULT_MAX_CONNECTIONS = 64
+DEFAULT_TIMEOUT = 120.0
+# Summary prompt of KnowledgeGraphBuilder.summary, so that async and threaded runs share cached responses
+SUMMARY_PROMPT = "Succinctly summarise the text provided by the user. Respond only with the summary and no other comments"
+
+
+# asyncio adapter of a GroqClient or OpenAIClient: requests go through the async SDK over one pooled
+# keep-alive HTTP client, so hundreds of requests can be in flight without a thread per request.
+# Other LLM clients are run in the default thread pool of the loop.
+class AsyncLLMClient:
+    def __init__(self, llm_client, max_in_flight=DEFAULT_MAX_IN_FLIGHT, max_connections=DEFAULT_MAX_CONNECTIONS, timeout=DEFAULT_TIMEOUT,
+                 max_retries=DEFAULT_MAX_RETRIES, requests_per_minute=None, tokens_per_minute=None,
+                 completion_tokens=DEFAULT_COMPLETION_TOKENS, cache=None, metrics=None):
+        self.llm_client = llm_client
+        self.settings = llm_settings(llm_client)
+        self.max_in_flight = max_in_flight
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.requests = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.completion_tokens = completion_tokens
+        # CachedLLMClient whose entries are read and written around every request
+        self.cache = cache
+        # KGMetrics.RunMetrics recording the latency and estimated tokens of every request
+        self.metrics = metrics
+        self.calls = 0
+        self.failures = 0
+        self._client = None
+        self._http_client = None
+        self._semaphore = None
+
+    # The SDK client and its connection pool belong to the event loop they are first used on
+    def async_client(self):
+        if self._client is not None:
+            return self._client
+        backend = self.settings["client"]
+        if backend not in ("GroqClient", "OpenAIClient"):
+            return None
+        import httpx
+        limits = httpx.Limits(max_connections=self.max_connections, max_keepalive_connections=self.max_connections)
+        self._http_client = httpx.AsyncClient(limits=limits, timeout=self.timeout)
+        if backend == "GroqClient":
+            from groq import AsyncGroq
+            self._client = AsyncGroq(http_client=self._http_client, max_retries=self.max_retries)
+        else:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(http_client=self._http_client, max_retries=self.max_retries)
+        return self._client
+
+    async def throttle(self, user_message, system_message):
+        if self.requests:
+            await asyncio.sleep(self.requests.reserve())
+        if self.tokens:
+            cost = estimate_tokens(system_message) + estimate_tokens(user_message) + self.completion_tokens
+            await asyncio.sleep(self.tokens.reserve(cost))
+
+    async def request(self, user_message, system_message):
+        client = self.async_client()
+        if client is None:
+            return await asyncio.get_running_loop().run_in_executor(None, self.llm_client.generate_response, user_message, system_message)
+        options = {"temperature": self.settings["temperature"], "top_p": self.settings["top_p"]}
+        max_tokens = getattr(self.llm_client, "_max_tokens", None)
+        if max_tokens:
+            options["max_tokens"] = max_tokens
+        result = await client.chat.completions.create(
+            messages=[
+                {"role": "system", "content": system_message},
+                {"role": "user", "content": user_message},
+            ],
+            model=self.settings["model"],
+            stop=None,
+            stream=False,
+            **options,
+        )
+        return result.choices[0].message.content
+
+    async def generate_response(self, user_message, system_message):
+        key = None
+        if self.cache is not None:
+            key, response = self.cache.lookup(user_message, system_message)
+            if response is not None:
+                return response
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        async with self._semaphore:
+            await self.throttle(user_message, system_message)
+            self.calls += 1
+            start = time.perf_counter()
+            try:
+                response = await self.request(user_message, system_message)
+            except Exception:
+                self.failures += 1
+                if self.metrics:
+                    self.metrics.count("llm_errors")
+                raise
+            finally:
+                if self.metrics:
+                    self.metrics.observe("llm_latency_seconds", time.perf_counter() - start)
+                    self.metrics.count("llm_requests")
+        if self.metrics:
+            self.metrics.count("prompt_tokens", estimate_tokens(system_message) + estimate_tokens(user_message))
+            self.metrics.count("completion_tokens", estimate_tokens(response or ""))
+        if self.cache is not None and response:
+            self.cache.put(key, response)
+        return response
+
+    async def aclose(self):
+        if self._http_client is not None:
+            await self._http_client.aclose()
+        self._client = None
+        self._http_client = None
+
+    def stats(self):
+        return {"calls": self.calls, "failures": self.failures, "max_in_flight": self.max_in_flight}
+
+
+# Edges of an LLM response, with the metadata and sequence document_to_subgraph attaches to them
+def response_to_subgraph(builder, response, doc, sequence):
+    if not response:
+        builder.log("ERROR", "Empty response from Knowledge Graph Builder")
+    jsondata = builder.response_to_json(response or "")
+    if jsondata is None:
+        jsondata = builder.parse_manually(response or "") or []
+    edges = builder.extract_valid_edges(jsondata)
+    for edge in edges:
+        edge.metadata = doc.metadata
+        edge.sequence = sequence
+    return edges
+
+
+# async form of KGGenerate.chunk_to_subgraph: the summary, then the extraction of one chunk
+async def chunk_to_subgraph_async(builder, client, chunk, sequence):
+    try:
+        summary = await client.generate_response(user_message=chunk, system_message=SUMMARY_PROMPT)
+    except Exception:
+        summary = ""
+    doc = Document(text=chunk, metadata={"summary": summary, "generated_at": str(datetime.datetime.now())})
+    response = await client.generate_response(user_message=builder.format_user_input(chunk), system_message=builder.format_prompt())
+    return response_to_subgraph(builder, response, doc, sequence)
+
+
+# async form of KGGenerate.documents_to_graph_concurrent: every chunk is a task of the running loop
+async def documents_to_graph_async(builder, client, user_text, prefilter=None):
+    system_tokens = estimate_tokens(builder.format_prompt()) if prefilter else 0
+    tasks = []
+    for index, chunk in enumerate(user_text):
+        if prefilter and not prefilter.keep(chunk, system_tokens + 2 * estimate_tokens(chunk)):
+            continue
+        tasks.append((index, asyncio.ensure_future(chunk_to_subgraph_async(builder, client, chunk, index))))
+    graph = []
+    failures = []
+    for index, task in tasks:
+        try:
+            graph.extend(await task)
+        except Exception as e:
+            failures.append((index, e))
+    return graph, failures
+
+
+# Runs one event loop in a background thread and hands out concurrent futures for its chunks, so the
+# synchronous extraction loop (KGGenerate.stream_subgraphs) can drive the async client from a QThread
+class AsyncRunner:
+    def __init__(self, client):
+        self.client = client
+        self.max_in_flight = client.max_in_flight
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name="llm-event-loop", daemon=True)
+        self.thread.start()
+
+    def submit(self, builder, chunk, sequence):
+        return asyncio.run_coroutine_threadsafe(chunk_to_subgraph_async(builder, self.client, chunk, sequence), self.loop)
+
+    def close(self):
+        asyncio.run_coroutine_threadsafe(self.client.aclose(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
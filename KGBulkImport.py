@@ -0,0 +1,344 @@
+# Import related packages
+from KGNeo4j import iter_workbook_rows, triples_kind, is_missing, constraint_statement
+from KGDedup import TripleIndex
+from itertools import islice
+import functools
+import tempfile
+import sqlite3
+import shutil
+import shlex
+import json
+import csv
+import os
+
+
+# Directory the import files are written to, next to the triple workbooks
+BULK_IMPORT_DIRNAME = "neo4j-import"
+# Lists the files written, their label or relationship type and row counts; read back by verify_bulk_import
+BULK_IMPORT_MANIFEST = "import.json"
+# Runs neo4j-admin on the files of the directory
+BULK_IMPORT_SCRIPT = "neo4j-admin-import.sh"
+# Uniqueness constraints of the imported labels, to run once the database is started (the importer creates none)
+BULK_IMPORT_SCHEMA = "schema.cypher"
+# Database the script imports into
+DEFAULT_DATABASE = "neo4j"
+# Most recently used strings of a GraphTable whose IDs are kept in memory
+STRING_CACHE_SIZE = 1 << 16
+# Rows checked against the deduplication index in one transaction
+DEDUP_BATCH_SIZE = 5000
+
+
+# Graph of a bulk export kept on disk instead of in dicts of Python strings, so that its size is bounded by the disk.
+# Every string (label, name, relationship type, attribute, value) is stored once in a string table and the nodes,
+# properties and relationships are rows of integer IDs. Nodes and properties are read back in the order they were added.
+class GraphTable:
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.executescript(
+            "PRAGMA journal_mode = OFF; PRAGMA synchronous = OFF;"
+            "CREATE TABLE IF NOT EXISTS strings (id INTEGER PRIMARY KEY, text TEXT NOT NULL UNIQUE);"
+            "CREATE TABLE IF NOT EXISTS nodes (id INTEGER PRIMARY KEY, label INTEGER NOT NULL, name INTEGER NOT NULL, UNIQUE (label, name));"
+            "CREATE TABLE IF NOT EXISTS properties ("
+            "node INTEGER NOT NULL, attribute INTEGER NOT NULL, value INTEGER NOT NULL, PRIMARY KEY (node, attribute)) WITHOUT ROWID;"
+            "CREATE TABLE IF NOT EXISTS relationships ("
+            "head_label INTEGER NOT NULL, type INTEGER NOT NULL, tail_label INTEGER NOT NULL, head INTEGER NOT NULL, tail INTEGER NOT NULL, "
+            "PRIMARY KEY (head_label, type, tail_label, head, tail)) WITHOUT ROWID;"
+        )
+        # Labels, relationship types and attributes repeat on every row: their IDs are looked up once
+        self.string = functools.lru_cache(maxsize=STRING_CACHE_SIZE)(self.string)
+
+    # ID of a string in the string table, added on first use
+    def string(self, text):
+        found = self._conn.execute("SELECT id FROM strings WHERE text = ?", (text,)).fetchone()
+        return found[0] if found else self._conn.execute("INSERT INTO strings (text) VALUES (?)", (text,)).lastrowid
+
+    # ID of the (label, name) node, added on first use
+    def node(self, label, name):
+        label, name = self.string(label), self.string(name)
+        found = self._conn.execute("SELECT id FROM nodes WHERE label = ? AND name = ?", (label, name)).fetchone()
+        return found[0] if found else self._conn.execute("INSERT INTO nodes (label, name) VALUES (?, ?)", (label, name)).lastrowid
+
+    # The last value of an attribute wins, like SET
+    def set_property(self, node, attribute, value):
+        self._conn.execute(
+            "INSERT INTO properties (node, attribute, value) VALUES (?, ?, ?) ON CONFLICT (node, attribute) DO UPDATE SET value = excluded.value",
+            (node, self.string(attribute), self.string(value)),
+        )
+
+    def add_relationship(self, head, key1, relationship, tail, key2):
+        self.node(head, key1)
+        self.node(tail, key2)
+        self._conn.execute(
+            "INSERT OR IGNORE INTO relationships (head_label, type, tail_label, head, tail) VALUES (?, ?, ?, ?, ?)",
+            (self.string(head), self.string(relationship), self.string(tail), self.string(key1), self.string(key2)),
+        )
+
+    def commit(self):
+        self._conn.commit()
+
+    def labels(self):
+        return sorted(text for (text,) in self._conn.execute("SELECT DISTINCT s.text FROM nodes n JOIN strings s ON s.id = n.label"))
+
+    # Attribute names of the nodes of a label and the number of these nodes
+    def label_summary(self, label):
+        attributes = sorted(text for (text,) in self._conn.execute(
+            "SELECT DISTINCT a.text FROM properties p JOIN nodes n ON n.id = p.node JOIN strings l ON l.id = n.label "
+            "JOIN strings a ON a.id = p.attribute WHERE l.text = ?", (label,)))
+        count = self._conn.execute("SELECT COUNT(*) FROM nodes n JOIN strings l ON l.id = n.label WHERE l.text = ?", (label,)).fetchone()[0]
+        return attributes, count
+
+    # (name, {attribute: value}) of the nodes of a label, streamed from two cursors ordered by node
+    def iter_nodes(self, label):
+        properties = self._conn.execute(
+            "SELECT p.node, a.text, v.text FROM properties p JOIN nodes n ON n.id = p.node JOIN strings l ON l.id = n.label "
+            "JOIN strings a ON a.id = p.attribute JOIN strings v ON v.id = p.value WHERE l.text = ? ORDER BY p.node", (label,))
+        pending = next(properties, None)
+        for node, name in self._conn.execute(
+                "SELECT n.id, s.text FROM nodes n JOIN strings l ON l.id = n.label JOIN strings s ON s.id = n.name WHERE l.text = ? ORDER BY n.id", (label,)):
+            values = {}
+            while pending is not None and pending[0] == node:
+                values[pending[1]] = pending[2]
+                pending = next(properties, None)
+            yield name, values
+
+    # (head label, relationship type, tail label) of the relationships with their count
+    def relationship_groups(self):
+        return sorted(self._conn.execute(
+            "SELECT h.text, t.text, e.text, COUNT(*) FROM relationships r JOIN strings h ON h.id = r.head_label "
+            "JOIN strings t ON t.id = r.type JOIN strings e ON e.id = r.tail_label GROUP BY r.head_label, r.type, r.tail_label"))
+
+    # (head name, tail name) of the relationships of a group, sorted
+    def iter_relationships(self, head, relationship, tail):
+        return self._conn.execute(
+            "SELECT h.text, t.text FROM relationships r JOIN strings h ON h.id = r.head JOIN strings t ON t.id = r.tail "
+            "WHERE r.head_label = (SELECT id FROM strings WHERE text = ?) AND r.type = (SELECT id FROM strings WHERE text = ?) "
+            "AND r.tail_label = (SELECT id FROM strings WHERE text = ?) ORDER BY h.text, t.text", (head, relationship, tail))
+
+    def close(self):
+        self._conn.close()
+
+
+# Node and relationship CSV files for `neo4j-admin database import full`, the offline importer that builds a new
+# database far faster than MERGE statements. The graph is the one BatchKGToNeo4j builds from the same workbooks:
+# - one node per (entity label, name); every label is its own ID space, so equal names of two labels stay two nodes
+# - the attributes of the entity attribute triples are properties of the entity node (the last value wins, like SET)
+# - one relationship per distinct (head, relationship, tail); relationship types outside the ontology's relationship
+#   list are written as the loader writes them, and counted
+# Rows with empty cells and duplicates (compared like KGDedup) are skipped, as the loader does.
+# The graph is kept in a GraphTable and the keys of the rows seen in a KGDedup.TripleIndex, both in a temporary
+# directory of work_dir (a new one by default) removed by close, so no part of the corpus is held in memory.
+class BulkImportWriter:
+    def __init__(self, erontology, work_dir=None):
+        self.relationship_types = set(erontology.relationships)
+        self.work_dir = tempfile.mkdtemp(prefix=".bulk-export-", dir=work_dir)
+        self.graph = GraphTable(os.path.join(self.work_dir, "graph.sqlite"))
+        self.index = TripleIndex(self.work_dir, durable=False)
+        self.stats = {"rows": 0, "skipped": 0, "duplicates": 0, "unknown_relationships": 0}
+
+    # Rows of an iterable, five cells as strings, without the rows with empty cells and the rows an earlier row
+    # of the same kind duplicates. The rows are checked against the index in batches.
+    def accept(self, kind, rows):
+        rows = iter(rows)
+        while True:
+            batch = list(islice(rows, DEDUP_BATCH_SIZE))
+            if not batch:
+                return
+            self.stats["rows"] += len(batch)
+            valid = [[str(value) for value in row[:5]] for row in batch if len(row) >= 5 and not any(is_missing(value) for value in row[:5])]
+            self.stats["skipped"] += len(batch) - len(valid)
+            unique = self.index.add(kind, BULK_IMPORT_DIRNAME, valid)
+            self.stats["duplicates"] += len(valid) - len(unique)
+            yield from unique
+
+    # Add (head, key1, relationship, tail, key2) rows of entity relationship triples
+    def add_relationships(self, rows):
+        for head, key1, relationship, tail, key2 in self.accept("relationship", rows):
+            if relationship not in self.relationship_types:
+                self.stats["unknown_relationships"] += 1
+            self.graph.add_relationship(head, key1, relationship, tail, key2)
+        self.graph.commit()
+
+    # Add (head, key1, attribute, tail, key2) rows of entity attribute triples
+    def add_attributes(self, rows):
+        for head, key1, attribute, tail, key2 in self.accept("attribute", rows):
+            self.graph.set_property(self.graph.node(head, key1), attribute, key2)
+        self.graph.commit()
+
+    def add_rows(self, kind, rows):
+        if kind == "relationship":
+            self.add_relationships(rows)
+        elif kind == "attribute":
+            self.add_attributes(rows)
+        else:
+            raise ValueError(f"Unsupported triples kind: {kind}")
+
+    # Write the node and relationship files, the manifest and the neo4j-admin script to output_dir.
+    # Returns the manifest.
+    def write(self, output_dir, database=DEFAULT_DATABASE):
+        os.makedirs(output_dir, exist_ok=True)
+        for name in os.listdir(output_dir):
+            if name.startswith(("nodes-", "relationships-")) and name.endswith(".csv"):
+                os.remove(os.path.join(output_dir, name))
+        manifest = {"database": database, "nodes": [], "relationships": [], "stats": dict(self.stats), "multiline": False}
+        labels = self.graph.labels()
+        for number, label in enumerate(labels):
+            attributes, count = self.graph.label_summary(label)
+            filename = f"nodes-{number}.csv"
+            rows = ([name, label] + [properties.get(attribute, "") for attribute in attributes] for name, properties in self.graph.iter_nodes(label))
+            manifest["multiline"] |= write_csv(os.path.join(output_dir, filename), node_header(label, attributes), rows)
+            manifest["nodes"].append({"file": filename, "label": label, "properties": attributes, "rows": count})
+        for number, (head, relationship, tail, count) in enumerate(self.graph.relationship_groups()):
+            filename = f"relationships-{number}.csv"
+            rows = ([key1, key2, relationship] for key1, key2 in self.graph.iter_relationships(head, relationship, tail))
+            manifest["multiline"] |= write_csv(os.path.join(output_dir, filename), relationship_header(head, tail), rows)
+            manifest["relationships"].append({"file": filename, "type": relationship, "start": head, "end": tail, "rows": count})
+        manifest["command"] = import_command(manifest)
+        # The same constraints the loader creates, so that later incremental loads MERGE through an index
+        with open(os.path.join(output_dir, BULK_IMPORT_SCHEMA), "w", encoding="utf-8") as file:
+            for label in labels:
+                file.write(constraint_statement(label) + ";\n")
+        manifest["schema"] = BULK_IMPORT_SCHEMA
+        with open(os.path.join(output_dir, BULK_IMPORT_MANIFEST), "w", encoding="utf-8") as file:
+            json.dump(manifest, file, ensure_ascii=False, indent=2)
+        script_path = os.path.join(output_dir, BULK_IMPORT_SCRIPT)
+        with open(script_path, "w", encoding="utf-8", newline="\n") as file:
+            file.write("#!/bin/sh\n# Stop the database first; the import creates it from these files\n")
+            file.write('cd "$(dirname "$0")" || exit 1\n')
+            file.write(" ".join(shlex.quote(arg) for arg in manifest["command"]) + "\n")
+            file.write(f"# Then start the database and create the constraints of the labels: cypher-shell -d {shlex.quote(database)} -f {BULK_IMPORT_SCHEMA}\n")
+        os.chmod(script_path, 0o755)
+        return manifest
+
+    def close(self):
+        self.graph.close()
+        self.index.close()
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+
+# The name is the ID of a node within the ID space of its label, and is stored as its name property
+def node_header(label, attributes):
+    return [f"name:ID({label})", ":LABEL"] + list(attributes)
+
+
+def relationship_header(head, tail):
+    return [f":START_ID({head})", f":END_ID({tail})", ":TYPE"]
+
+
+# Returns whether a value spans several lines, which neo4j-admin only accepts with --multiline-fields
+def write_csv(path, header, rows):
+    multiline = False
+    with open(path, "w", encoding="utf-8", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        for row in rows:
+            multiline = multiline or any("\n" in value or "\r" in value for value in row)
+            writer.writerow(row)
+    return multiline
+
+
+def import_command(manifest):
+    command = ["neo4j-admin", "database", "import", "full", manifest["database"]]
+    command += [f"--nodes={entry['file']}" for entry in manifest["nodes"]]
+    command += [f"--relationships={entry['file']}" for entry in manifest["relationships"]]
+    if manifest["multiline"]:
+        command.append("--multiline-fields=true")
+    return command
+
+
+# Write the import files of the triple workbooks of inputdir_path (ERTriples.xlsx, EATriples.xlsx, ...) to
+# output_dir (inputdir_path/neo4j-import by default). The header row of every workbook decides its kind,
+# as for load_directory. Returns the manifest of the files written and the problems found by verify_bulk_import.
+def bulk_export_directory(inputdir_path, erontology, output_dir=None, log=print, database=DEFAULT_DATABASE):
+    output_dir = output_dir or os.path.join(inputdir_path, BULK_IMPORT_DIRNAME)
+    os.makedirs(output_dir, exist_ok=True)
+    # The graph is built next to the import files, on the disk that has to hold them anyway
+    writer = BulkImportWriter(erontology, output_dir)
+    try:
+        for filename in sorted(os.listdir(inputdir_path)):
+            file_path = os.path.join(inputdir_path, filename)
+            if not (os.path.isfile(file_path) and filename.endswith(('.xlsx', '.xls'))):
+                continue
+            rows = iter_workbook_rows(file_path)
+            try:
+                kind = triples_kind(next(rows, ()))
+                if kind is None:
+                    log(f"Unknown ontology type for file {filename}.")
+                    continue
+                writer.add_rows(kind, rows)
+                log(f"Read the entity {kind} triples of {filename}")
+            finally:
+                rows.close()
+        return write_bulk_import(writer, output_dir, log, database)
+    finally:
+        writer.close()
+
+
+def write_bulk_import(writer, output_dir, log, database):
+    manifest = writer.write(output_dir, database)
+    stats = manifest["stats"]
+    if stats["unknown_relationships"]:
+        log(f"{stats['unknown_relationships']} triples have a relationship type that is not in the ontology; they are written as the loader writes them")
+    if stats["skipped"] or stats["duplicates"]:
+        log(f"Skipped {stats['skipped']} triples with empty cells and {stats['duplicates']} duplicate triples")
+    problems = verify_bulk_import(output_dir)
+    for problem in problems:
+        log(f"Import file problem: {problem}")
+    nodes = sum(entry["rows"] for entry in manifest["nodes"])
+    relationships = sum(entry["rows"] for entry in manifest["relationships"])
+    log(f"Wrote {nodes} nodes and {relationships} relationships for neo4j-admin to {output_dir}; run {BULK_IMPORT_SCRIPT} there with the database stopped.")
+    return {"output": output_dir, "nodes": nodes, "relationships": relationships, "stats": stats, "problems": problems}
+
+
+# Check the import files of output_dir the way neo4j-admin reads them, without a database: the headers,
+# the row counts of the manifest, duplicate node IDs within an ID space and relationships whose start or
+# end node is missing. Returns the problems found (an empty list when the files can be imported).
+def verify_bulk_import(output_dir):
+    with open(os.path.join(output_dir, BULK_IMPORT_MANIFEST), "r", encoding="utf-8") as file:
+        manifest = json.load(file)
+    problems = []
+    ids = {}
+    for entry in manifest["nodes"]:
+        label = entry["label"]
+        space = ids.setdefault(label, set())
+        with open(os.path.join(output_dir, entry["file"]), "r", encoding="utf-8", newline="") as file:
+            reader = csv.reader(file)
+            header = next(reader, [])
+            if header != node_header(label, entry["properties"]):
+                problems.append(f"{entry['file']}: unexpected header {header}")
+                continue
+            count = 0
+            for row in reader:
+                count += 1
+                if len(row) != len(header):
+                    problems.append(f"{entry['file']} line {reader.line_num}: {len(row)} fields instead of {len(header)}")
+                elif row[1] != label:
+                    problems.append(f"{entry['file']} line {reader.line_num}: label {row[1]} instead of {label}")
+                elif row[0] in space:
+                    problems.append(f"{entry['file']} line {reader.line_num}: duplicate node ID {row[0]} in ID space {label}")
+                else:
+                    space.add(row[0])
+        if count != entry["rows"]:
+            problems.append(f"{entry['file']}: {count} nodes instead of {entry['rows']}")
+    for entry in manifest["relationships"]:
+        start_ids, end_ids = ids.get(entry["start"], set()), ids.get(entry["end"], set())
+        with open(os.path.join(output_dir, entry["file"]), "r", encoding="utf-8", newline="") as file:
+            reader = csv.reader(file)
+            header = next(reader, [])
+            if header != relationship_header(entry["start"], entry["end"]):
+                problems.append(f"{entry['file']}: unexpected header {header}")
+                continue
+            count = 0
+            for row in reader:
+                count += 1
+                if len(row) != 3:
+                    problems.append(f"{entry['file']} line {reader.line_num}: {len(row)} fields instead of 3")
+                elif row[0] not in start_ids:
+                    problems.append(f"{entry['file']} line {reader.line_num}: no {entry['start']} node {row[0]}")
+                elif row[1] not in end_ids:
+                    problems.append(f"{entry['file']} line {reader.line_num}: no {entry['end']} node {row[1]}")
+                elif row[2] != entry["type"]:
+                    problems.append(f"{entry['file']} line {reader.line_num}: type {row[2]} instead of {entry['type']}")
+        if count != entry["rows"]:
+            problems.append(f"{entry['file']}: {count} relationships instead of {entry['rows']}")
+    return problems
@@ -0,0 +1,151 @@
+# Import related packages
+from knowledge_graph_builder import LLMClient
+import threading
+import hashlib
+import sqlite3
+import json
+import time
+import os
+
+
+# Default name of the cache file stored in the save directory
+LLM_CACHE_FILENAME = "llm_cache.sqlite"
+# Entries older than 30 days are evicted
+DEFAULT_MAX_AGE = 30 * 24 * 3600
+# The cache is trimmed to 512 MB, dropping the least recently used entries first
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+
+
+# Model name and sampling parameters of an LLM client, looking through wrappers such as CachedLLMClient
+def llm_settings(client):
+    while hasattr(client, "llm_client"):
+        client = client.llm_client
+    return {
+        "client": type(client).__name__,
+        "model": getattr(client, "_model", getattr(client, "model", None)),
+        "temperature": getattr(client, "_temperature", getattr(client, "temperature", None)),
+        "top_p": getattr(client, "_top_p", getattr(client, "top_p", None)),
+    }
+
+
+# Persistent content-addressed cache in front of an LLM client (GroqClient, OpenAIClient, ...)
+class CachedLLMClient(LLMClient):
+    def __init__(self, llm_client, cache_path, max_age=DEFAULT_MAX_AGE, max_size=DEFAULT_MAX_SIZE):
+        self.llm_client = llm_client
+        self.cache_path = cache_path
+        self.max_age = max_age
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        cache_dir = os.path.dirname(cache_path)
+        if cache_dir and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        self._conn = sqlite3.connect(cache_path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self.evict()
+
+    # Model name and sampling parameters of the wrapped client, part of every cache key
+    def client_settings(self):
+        return llm_settings(self.llm_client)
+
+    # The system message carries the serialized ontology and the user message carries the chunk text
+    def cache_key(self, user_message, system_message):
+        payload = json.dumps(
+            {"user": user_message, "system": system_message, **self.client_settings()},
+            ensure_ascii=False, sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or (self.max_age and now - row[1] > self.max_age):
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return row[0]
+
+    def put(self, key, response):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode("utf-8")), now, now),
+            )
+            self._conn.commit()
+
+    # Cache key of a request and its cached response, None on a miss
+    def lookup(self, user_message, system_message):
+        key = self.cache_key(user_message, system_message)
+        response = self.get(key)
+        with self._lock:
+            if response is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return key, response
+
+    # Generate a response, serving it from the cache when the same request has been answered before
+    def generate_response(self, user_message: str, system_message: str) -> str:
+        key, response = self.lookup(user_message, system_message)
+        if response is not None:
+            return response
+        response = self.llm_client.generate_response(user_message=user_message, system_message=system_message)
+        # Empty answers are usually failures and are asked again next time
+        if response:
+            self.put(key, response)
+        return response
+
+    # Drop entries older than max_age, then the least recently used entries until the cache fits in max_size
+    def evict(self):
+        evicted = 0
+        with self._lock:
+            if self.max_age:
+                cursor = self._conn.execute("DELETE FROM responses WHERE created < ?", (time.time() - self.max_age,))
+                evicted += cursor.rowcount
+            if self.max_size:
+                total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+                if total > self.max_size:
+                    rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed").fetchall()
+                    stale = []
+                    for key, size in rows:
+                        if total <= self.max_size:
+                            break
+                        stale.append((key,))
+                        total -= size
+                    self._conn.executemany("DELETE FROM responses WHERE key = ?", stale)
+                    evicted += len(stale)
+            self._conn.commit()
+            self.evictions += evicted
+        return evicted
+
+    # Hit/miss statistics of this run plus the current size of the cache
+    def stats(self):
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            requests = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / requests if requests else 0.0,
+                "evictions": self.evictions,
+                "entries": entries,
+                "size_bytes": size,
+            }
+
+    def close(self):
+        self.evict()
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,131 @@
+# Import related packages
+import unicodedata
+import threading
+import hashlib
+import sqlite3
+import json
+import os
+
+
+# Name of the deduplication index stored in the save directory
+TRIPLE_INDEX_FILENAME = "triple_index.sqlite"
+
+
+# Version of the keys of the index; an index written with other keys is emptied and rebuilt from the shards
+KEY_VERSION = 2
+# Chinese punctuation NFKC leaves alone, mapped to the ASCII punctuation it stands for
+PUNCTUATION = str.maketrans({"。": ".", "、": ",", "“": '"', "”": '"', "‘": "'", "’": "'", "【": "[", "】": "]", "—": "-", "–": "-"})
+
+
+# Normalize a cell for comparison: NFKC folds full-width characters (，→ ,), equivalent punctuation is mapped,
+# then case is folded and runs of whitespace collapse. Punctuation is kept: 1.5米 and 15米 are different values.
+def normalize(value):
+    text = unicodedata.normalize("NFKC", str(value)).translate(PUNCTUATION).casefold()
+    return " ".join(text.split())
+
+
+# Key of a (head, key1, relationship/attribute, tail, key2) row: two rows with the same key are duplicates
+def triple_key(row):
+    return hashlib.sha1("\x1f".join(normalize(value) for value in row).encode("utf-8")).hexdigest()
+
+
+# Persistent hash index of the triples written to the triple store of a save directory.
+# Only the first occurrence of a triple is kept; the index remembers which source file owns
+# the stored row and how many times every source file produced the triple.
+# A durable=False index (a throwaway one, such as the one of a KGBulkImport export) is written without a journal or fsync.
+class TripleIndex:
+    def __init__(self, output_dir, durable=True):
+        self.path = os.path.join(output_dir, TRIPLE_INDEX_FILENAME)
+        self.added = 0
+        self.duplicates = 0
+        self._lock = threading.Lock()
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        if not durable:
+            self._conn.executescript("PRAGMA journal_mode = OFF; PRAGMA synchronous = OFF;")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS occurrences ("
+            "output TEXT NOT NULL, key TEXT NOT NULL, source TEXT NOT NULL, row TEXT NOT NULL, count INTEGER NOT NULL, "
+            "PRIMARY KEY (output, key, source));"
+            "CREATE TABLE IF NOT EXISTS owners ("
+            "output TEXT NOT NULL, key TEXT NOT NULL, source TEXT NOT NULL, PRIMARY KEY (output, key));"
+            "CREATE INDEX IF NOT EXISTS owners_source ON owners (output, source);"
+        )
+        # The keys of an older normalization no longer match; extract_files reindexes the shards of an empty index
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] != KEY_VERSION:
+            self._conn.execute("DELETE FROM occurrences")
+            self._conn.execute("DELETE FROM owners")
+            self._conn.execute(f"PRAGMA user_version = {KEY_VERSION}")
+        self._conn.commit()
+
+    # Count the rows produced by a source file and return the ones seen for the first time
+    def add(self, output, source, rows):
+        new_rows = []
+        with self._lock:
+            for row in rows:
+                key = triple_key(row)
+                self._conn.execute(
+                    "INSERT INTO occurrences (output, key, source, row, count) VALUES (?, ?, ?, ?, 1) "
+                    "ON CONFLICT (output, key, source) DO UPDATE SET count = count + 1",
+                    (output, key, source, json.dumps(list(row), ensure_ascii=False)),
+                )
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO owners (output, key, source) VALUES (?, ?, ?)", (output, key, source)
+                )
+                if cursor.rowcount:
+                    new_rows.append(list(row))
+            self._conn.commit()
+            self.added += len(new_rows)
+            self.duplicates += len(rows) - len(new_rows)
+        return new_rows
+
+    # Forget the triples of a source file. Triples it owned but other source files also produced are
+    # handed over to one of them; the returned {source: rows} must be appended to their shards.
+    def release(self, output, source):
+        handover = {}
+        with self._lock:
+            owned = [key for (key,) in self._conn.execute(
+                "SELECT key FROM owners WHERE output = ? AND source = ?", (output, source)
+            )]
+            self._conn.execute("DELETE FROM occurrences WHERE output = ? AND source = ?", (output, source))
+            self._conn.execute("DELETE FROM owners WHERE output = ? AND source = ?", (output, source))
+            for key in owned:
+                other = self._conn.execute(
+                    "SELECT source, row FROM occurrences WHERE output = ? AND key = ? ORDER BY source LIMIT 1",
+                    (output, key),
+                ).fetchone()
+                if other:
+                    self._conn.execute("INSERT INTO owners (output, key, source) VALUES (?, ?, ?)", (output, key, other[0]))
+                    handover.setdefault(other[0], []).append(json.loads(other[1]))
+            self._conn.commit()
+        return handover
+
+    def is_empty(self, output):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM owners WHERE output = ? LIMIT 1", (output,)).fetchone() is None
+
+    # How many times a triple (or any of its normalized variants) has been produced
+    def count(self, output, row):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COALESCE(SUM(count), 0) FROM occurrences WHERE output = ? AND key = ?", (output, triple_key(row))
+            ).fetchone()[0]
+
+    # The most frequently produced triples of an output with their counts
+    def most_common(self, output, limit=10):
+        with self._lock:
+            return [(json.loads(row), count) for row, count in self._conn.execute(
+                "SELECT MIN(row), SUM(count) AS seen FROM occurrences WHERE output = ? "
+                "GROUP BY key ORDER BY seen DESC LIMIT ?", (output, limit)
+            )]
+
+    def stats(self):
+        with self._lock:
+            unique = self._conn.execute("SELECT COUNT(*) FROM owners").fetchone()[0]
+            seen = self._conn.execute("SELECT COALESCE(SUM(count), 0) FROM occurrences").fetchone()[0]
+        return {"added": self.added, "duplicates_dropped": self.duplicates, "unique_triples": unique, "triples_seen": seen}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
@@ -1,10 +1,26 @@
 # Import related packages
-from knowledge_graph_builder import EAOntology, EROntology
-from sympy import erf
-import pandas as pd
+from knowledge_graph_builder import EAOntology, EROntology, KnowledgeGraphBuilder, EAEdge, EREdge
+from KGManifest import ExtractionManifest, file_hash, extraction_version
+from KGStore import TripleStore, ER_FILENAME, EA_FILENAME, DEFAULT_SOURCE
+from KGDedup import TripleIndex
+from KGMatcher import OntologyPrefilter, OntologyPruner, estimate_tokens
+from KGMetrics import timed
+from KGJournal import ChunkJournal
+from concurrent.futures import ThreadPoolExecutor, Future
+from collections import deque
+import re
 import os
 
 
+# Number of chunks sent to the LLM at the same time, kept low to stay under the Groq rate limit
+DEFAULT_MAX_WORKERS = 4
+
+# Token budget of a chunk; in our practice tests chunks of 800 to 1200 tokens worked best
+DEFAULT_CHUNK_TOKENS = 1000
+# Sentences end with Chinese or Western end punctuation
+SENTENCE_BOUNDARY = r"(?<=[。；！？;!?])"
+
+
 # Define Entity Relationship Ontology
 def define_ERontology():
     return EROntology(
@@ -68,69 +84,500 @@ def define_EAontology():
         ]
     )
 
-# Load the user input txt
-def load_usertext(inputfile):
+# Words that signal a relationship or an attribute in a chunk, besides its own name (see KGMatcher.OntologyPruner)
+def define_ontology_signals():
+    return {
+        "邻近": ["相邻", "毗邻", "附近", "靠近", "周边", "交错"],
+        "生长": ["生于", "长于", "分布", "生境", "常见于", "栽培"],
+        "别名": ["又名", "又称", "俗称", "别称", "亦称"],
+        "俗名": ["俗称", "土名", "又名"],
+        "优势种": ["优势", "建群"],
+        "伴生种": ["伴生", "混生"],
+        "生活型": ["草本", "灌木", "乔木", "一年生", "二年生", "多年生", "沉水"],
+        "高度": ["株高", "高达", "高约", "米", "厘米"],
+        "盖度": ["覆盖", "%"],
+        "颜色": ["色"],
+        "染色体": ["2n"],
+        "学名": ["拉丁", "Linn", "L."],
+        "果实": ["果", "荚", "颖果"],
+        "种子": ["种皮"],
+        "功效": ["入药", "药用", "清热", "解毒", "止血"],
+        "物候期": ["花期", "果期", "花果期", "开花", "结果"],
+        "用途": ["可作", "可用", "可供", "用于", "饲料", "造纸", "食用", "观赏"],
+        "作用": ["功能", "净化", "调节", "保持", "维护", "防风", "固沙", "护岸"],
+        "生境": ["生于", "分布", "常见于", "湿地", "滩涂", "盐碱"],
+    }
+
+
+# Load the user input txt and pack its lines into chunks of at most max_tokens tokens.
+# With max_tokens=None every non-empty line is its own chunk.
+def load_usertext(inputfile, max_tokens=DEFAULT_CHUNK_TOKENS, overlap_tokens=0):
+    return list(iter_usertext(inputfile, max_tokens, overlap_tokens))
+
+
+# Same as load_usertext, but the file is read lazily and the chunks are yielded one by one.
+# With a positions list, the number of bytes of the file read when each chunk was cut is appended to it.
+def iter_usertext(inputfile, max_tokens=DEFAULT_CHUNK_TOKENS, overlap_tokens=0, positions=None):
+    read = 0
+
+    def lines(file):
+        nonlocal read
+        for line in file:
+            read += len(line.encode('utf-8'))
+            yield line
+
     with open(inputfile, 'r', encoding='utf-8') as file:
-        lines = file.readlines()
-        user_text = ["\n" + line.strip() + "\n" for line in lines if line.strip()]
-    return user_text 
+        if max_tokens is None:
+            chunks = ("\n" + line.strip() + "\n" for line in lines(file) if line.strip())
+        else:
+            chunks = iter_chunks(lines(file), max_tokens, overlap_tokens)
+        for chunk in chunks:
+            if positions is not None:
+                positions.append(read)
+            yield chunk
+
+
+# Split a line into sentences, keeping the Chinese or Western end punctuation with its sentence
+def split_sentences(line):
+    return [sentence for sentence in re.split(SENTENCE_BOUNDARY, line) if sentence.strip()]
+
+
+# Cut a sentence that is longer than the budget into pieces that fit
+def split_long_sentence(sentence, max_tokens):
+    pieces = []
+    piece = ""
+    for char in sentence:
+        if piece and estimate_tokens(piece + char) > max_tokens:
+            pieces.append(piece)
+            piece = ""
+        piece += char
+    if piece:
+        pieces.append(piece)
+    return pieces
+
+
+# Yield the sentences of the lines as (text, tokens, ends its line)
+def iter_sentences(lines, max_tokens):
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        parts = []
+        for sentence in split_sentences(line):
+            parts.extend(split_long_sentence(sentence, max_tokens) if estimate_tokens(sentence) > max_tokens else [sentence])
+        for index, part in enumerate(parts):
+            yield part, estimate_tokens(part), index == len(parts) - 1
+
+
+def format_chunk(sentences):
+    return "\n" + "".join(text + ("\n" if line_end else "") for text, _, line_end in sentences).strip() + "\n"
+
+
+# Pack consecutive lines into chunks of at most max_tokens tokens, only cutting at sentence boundaries
+# (。；！？) unless a single sentence exceeds the budget. The last sentences of a chunk, up to
+# overlap_tokens tokens, are repeated at the start of the next one as far as the budget leaves room for them.
+def iter_chunks(lines, max_tokens=DEFAULT_CHUNK_TOKENS, overlap_tokens=0):
+    current = []
+    tokens = 0
+    for sentence in iter_sentences(lines, max_tokens):
+        if current and tokens + sentence[1] > max_tokens:
+            yield format_chunk(current)
+            # Carry the overlap over, never a whole chunk
+            carried = []
+            carried_tokens = 0
+            for previous in reversed(current[1:]):
+                if carried_tokens + previous[1] > overlap_tokens:
+                    break
+                carried.insert(0, previous)
+                carried_tokens += previous[1]
+            # The overlap gives way to the next sentence: the oldest carried sentences are dropped until both fit
+            while carried and carried_tokens + sentence[1] > max_tokens:
+                carried_tokens -= carried.pop(0)[1]
+            current, tokens = carried, carried_tokens
+        current.append(sentence)
+        tokens += sentence[1]
+    if current:
+        yield format_chunk(current)
+
+
+def chunk_usertext(lines, max_tokens=DEFAULT_CHUNK_TOKENS, overlap_tokens=0):
+    return list(iter_chunks(lines, max_tokens, overlap_tokens))
+
+
+# Builder whose prompt only carries the part of the ontology the chunk plausibly needs
+def pruned_builder(builder, pruner, chunk):
+    if isinstance(builder, JointKnowledgeGraphBuilder):
+        pruned = JointKnowledgeGraphBuilder(pruner.prune(builder.erontology, chunk), pruner.prune(builder.eaontology, chunk), builder.llm_client)
+    else:
+        pruned = KnowledgeGraphBuilder(ontology=pruner.prune(builder.ontology, chunk), llm_client=builder.llm_client)
+    pruner.record(estimate_tokens(builder.format_prompt()), estimate_tokens(pruned.format_prompt()))
+    return pruned
+
+
+# Turn one chunk of user text into a Document and extract its subgraph
+def chunk_to_subgraph(builder, chunk, sequence):
+    doc = next(builder.create_docs([chunk]))
+    return builder.document_to_subgraph(doc, sequence)
+
+
+# Send the chunks to the LLM with a bounded worker pool and merge the subgraphs in the original chunk order.
+# A failed chunk is recorded as (chunk index, error) instead of aborting the whole file.
+# With an OntologyPrefilter, chunks that mention no ontology entity are not sent at all.
+def documents_to_graph_concurrent(builder, user_text, max_workers=DEFAULT_MAX_WORKERS, prefilter=None):
+    graph = []
+    failures = []
+    for index, subgraph, error in stream_subgraphs(builder, user_text, max_workers, prefilter):
+        if error is not None:
+            failures.append((index, error))
+        else:
+            graph.extend(subgraph)
+    return graph, failures
+
+
+def chunk_result(index, future):
+    try:
+        return index, future.result(), None
+    except Exception as e:
+        return index, [], e
+
 
+# Streaming form of documents_to_graph_concurrent: chunks are pulled lazily from user_text, at most
+# max_pending of them are in flight, and (chunk index, subgraph, error) is yielded in chunk order as
+# soon as each chunk completes. The caller writes earlier results while later chunks are being extracted.
+# With a runner (KGAsync.AsyncRunner) the chunks are extracted on its event loop instead of a thread pool.
+# completed maps the index of chunks already extracted (KGJournal.ChunkJournal) to their subgraph; they are yielded in place.
+# With a KGMatcher.OntologyPruner, every chunk is sent with the part of the ontology it plausibly needs.
+def stream_subgraphs(builder, user_text, max_workers=DEFAULT_MAX_WORKERS, prefilter=None, max_pending=None, runner=None, completed=None, pruner=None):
+    chunk_builder = (lambda chunk: pruned_builder(builder, pruner, chunk)) if pruner else (lambda chunk: builder)
+    if runner is not None:
+        yield from ordered_results(lambda chunk, index: runner.submit(chunk_builder(chunk), chunk, index), user_text, builder, prefilter,
+                                   max_pending or runner.max_in_flight, completed)
+        return
+    max_workers = max(1, max_workers)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        yield from ordered_results(lambda chunk, index: executor.submit(chunk_to_subgraph, chunk_builder(chunk), chunk, index), user_text, builder, prefilter,
+                                   max_pending or 2 * max_workers, completed)
 
-def export_to_directory(graph, ontology, output_dir):
+
+def completed_future(subgraph):
+    future = Future()
+    future.set_result(subgraph)
+    return future
+
+
+# Submit the chunks that pass the pre-filter and yield their results in chunk order, keeping at most max_pending futures
+def ordered_results(submit, user_text, builder, prefilter, max_pending, completed=None):
+    system_tokens = estimate_tokens(builder.format_prompt()) if prefilter else 0
+    pending = deque()
+    for index, chunk in enumerate(user_text):
+        if completed and index in completed:
+            pending.append((index, completed_future(completed[index])))
+        # A skipped chunk saves the extraction call and the summary call of create_docs
+        elif prefilter and not prefilter.keep(chunk, system_tokens + 2 * estimate_tokens(chunk)):
+            continue
+        else:
+            pending.append((index, submit(chunk, index)))
+        if len(pending) >= max_pending:
+            yield chunk_result(*pending.popleft())
+    while pending:
+        yield chunk_result(*pending.popleft())
+
+
+# Knowledge Graph Builder that extracts entity relationship triples and entity attribute triples in a single LLM call
+class JointKnowledgeGraphBuilder(KnowledgeGraphBuilder):
+    def __init__(self, erontology, eaontology, llm_client):
+        super().__init__(ontology=erontology, llm_client=llm_client)
+        self.erontology = erontology
+        self.eaontology = eaontology
+
+    # Both ontologies share their entity lists, so each entity is only sent to the LLM once
+    def joint_ontology(self):
+        entities = []
+        for entity in self.erontology.entities + self.eaontology.entities:
+            if entity not in entities:
+                entities.append(entity)
+        return {
+            "entities": entities,
+            "relationships": self.erontology.relationships,
+            "attributes": self.eaontology.attributes,
+        }
+
+    # Names of the entity types that may carry attributes
+    def attribute_entity_types(self):
+        types = []
+        for entity in self.eaontology.entities:
+            types.extend(entity.keys() if isinstance(entity, dict) else [entity])
+        return types
+
+    # System Tips for Formatting Joint Entity Relation and Entity Attribute Triple Extraction
+    def format_prompt(self) -> str:
+        return (
+            "You are an expert at creating Knowledge Graphs. "
+            "Consider the following ontology. \n"
+            f"{self.joint_ontology()} \n"
+            "The user will provide you with an input text delimited by ```. "
+            "Extract from the user-provided text, as per the given ontology, both the relationships between entities and the attributes possessed by entities. Do not use any previous knowledge about the context. "
+            "Be consistent with the given ontology. Use ONLY the entities, relationships and attributes mentioned in the ontology. "
+            f"Attributes may only be extracted for entities of the types {self.attribute_entity_types()}. "
+            "If the same entity and attribute has multiple attribute values, these multiple different attribute values are combined into one string. "
+            "Format your output as a json with the following schema. \n"
+            "{\n"
+            '   "relationships": [\n'
+            "       {\n"
+            '           node_1: Required, an entity object with attributes: {"entity": "According to the type field of the entities list defined in the ontology", "name": "Name of the entity"},\n'
+            '           node_2: Required, an entity object with attributes: {"entity": "According to the type field of the entities list defined in the ontology", "name": "Name of the entity"},\n'
+            "           relationship: Required, the relationship type between node_1 and node_2 defined in the relationships list of the ontology.\n"
+            "       },\n"
+            "   ],\n"
+            '   "attributes": [\n'
+            "       {\n"
+            '           node_1: Required, an entity object with attributes: {"entity": "According to the type field of the entities list defined in the ontology", "name": "Name of the entity"},\n'
+            '           node_2: Required, {"attribute": "According to the type field of the attributes list defined in the ontology", "name": "The value of the attribute"},\n'
+            "           relationship: Required, the attribute of the node_1 node as defined in the attributes list of the ontology.\n"
+            "       },\n"
+            "   ]\n"
+            "}\n"
+            "Do not add any other comment before or after the json. Respond ONLY with a well formed json that can be directly read by a program."
+        )
+
+    # Convert the generated JSON to an entity relationship edge or an entity attribute edge
+    def data_to_edge(self, edge_data):
+        try:
+            if "attribute" in edge_data.get("node_2", {}):
+                return EAEdge(**edge_data)
+            return EREdge(**edge_data)
+        except Exception as e:
+            self.log("ERROR", f"Edge parsing failed: {e}, Invalid edge data: {edge_data}")
+            return None
+
+    # Accept both the {"relationships": [...], "attributes": [...]} answer and a flat list of edges
+    def extract_valid_edges(self, jsondata):
+        if isinstance(jsondata, dict):
+            jsondata = jsondata.get("relationships", []) + jsondata.get("attributes", [])
+        return super().extract_valid_edges(jsondata or [])
+
+
+# Split a graph produced by JointKnowledgeGraphBuilder into its entity relationship and entity attribute edges
+def split_joint_graph(graph):
+    ER_graph = [edge for edge in graph if isinstance(edge, EREdge)]
+    EA_graph = [edge for edge in graph if isinstance(edge, EAEdge)]
+    return ER_graph, EA_graph
+
+
+# Append the triples of a graph to the shard of its source file in the triple store of output_dir.
+# The ERTriples.xlsx / EATriples.xlsx workbooks are written from the store by materialize_to_excel.
+# With a TripleIndex, triples that were already exported (from any file or run) are dropped.
+def export_to_directory(graph, ontology, output_dir, source=DEFAULT_SOURCE, index=None):
     
     if not os.path.exists(output_dir):
         os.makedirs(output_dir)
     
-    # Define file the name
-    ER_filename = "ERTriples.xlsx"
-    EA_filename = "EATriples.xlsx"
-    
-    # Build a complete file path
-    ER_outputfile = os.path.join(output_dir, ER_filename)
-    EA_outputfile = os.path.join(output_dir, EA_filename)
-    
-    # Extracting Entity Relationship Triples
-    ER_extracted_data = [
-        [edge.node_1.entity, edge.node_1.name, edge.node_2.entity, edge.node_2.name, edge.relationship]
-        for edge in graph
-        if isinstance(ontology, EROntology)  
-    ]
-    # Extracting Entity Attribute Triples
-    EA_extracted_data = [
-        [edge.node_1.entity, edge.node_1.name, edge.node_2.attribute, edge.node_2.name, edge.relationship]
-        for edge in graph
-        if isinstance(ontology, EAOntology)  
-    ]
-    
-    # Write Entity Relationship Triples to Excel
-    if ER_extracted_data:
-        ER_df = pd.DataFrame(ER_extracted_data, columns=['head', 'key1', 'tail', 'key2', 'relationship'])
-        ER_df = ER_df[['head', 'key1', 'relationship', 'tail', 'key2']]
-        ER_fileexists = os.path.isfile(ER_outputfile)
-        if not ER_fileexists:
-            ER_df.to_excel(ER_outputfile, index=False)
-        else:
-            with pd.ExcelWriter(ER_outputfile, mode='a', if_sheet_exists='overlay') as writer:
-                existing_df_er = pd.read_excel(ER_outputfile)
-                combined_df_er = pd.concat([existing_df_er, ER_df], ignore_index=True)
-                combined_df_er.to_excel(writer, index=False)
-    
-    # Write Entity Attribute Triples to Excel
-    if EA_extracted_data:
-        EA_df = pd.DataFrame(EA_extracted_data, columns=['head', 'key1', 'tail', 'key2', 'attribute'])
-        EA_df = EA_df[['head', 'key1', 'attribute', 'tail', 'key2']]
-        EA_fileexists = os.path.isfile(EA_outputfile)
-        if not EA_fileexists:
-            EA_df.to_excel(EA_outputfile, index=False)
-        else:
-            with pd.ExcelWriter(EA_outputfile, mode='a', if_sheet_exists='overlay') as writer:
-                existing_df_ea = pd.read_excel(EA_outputfile)
-                combined_df_ea = pd.concat([existing_df_ea, EA_df], ignore_index=True)
-                combined_df_ea.to_excel(writer, index=False)
+    # Triples in the column order head, key1, relationship/attribute, tail, key2
+    if isinstance(ontology, EROntology):
+        extracted_data = [[edge.node_1.entity, edge.node_1.name, edge.relationship, edge.node_2.entity, edge.node_2.name] for edge in graph]
+    else:
+        extracted_data = [[edge.node_1.entity, edge.node_1.name, edge.relationship, edge.node_2.attribute, edge.node_2.name] for edge in graph]
+    if index:
+        extracted_data = index.add(output_filename(ontology), source, extracted_data)
+    # Number of triples appended to the store
+    return TripleStore(output_dir).append(output_filename(ontology), source, extracted_data)
+
+
+# Write ERTriples.xlsx / EATriples.xlsx once from the triple store, in the order the manifest extracted the files
+def materialize_to_excel(output_dir, outputs=(ER_FILENAME, EA_FILENAME)):
+    store = TripleStore(output_dir)
+    manifest = ExtractionManifest(output_dir)
+    return {output: store.materialize(output, manifest.filenames(output)) for output in outputs}
+
+
+# Name of the file the triples of an ontology are exported to
+def output_filename(ontology):
+    return ER_FILENAME if isinstance(ontology, EROntology) else EA_FILENAME
+
+
+# Drop the triples a previous run extracted from filename and forget the file in the manifest.
+# Triples other files also produced are handed over to the shards of those files.
+def drop_file_triples(manifest, store, output, filename, index=None):
+    store.remove(output, filename)
+    manifest.forget(output, filename)
+    if index:
+        for source, rows in index.release(output, filename).items():
+            store.append(output, source, rows)
+
+
+# Extract the triples of every .txt file in the input directory and export them to save_path.
+# Files whose triples in save_path are still current (same content, ontology and model) are skipped,
+# and the stale triples of changed or deleted files are dropped from the outputs first.
+# Triples already exported from another file or run are dropped by the deduplication index.
+# With prefilter, chunks that mention none of the ontology entities are skipped without calling the LLM,
+# and with prune every chunk is sent with all the entity types but only the relationships and attributes it plausibly needs.
+# Lines are packed into chunks of chunk_tokens tokens, overlapping by chunk_overlap tokens (None: one chunk per line).
+# With a runner (KGAsync.AsyncRunner) the LLM calls are made from its event loop instead of max_workers threads.
+# progress(label, done, total) is called after every chunk with the bytes of the input files extracted so far.
+# With a KGMetrics.RunMetrics, the export and materialize times and the chunk and triple counts are recorded.
+# only limits the extraction to the listed files; without materialize the workbooks are not written (KGShard merges them).
+# Without dedup, every file keeps all the triples it produced (KGShard workers: the merge deduplicates across workers).
+# cancelled(filename) tells whether a file is no longer wanted (a KGShard worker lost its lease on it): the file is
+# left before its next chunk is exported and is not recorded as extracted.
+# Returns the statistics of the run: files extracted, skipped and deleted, failed chunks and files, and rows written.
+def extract_directory(builder, inputdir_path, save_path, log=print, max_workers=DEFAULT_MAX_WORKERS, label="Knowledge graph", prefilter=True,
+                      chunk_tokens=DEFAULT_CHUNK_TOKENS, chunk_overlap=0, runner=None, progress=None, metrics=None, only=None, materialize=True,
+                      prune=False, dedup=True, cancelled=None):
+    joint = isinstance(builder, JointKnowledgeGraphBuilder)
+    ontologies = [builder.erontology, builder.eaontology] if joint else [builder.ontology]
+    chunk_filter = OntologyPrefilter(*ontologies) if prefilter else None
+    pruner = OntologyPruner(define_ontology_signals()) if prune else None
+    chunking = {"chunk_tokens": chunk_tokens, "chunk_overlap": chunk_overlap}
+    if not save_path or not dedup:
+        summary = extract_files(builder, ontologies, inputdir_path, save_path, ExtractionManifest(save_path) if save_path else None, None, log, max_workers, label, chunk_filter, chunking, runner, progress, metrics, only, materialize,
+                                pruner, cancelled)
+    else:
+        triple_index = TripleIndex(save_path)
+        try:
+            summary = extract_files(builder, ontologies, inputdir_path, save_path, ExtractionManifest(save_path), triple_index, log, max_workers, label, chunk_filter, chunking, runner, progress, metrics,
+                                    only, materialize, pruner, cancelled)
+            summary["deduplication"] = triple_index.stats()
+            log(f"Triple deduplication statistics: {summary['deduplication']}")
+        finally:
+            triple_index.close()
+    if chunk_filter:
+        stats = summary["prefilter"] = chunk_filter.stats()
+        log(f"Pre-filter skipped {stats['skipped_chunks']} of {stats['total_chunks']} chunks without ontology entities, saving about {stats['tokens_saved']} prompt tokens.")
+    if pruner:
+        stats = summary["pruning"] = pruner.stats()
+        if metrics:
+            metrics.count("prompt_tokens_saved", stats["tokens_saved"])
+        log(f"Ontology pruning sent {stats['prompt_tokens_sent']} instead of {stats['prompt_tokens_full']} system prompt tokens over {stats['chunks']} chunks, "
+            f"saving about {stats['tokens_saved']} prompt tokens ({stats['saved_ratio']:.0%}).")
+    return summary
+
+
+def extract_files(builder, ontologies, inputdir_path, save_path, manifest, triple_index, log, max_workers, label, chunk_filter, chunking, runner, progress, metrics,
+                  only=None, materialize=True, pruner=None, cancelled=None):
+    joint = isinstance(builder, JointKnowledgeGraphBuilder)
+    filenames = sorted(filename for filename in os.listdir(inputdir_path) if filename.endswith(".txt"))
+    # only restricts the extraction to some files of the directory (the files claimed by a KGShard worker);
+    # the triples of the other files are kept unless the files were deleted
+    selected = filenames
+    if only is not None:
+        only = set(only)
+        selected = [filename for filename in filenames if filename in only]
+    # Pruning changes the prompt of every call and turning the pre-filter off sends the chunks it skipped, so both are part
+    # of the version; with the defaults (pre-filter on, no pruning) the version of earlier runs is unchanged
+    version = extraction_version(builder, **chunking, **({"prune": True} if pruner else {}), **({} if chunk_filter else {"prefilter": False}))
+    store = TripleStore(save_path) if save_path else None
+    # Chunks are journaled before their triples are exported, so a run that stops partway through a file resumes after its last chunk
+    journal = ChunkJournal(save_path, version, [output_filename(ontology) for ontology in ontologies]) if manifest else None
+    changed = False
+    deleted = set()
+    summary = {"files": len(selected), "extracted": 0, "skipped": 0, "deleted": 0, "failed_chunks": 0, "resumed_chunks": 0, "failed_files": [], "cancelled_files": [],
+               "rows": {output_filename(ontology): 0 for ontology in ontologies}}
+
+    if manifest:
+        for ontology in ontologies:
+            output = output_filename(ontology)
+            extracted = manifest.filenames(output)
+            # Workbooks written before the triple store existed are split into shards once (the store keeps a marker),
+            # and shards written before the deduplication index existed are indexed once
+            store.import_workbook(output, [(filename, manifest.entry(output, filename)["rows"]) for filename in extracted], triple_index)
+            if triple_index and triple_index.is_empty(output) and store.has_shards(output):
+                store.reindex(output, triple_index, extracted)
+                changed = True
+            for filename in extracted:
+                if filename not in filenames:
+                    drop_file_triples(manifest, store, output, filename, triple_index)
+                    changed = True
+                    deleted.add(filename)
+                    log(f"Dropped the {output} triples of deleted file {filename}")
+        manifest.save()
+        summary["deleted"] = len(deleted)
 
-            
+    pending = []
+    hashes = {}
+    for filename in selected:
+        input_file = os.path.join(inputdir_path, filename)
+        content_hash = hashes[filename] = file_hash(input_file)
+        if manifest and all(manifest.is_current(output_filename(ontology), filename, content_hash, version) for ontology in ontologies):
+            log(f"{filename} has not changed since the last extraction, skipped.")
+            summary["skipped"] += 1
+            continue
+        # The progress is measured in bytes read, so the files are not chunked twice to count their chunks
+        pending.append((filename, input_file, content_hash, os.path.getsize(input_file)))
 
-            
+    done = 0
+    total = sum(size for *_, size in pending)
+    if progress:
+        progress(label, done, total)
+    for filename, input_file, content_hash, size in pending:
+        if cancelled and cancelled(filename):
+            done += size
+            summary["cancelled_files"].append(filename)
+            log(f"Skipped {filename}, it is no longer needed")
+            continue
 
+        # Stale triples go first, then the triples of every chunk are written as soon as it completes
+        if manifest:
+            for ontology in ontologies:
+                drop_file_triples(manifest, store, output_filename(ontology), filename, triple_index)
+        rows = {output_filename(ontology): 0 for ontology in ontologies}
+        failures = 0
+        journaled = journal.chunks(filename, content_hash) if journal else {}
+        if journaled:
+            log(f"Resuming {filename}: {len(journaled)} chunks are replayed from the journal")
+            summary["resumed_chunks"] += len(journaled)
+        # Bytes of the file read when each chunk was cut
+        positions = []
+        user_text = iter_usertext(input_file, chunking["chunk_tokens"], chunking["chunk_overlap"], positions)
+        for index, subgraph, error in stream_subgraphs(builder, user_text, max_workers, chunk_filter, runner=runner, completed=journaled, pruner=pruner):
+            if cancelled and cancelled(filename):
+                break
+            # Results come in chunk order, so every chunk up to this one is done, skipped ones included
+            if progress:
+                progress(label, done + positions[index], total)
+            if metrics:
+                metrics.count("chunks_failed" if error is not None else "chunks_resumed" if index in journaled else "chunks_extracted")
+            if error is not None:
+                failures += 1
+                log(f"Failed to extract chunk {index + 1} of {filename}: {error}")
+                continue
+            for item in subgraph:
+                log(str(item))
+            if journal and index not in journaled:
+                journal.append(filename, content_hash, index, subgraph)
+            if manifest:
+                graphs = split_joint_graph(subgraph) if joint else [subgraph]
+                for ontology, part in zip(ontologies, graphs):
+                    with timed(metrics, "export"):
+                        written = export_to_directory(part, ontology, save_path, filename, triple_index)
+                    rows[output_filename(ontology)] += written
+                    if metrics:
+                        metrics.count("triples_written", written)
 
+        done += size
+        if progress:
+            progress(label, done, total)
+        if cancelled and cancelled(filename):
+            summary["cancelled_files"].append(filename)
+            log(f"Stopped extracting {filename}, it is no longer needed")
+            continue
+        summary["extracted"] += 1
+        summary["failed_chunks"] += failures
+        if failures:
+            summary["failed_files"].append(filename)
+        if not manifest:
+            log("The save path is not selected, please select the save path.")
+            continue
+        for output, count in rows.items():
+            summary["rows"][output] += count
+            # Files with failed chunks are extracted again on the next run
+            manifest.record(output, filename, content_hash, version, count, complete=not failures)
+        manifest.save()
+        changed = True
+        log(f"{label} triples have been extracted from {filename} to {save_path}")
 
+    if journal:
+        journal.compact(manifest, filenames, hashes)
+    if manifest and materialize and (changed or not all(os.path.isfile(os.path.join(save_path, output_filename(ontology))) for ontology in ontologies)):
+        with timed(metrics, "materialize"):
+            materialize_to_excel(save_path, [output_filename(ontology) for ontology in ontologies])
+    return summary
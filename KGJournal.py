@@ -0,0 +1,151 @@
+# Import related packages
+from knowledge_graph_builder import EAEdge, EREdge
+from KGManifest import file_hash
+import json
+import os
+
+
+# Write-ahead journal of the extracted chunks, stored in the save directory
+CHUNK_JOURNAL_FILENAME = "chunk_journal.jsonl"
+# Batches committed to Neo4j by an unfinished load, stored in the directory of the workbooks
+LOAD_JOURNAL_FILENAME = "load_journal.json"
+
+
+def edge_to_record(edge):
+    return {"kind": "EA" if isinstance(edge, EAEdge) else "ER", **edge.model_dump()}
+
+
+def record_to_edge(record):
+    record = dict(record)
+    return (EAEdge if record.pop("kind") == "EA" else EREdge)(**record)
+
+
+# Append-only journal of the subgraph of every chunk extracted from a file, written (and fsynced) before the
+# triples are exported. When a run stops partway through a file, the next run replays the journaled chunks
+# of that file instead of sending them to the LLM again and only extracts the chunks that are missing.
+# Records name the extraction version and the content hash of the file, so a journal never replays the
+# chunks of another ontology, model, chunking or file content. Records of completed, deleted or changed files
+# and of older versions are compacted away.
+class ChunkJournal:
+    def __init__(self, output_dir, version, outputs, fsync=True):
+        self.path = os.path.join(output_dir, CHUNK_JOURNAL_FILENAME)
+        self.version = version
+        self.outputs = list(outputs)
+        self.fsync = fsync
+        self.appended = 0
+        self.replayed = 0
+        self._file = None
+        # {(file, sha256): {chunk index: edge records}} of this version, read once on the first lookup
+        self._index = None
+
+    # Journaled chunks of a file: {chunk index: subgraph}. The journal is read once per run, not once per file;
+    # the records a run appends are not looked up again, since each file is extracted once per run.
+    def chunks(self, filename, content_hash):
+        if self._index is None:
+            self._index = {}
+            for record in self.records():
+                if record["version"] == self.version:
+                    self._index.setdefault((record["file"], record["sha256"]), {})[record["chunk"]] = record["edges"]
+        records = self._index.pop((filename, content_hash), {})
+        chunks = {chunk: [record_to_edge(edge) for edge in edges] for chunk, edges in records.items()}
+        self.replayed += len(chunks)
+        return chunks
+
+    def records(self):
+        if not os.path.isfile(self.path):
+            return
+        with open(self.path, "r", encoding="utf-8") as file:
+            for line in file:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    # The last line of a journal cut off by a crash
+                    continue
+
+    def append(self, filename, content_hash, chunk, subgraph):
+        if self._file is None:
+            self._file = open(self.path, "a", encoding="utf-8")
+        record = {"version": self.version, "outputs": self.outputs, "file": filename, "sha256": content_hash, "chunk": chunk,
+                  "edges": [edge_to_record(edge) for edge in subgraph]}
+        self._file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self.appended += 1
+
+    # Drop the records of the files the manifest holds as complete, of any pass, and the records that can never be
+    # replayed again: those of deleted files (not in filenames), of changed files (content hash not in hashes, which maps
+    # the files hashed by this run to their hash) and of an older extraction version of this pass
+    def compact(self, manifest, filenames, hashes):
+        self.close()
+        if not os.path.isfile(self.path):
+            return
+        filenames = set(filenames)
+        temp_path = self.path + ".tmp"
+        kept = 0
+        with open(temp_path, "w", encoding="utf-8") as file:
+            for record in self.records():
+                stale = (record["file"] not in filenames or hashes.get(record["file"], record["sha256"]) != record["sha256"]
+                         or (record["version"] != self.version and not set(record["outputs"]).isdisjoint(self.outputs)))
+                entry_current = all(manifest.is_current(output, record["file"], record["sha256"], record["version"]) for output in record["outputs"])
+                if not stale and not entry_current:
+                    file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    kept += 1
+        if kept:
+            os.replace(temp_path, self.path)
+        else:
+            os.remove(temp_path)
+            os.remove(self.path)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self):
+        return {"appended": self.appended, "replayed": self.replayed}
+
+
+# Journal of a Neo4j load: for every workbook, the rows read up to the last committed batch. A load that
+# stops partway resumes after that batch; the journal is removed once every workbook has been loaded.
+# It is bound to the database URI, so loading the same workbooks into another database starts over.
+class LoadJournal:
+    def __init__(self, directory, uri):
+        self.path = os.path.join(directory, LOAD_JOURNAL_FILENAME)
+        self.directory = directory
+        self.uri = uri
+        self.workbooks = {}
+        self.hashes = {}
+        if os.path.isfile(self.path):
+            with open(self.path, "r", encoding="utf-8") as file:
+                journal = json.load(file)
+            if journal.get("uri") == uri:
+                self.workbooks = journal.get("workbooks", {})
+
+    def content_hash(self, name):
+        if name not in self.hashes:
+            self.hashes[name] = file_hash(os.path.join(self.directory, os.path.basename(name)))
+        return self.hashes[name]
+
+    # Rows of a workbook already committed by an earlier run
+    def committed(self, name):
+        entry = self.workbooks.get(os.path.basename(name))
+        if entry and entry["sha256"] == self.content_hash(name):
+            return entry["rows"]
+        return 0
+
+    def commit(self, name, rows):
+        self.workbooks[os.path.basename(name)] = {"sha256": self.content_hash(name), "rows": rows}
+        self.save()
+
+    # Write to a temporary file first so that a crash never leaves a truncated journal behind
+    def save(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump({"uri": self.uri, "workbooks": self.workbooks}, file, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
+
+    def clear(self):
+        self.workbooks = {}
+        if os.path.isfile(self.path):
+            os.remove(self.path)
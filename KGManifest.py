@@ -0,0 +1,69 @@
+# Import related packages
+from KGCache import llm_settings
+import hashlib
+import json
+import os
+
+
+# Name of the manifest stored in the save directory
+MANIFEST_FILENAME = "manifest.json"
+
+
+# Content hash of an input file
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Version of the extraction: the system prompt carries the ontology and the extraction mode, the settings carry the model,
+# and options such as the chunking change which text each call sees
+def extraction_version(builder, **options):
+    payload = json.dumps(
+        {"prompt": builder.format_prompt(), **llm_settings(builder.llm_client), **options},
+        ensure_ascii=False, sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# Records which input files have been extracted into each output file of a save directory,
+# with their content hash, the extraction version and the number of rows they contributed.
+# Files are kept in the order their rows were appended to the output file.
+class ExtractionManifest:
+    def __init__(self, output_dir):
+        self.path = os.path.join(output_dir, MANIFEST_FILENAME)
+        self.outputs = {}
+        if os.path.isfile(self.path):
+            with open(self.path, 'r', encoding='utf-8') as file:
+                self.outputs = json.load(file).get("outputs", {})
+
+    def entry(self, output, filename):
+        return self.outputs.get(output, {}).get(filename)
+
+    def filenames(self, output):
+        return list(self.outputs.get(output, {}))
+
+    # A file is current when it was fully extracted from the same content with the same ontology and model
+    def is_current(self, output, filename, content_hash, version):
+        entry = self.entry(output, filename)
+        return bool(entry) and entry["complete"] and entry["sha256"] == content_hash and entry["version"] == version
+
+    def record(self, output, filename, content_hash, version, rows, complete=True):
+        self.outputs.setdefault(output, {})[filename] = {
+            "sha256": content_hash,
+            "version": version,
+            "rows": rows,
+            "complete": complete,
+        }
+
+    def forget(self, output, filename):
+        self.outputs.get(output, {}).pop(filename, None)
+
+    # Write to a temporary file first so that a crash never leaves a truncated manifest behind
+    def save(self):
+        temp_path = self.path + ".tmp"
+        with open(temp_path, 'w', encoding='utf-8') as file:
+            json.dump({"outputs": self.outputs}, file, ensure_ascii=False, indent=2)
+        os.replace(temp_path, self.path)
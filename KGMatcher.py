@@ -0,0 +1,199 @@
+# Import related packages
+from collections import deque
+import unicodedata
+import threading
+import re
+
+
+# Separators between the examples of an ontology entry, e.g. "滨麦，秋英" or "海水, 潮沟"
+EXAMPLE_SEPARATORS = r"[,，、;；\s]+"
+
+
+# Characters and case are folded the same way for terms and text, so full-width variants still match
+def fold(text):
+    return unicodedata.normalize("NFKC", text).casefold()
+
+
+# Rough token count of a text: one token per CJK character and about four characters per token otherwise
+def estimate_tokens(text):
+    cjk = sum(1 for char in text if "⺀" <= char <= "鿿" or "豈" <= char <= "﫿")
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+# Terms of the entity lists of an ontology, mapped to their entity type: the type names and their examples.
+# Single-character type names (科, 属, 目, 界, ...) are left out: they occur in ordinary words such as 目前 or 各界,
+# and their examples (菊科, 蓼属, 植物界) already match the chunks that name a taxon.
+def ontology_terms(ontology):
+    terms = {}
+    for entity in ontology.entities:
+        if isinstance(entity, dict):
+            for entity_type, examples in entity.items():
+                if len(entity_type) > 1:
+                    terms.setdefault(entity_type, entity_type)
+                for example in re.split(EXAMPLE_SEPARATORS, str(examples)):
+                    if example:
+                        terms.setdefault(example, entity_type)
+        elif len(entity) > 1:
+            terms.setdefault(entity, entity)
+    return terms
+
+
+# Aho-Corasick automaton: finds every occurrence of a set of terms in one linear scan of the text
+class AhoCorasick:
+    def __init__(self, terms):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+        for term, payload in terms.items():
+            self.add(fold(term), (term, payload))
+        self.build()
+
+    def add(self, term, value):
+        if not term:
+            return
+        state = 0
+        for char in term:
+            if char not in self.goto[state]:
+                self.goto.append({})
+                self.fail.append(0)
+                self.output.append([])
+                self.goto[state][char] = len(self.goto) - 1
+            state = self.goto[state][char]
+        self.output[state].append(value)
+
+    # Breadth-first construction of the failure links
+    def build(self):
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fail = self.fail[state]
+                while fail and char not in self.goto[fail]:
+                    fail = self.fail[fail]
+                self.fail[next_state] = self.goto[fail].get(char, 0)
+                self.output[next_state] = self.output[next_state] + self.output[self.fail[next_state]]
+
+    # Yield the (term, payload) of every match in the text
+    def iter_matches(self, text):
+        state = 0
+        for char in fold(text):
+            while state and char not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(char, 0)
+            yield from self.output[state]
+
+    def search(self, text):
+        return next(self.iter_matches(text), None) is not None
+
+    def find_all(self, text):
+        return set(self.iter_matches(text))
+
+
+# Skips the chunks that mention none of the entities of the ontologies before they are sent to the LLM
+class OntologyPrefilter:
+    def __init__(self, *ontologies):
+        terms = {}
+        for ontology in ontologies:
+            for term, entity_type in ontology_terms(ontology).items():
+                terms.setdefault(term, entity_type)
+        self.matcher = AhoCorasick(terms)
+        self.total_chunks = 0
+        self.skipped_chunks = 0
+        self.tokens_saved = 0
+
+    # Decide whether a chunk is sent to the LLM; prompt_tokens is what a skipped chunk would have cost
+    def keep(self, chunk, prompt_tokens=0):
+        self.total_chunks += 1
+        if self.matcher.search(chunk):
+            return True
+        self.skipped_chunks += 1
+        self.tokens_saved += prompt_tokens
+        return False
+
+    def stats(self):
+        return {
+            "total_chunks": self.total_chunks,
+            "skipped_chunks": self.skipped_chunks,
+            "tokens_saved": self.tokens_saved,
+        }
+
+
+# Name of an entry of an ontology list: the key of {"植物": "红树,芦苇"} or the string itself
+def entry_name(entry):
+    return next(iter(entry)) if isinstance(entry, dict) else entry
+
+
+# Builds, for every chunk, an ontology reduced to the relationships and attributes the chunk plausibly mentions.
+# Every entity type is kept: an entity the chunk names without using its type name or a listed example
+# (滩涂 in 潮间带) must still be typed. A relationship or attribute is kept when its name or one of its signal
+# words appears in the chunk (signals maps a name to words such as "又名" for 别名 or "花期" for 物候期); a
+# relationship named after an entity type the chunk mentions (科, 属, ...) is kept with it. When nothing of a
+# list matches, the whole list is kept rather than guessing.
+# max_examples limits the examples sent per entity type, the ones found in the chunk first.
+class OntologyPruner:
+    def __init__(self, signals=None, max_examples=None):
+        self.signals = signals or {}
+        self.max_examples = max_examples
+        self.matchers = {}
+        self.chunks = 0
+        self.full_tokens = 0
+        self.pruned_tokens = 0
+        self._lock = threading.Lock()
+
+    # One automaton per ontology over its entity terms and the signals of its relationships or attributes
+    def matcher(self, ontology):
+        key = id(ontology)
+        if key not in self.matchers:
+            terms = {}
+            for term, entity_type in ontology_terms(ontology).items():
+                terms.setdefault(term, []).append(("entity", entity_type))
+            for kind in ("relationships", "attributes"):
+                for entry in getattr(ontology, kind, []):
+                    name = entry_name(entry)
+                    for signal in [name] + list(self.signals.get(name, [])):
+                        terms.setdefault(signal, []).append((kind, name))
+            self.matchers[key] = (ontology, AhoCorasick(terms))
+        return self.matchers[key][1]
+
+    def prune(self, ontology, chunk):
+        found = {}
+        for term, payloads in self.matcher(ontology).iter_matches(chunk):
+            for kind, name in payloads:
+                found.setdefault(kind, {}).setdefault(name, set()).add(term)
+        entity_types = found.get("entity", {})
+        fields = {"entities": [self.prune_examples(entry, entity_types.get(entry_name(entry), set())) for entry in ontology.entities]}
+        if hasattr(ontology, "relationships"):
+            kept = found.get("relationships", {})
+            relationships = [name for name in ontology.relationships if name in kept or name in entity_types]
+            fields["relationships"] = relationships or list(ontology.relationships)
+        if hasattr(ontology, "attributes"):
+            kept = found.get("attributes", {})
+            attributes = [entry for entry in ontology.attributes if entry_name(entry) in kept]
+            fields["attributes"] = attributes or list(ontology.attributes)
+        return type(ontology)(**fields)
+
+    def prune_examples(self, entry, terms):
+        if self.max_examples is None or not isinstance(entry, dict):
+            return entry
+        entity_type, examples = next(iter(entry.items()))
+        examples = [example for example in re.split(EXAMPLE_SEPARATORS, str(examples)) if example]
+        ordered = [example for example in examples if example in terms] + [example for example in examples if example not in terms]
+        return {entity_type: ",".join(ordered[:max(self.max_examples, len(terms))])}
+
+    # Prompt tokens of one call with the full and with the pruned ontology
+    def record(self, full_tokens, pruned_tokens):
+        with self._lock:
+            self.chunks += 1
+            self.full_tokens += full_tokens
+            self.pruned_tokens += pruned_tokens
+
+    def stats(self):
+        saved = self.full_tokens - self.pruned_tokens
+        return {
+            "chunks": self.chunks,
+            "prompt_tokens_full": self.full_tokens,
+            "prompt_tokens_sent": self.pruned_tokens,
+            "tokens_saved": saved,
+            "saved_ratio": round(saved / self.full_tokens, 3) if self.full_tokens else 0.0,
+        }
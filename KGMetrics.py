@@ -0,0 +1,182 @@
+# Import related packages
+from knowledge_graph_builder import LLMClient
+from KGMatcher import estimate_tokens
+from contextlib import contextmanager, nullcontext
+import threading
+import json
+import time
+import os
+
+
+# Name of the JSON run report written to the save directory, per kind of run (extract, load)
+RUN_REPORT_FILENAME = "run_report_{}.json"
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+# Fixed-bucket histogram in the Prometheus style: cumulative counts per upper bound, sum and count
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    # Estimate of a quantile: the upper bound of the bucket where it falls
+    def quantile(self, q):
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        for bound, cumulative in zip(self.buckets, self.counts):
+            if cumulative >= rank:
+                return bound
+        return self.max
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "max": round(self.max, 6),
+            "p50": self.quantile(0.5),
+            "p95": self.quantile(0.95),
+            "buckets": {str(bound): cumulative for bound, cumulative in zip(self.buckets, self.counts)},
+        }
+
+
+# Metrics of one extraction or loading run: wall time per stage, counters and latency histograms.
+# All the methods are thread safe, the worker threads and the event loop record into the same object.
+class RunMetrics:
+    def __init__(self, name, prometheus_path=None):
+        self.name = name
+        self.prometheus_path = prometheus_path
+        self.started = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.histograms = {}
+        self.extra = {}
+        self._lock = threading.Lock()
+
+    # Time a stage; stages may run concurrently and are summed per name
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_stage(name, time.perf_counter() - start)
+
+    def add_stage(self, name, seconds):
+        with self._lock:
+            stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+            stage["seconds"] += seconds
+            stage["calls"] += 1
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, name, value):
+        with self._lock:
+            self.histograms.setdefault(name, Histogram()).observe(value)
+
+    def wall_seconds(self):
+        return time.time() - self.started
+
+    def report(self):
+        wall = self.wall_seconds()
+        with self._lock:
+            triples = self.counters.get("triples_written", 0)
+            return {
+                "run": self.name,
+                "started": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(self.started)),
+                "wall_seconds": round(wall, 3),
+                "triples_per_second": round(triples / wall, 3) if wall else 0.0,
+                "stages": {name: {"seconds": round(stage["seconds"], 3), "calls": stage["calls"]} for name, stage in self.stages.items()},
+                "counters": dict(self.counters),
+                "histograms": {name: histogram.to_dict() for name, histogram in self.histograms.items()},
+                **self.extra,
+            }
+
+    # One line for the progress dialog
+    def summary_line(self):
+        report = self.report()
+        latency = report["histograms"].get("llm_latency_seconds", {})
+        counters = report["counters"]
+        return (f"{report['wall_seconds']:.0f}s, {counters.get('llm_requests', 0)} LLM requests "
+                f"(p50 {latency.get('p50', 0)}s, p95 {latency.get('p95', 0)}s, {counters.get('llm_errors', 0)} errors), "
+                f"{counters.get('triples_written', 0)} triples ({report['triples_per_second']:.1f}/s)")
+
+    # Prometheus text exposition format, for the textfile collector of node_exporter
+    def prometheus_text(self):
+        report = self.report()
+        run = f'run="{self.name}"'
+        lines = [f"kg_run_wall_seconds{{{run}}} {report['wall_seconds']}"]
+        for name, stage in report["stages"].items():
+            lines.append(f'kg_stage_seconds{{{run},stage="{name}"}} {stage["seconds"]}')
+            lines.append(f'kg_stage_calls{{{run},stage="{name}"}} {stage["calls"]}')
+        for name, value in report["counters"].items():
+            lines.append(f"kg_{name}_total{{{run}}} {value}")
+        for name, histogram in report["histograms"].items():
+            lines.append(f"# TYPE kg_{name} histogram")
+            for bound, cumulative in histogram["buckets"].items():
+                lines.append(f'kg_{name}_bucket{{{run},le="{bound}"}} {cumulative}')
+            lines.append(f'kg_{name}_bucket{{{run},le="+Inf"}} {histogram["count"]}')
+            lines.append(f"kg_{name}_sum{{{run}}} {histogram['sum']}")
+            lines.append(f"kg_{name}_count{{{run}}} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    # Write the JSON run report to output_dir and the Prometheus textfile if a path was given.
+    # Both are written to a temporary file first so that a reader never sees half a report.
+    def save(self, output_dir):
+        paths = []
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+            path = os.path.join(output_dir, RUN_REPORT_FILENAME.format(self.name))
+            write_atomic(path, json.dumps(self.report(), ensure_ascii=False, indent=2))
+            paths.append(path)
+        if self.prometheus_path:
+            write_atomic(self.prometheus_path, self.prometheus_text())
+            paths.append(self.prometheus_path)
+        return paths
+
+
+def write_atomic(path, text):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as file:
+        file.write(text)
+    os.replace(temp_path, path)
+
+
+# Stage timer that does nothing without metrics
+def timed(metrics, name):
+    return metrics.stage(name) if metrics else nullcontext()
+
+
+# Records the latency, errors and estimated prompt/completion tokens of every call of an LLM client
+class MeteredLLMClient(LLMClient):
+    def __init__(self, llm_client, metrics):
+        self.llm_client = llm_client
+        self.metrics = metrics
+
+    def generate_response(self, user_message, system_message):
+        start = time.perf_counter()
+        try:
+            response = self.llm_client.generate_response(user_message, system_message)
+        except Exception:
+            self.metrics.count("llm_errors")
+            raise
+        finally:
+            self.metrics.observe("llm_latency_seconds", time.perf_counter() - start)
+            self.metrics.count("llm_requests")
+        self.metrics.count("prompt_tokens", estimate_tokens(system_message) + estimate_tokens(user_message))
+        self.metrics.count("completion_tokens", estimate_tokens(response or ""))
+        return response
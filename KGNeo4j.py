@@ -0,0 +1,479 @@
+# Import related packages
+from knowledge_graph_builder import EAOntology, EROntology, KGToNeo4j
+from KGDedup import triple_key
+from KGMatcher import entry_name
+from neo4j import GraphDatabase
+from openpyxl import load_workbook
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import threading
+import random
+import zlib
+import time
+import os
+
+
+# Number of triples written to Neo4j in one transaction
+DEFAULT_BATCH_SIZE = 5000
+# Sessions writing the partitions of a batch at the same time; 1 writes the batches one after another
+DEFAULT_WRITERS = 4
+# Retries of a transaction failing with a deadlock, a lock timeout or another transient error
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_RETRY_DELAY = 0.2
+MAX_RETRY_DELAY = 10.0
+# Plan operators of a MERGE that finds its node through an index instead of scanning the label all contain this name
+# (NodeUniqueIndexSeek, NodeIndexSeek, AssertingMultiNodeIndexSeek, NodeUniqueIndexSeek(Locking), ...)
+INDEX_SEEK_OPERATOR = "IndexSeek"
+
+
+# Labels, relationship types and property keys cannot be query parameters, so they are escaped into the query
+def quote(name):
+    return "`" + str(name).replace("`", "``") + "`"
+
+
+# A cell is missing when it is empty or NaN
+def is_missing(value):
+    return value is None or value != value or str(value).strip() == ""
+
+
+# Stream the rows of a triples workbook, header row first, without loading the whole file into memory.
+# The other rows are (head, key1, relationship/attribute, tail, key2) tuples read from the columns of these
+# names, wherever they are in the sheet (see triple_columns). .xlsx files are read with the read-only
+# openpyxl reader; legacy .xls files fall back to pandas.
+def iter_workbook_rows(graphfile):
+    rows = iter_sheet_rows(graphfile)
+    try:
+        header = next(rows, None)
+        if header is None:
+            return
+        yield header
+        columns = triple_columns(header, graphfile)
+        for row in rows:
+            yield tuple(row[column] if column < len(row) else None for column in columns)
+    finally:
+        rows.close()
+
+
+def iter_sheet_rows(graphfile):
+    if graphfile.endswith('.xls'):
+        import pandas as pd
+        df = pd.read_excel(graphfile)
+        yield tuple(df.columns)
+        yield from df.itertuples(index=False, name=None)
+        return
+    workbook = load_workbook(graphfile, read_only=True)
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            # Blank rows left at the end of a sheet are ignored
+            if any(value is not None for value in row):
+                yield row
+    finally:
+        workbook.close()
+
+
+# Positions of the head, key1, relationship/attribute, tail and key2 columns in a header row, so that a workbook
+# with reordered or extra columns (a hand-edited one) is read by name, as KGToNeo4j does. A missing column is an error.
+def triple_columns(header, graphfile=""):
+    names = [str(name).strip() if name is not None else "" for name in header]
+    kind = triples_kind(header)
+    columns = []
+    for name in ("head", "key1", kind, "tail", "key2"):
+        matches = [column for column, found in enumerate(names) if found == name or (name == kind and kind and kind in found)]
+        if not name or not matches:
+            raise ValueError(f"{graphfile} has no {name or 'relationship or attribute'} column (header: {names})")
+        columns.append(matches[0])
+    return columns
+
+
+# Node labels of an ontology: the entity types of its entities list (the entities that have attributes, for an EAOntology)
+def ontology_labels(ontology):
+    return [entry_name(entry) for entry in ontology.entities]
+
+
+# Uniqueness constraint on the name of the nodes of a label, kept if it already exists
+def constraint_statement(label):
+    return f"CREATE CONSTRAINT {quote(f'kg_{label}_name')} IF NOT EXISTS FOR (n:{quote(label)}) REQUIRE n.name IS UNIQUE"
+
+
+def index_statement(label):
+    return f"CREATE INDEX {quote(f'kg_{label}_name_index')} IF NOT EXISTS FOR (n:{quote(label)}) ON (n.name)"
+
+
+# Operators of a plan (summary.plan of an EXPLAIN), depth first, without the runtime suffix ("@neo4j") and the
+# variant in parentheses ("(Locking)") some Neo4j versions add to the operator name
+def plan_operators(plan):
+    if not plan:
+        return []
+    operators = [str(plan.get("operatorType", "")).split("@")[0].split("(")[0]]
+    for child in plan.get("children", []):
+        operators += plan_operators(child)
+    return operators
+
+
+# Deadlocks, lock acquisition timeouts and lost connections: the transaction can be run again as is
+# (every statement is a MERGE or a SET, so a retried transaction does not duplicate anything)
+def is_transient(error):
+    code = str(getattr(error, "code", None) or "")
+    if code.startswith("Neo.TransientError"):
+        return True
+    is_retryable = getattr(error, "is_retryable", None)
+    return bool(is_retryable()) if callable(is_retryable) else False
+
+
+# Writer of a row (or of a (label, name) node): rows about the same head node always go to the same writer, so concurrent transactions
+# writing attributes or nodes never lock the same node. A stable hash (not hash()) keeps the partitioning the same between runs.
+# Relationship rows also lock their tail, which other writers may share (a hub such as 植物界): see BatchKGToNeo4j.locked_ER_statements.
+def writer_of(row, writers):
+    return zlib.crc32(f"{row[0]}\x1f{row[1]}".encode("utf-8")) % writers
+
+
+def partition_rows(rows, writers):
+    partitions = [[] for _ in range(writers)]
+    for row in rows:
+        partitions[writer_of(row, writers)].append(row)
+    return partitions
+
+
+# Sessions of the writers of a load. A session is not thread safe, so every writer thread opens its own;
+# with a single writer the partitions are written from the calling thread.
+class WriterPool:
+    def __init__(self, driver, writers=DEFAULT_WRITERS):
+        self.driver = driver
+        self.writers = max(int(writers or 1), 1)
+        self.executor = ThreadPoolExecutor(self.writers, thread_name_prefix="neo4j-writer") if self.writers > 1 else None
+        self.sessions = []
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = self.driver.session()
+            with self._lock:
+                self.sessions.append(session)
+        return session
+
+    # Run function(session, item) for every item, one writer per item, and return the results in order
+    def map(self, function, items):
+        if self.executor is None:
+            return [function(self.session(), item) for item in items]
+        futures = [self.executor.submit(lambda item=item: function(self.session(), item)) for item in items]
+        return [future.result() for future in futures]
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        for session in self.sessions:
+            session.close()
+        self.sessions = []
+
+
+# A column of the header names the kind of triples: 'relationship' or 'attribute'
+def triples_kind(header):
+    names = [str(name) for name in header if name is not None]
+    if any('relationship' in name for name in names):
+        return 'relationship'
+    if any('attribute' in name for name in names):
+        return 'attribute'
+    return None
+
+
+# Writes the triples of a workbook in batches of parameterized UNWIND ... MERGE statements instead of one
+# transaction per triple. Every batch is partitioned by head node over `writers` sessions that commit their
+# partition at the same time; transient errors (deadlocks between the writers, lock timeouts) are retried
+# with exponential backoff and jitter.
+# With schema, every node label (those of the ontology, then any new one found in the rows) gets a uniqueness
+# constraint on name before its nodes are written, so a MERGE is an index seek instead of a label scan and
+# its cost does not grow with the database; EXPLAIN checks that the MERGE statements use it.
+class BatchKGToNeo4j(KGToNeo4j):
+    def __init__(self, uri, username, password, batch_size=DEFAULT_BATCH_SIZE, log=print, dedup=True, metrics=None, journal=None,
+                 writers=DEFAULT_WRITERS, max_retries=DEFAULT_MAX_RETRIES, retry_delay=DEFAULT_RETRY_DELAY, schema=True):
+        super().__init__(uri, username, password)
+        self.batch_size = batch_size
+        self.log = log
+        self.driver = None
+        # Duplicate triples of a workbook are dropped before they become redundant MERGEs
+        self.dedup = dedup
+        # KGMetrics.RunMetrics recording the commit time of every batch
+        self.metrics = metrics
+        # KGJournal.LoadJournal: a workbook resumes after the last batch an earlier run committed
+        self.journal = journal
+        self.writers = max(int(writers or 1), 1)
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        # {label: {"constraint": "created" | "index" | "failed", "operators": [...], "indexed": bool}}, None without schema
+        self.schema = {} if schema else None
+
+    # The driver and its connection pool are shared by all the workbooks of a run
+    def get_driver(self):
+        if self.driver is None:
+            # Transient errors are retried by commit_partition, where they are counted per writer
+            self.driver = GraphDatabase.driver(self.uri, auth=(self.username, self.password), max_transaction_retry_time=0)
+        return self.driver
+
+    def close(self):
+        if self.driver is not None:
+            self.driver.close()
+            self.driver = None
+
+    # One UNWIND statement per (head label, tail label, relationship type) found in the batch
+    def ER_statements(self, rows):
+        groups = {}
+        for head, key1, relationship, tail, key2 in rows:
+            groups.setdefault((head, tail, relationship), []).append({"node1": key1, "node2": key2})
+        return [
+            (
+                "UNWIND $rows AS row "
+                f"MERGE (n1:{quote(head)} {{name: row.node1}}) "
+                f"MERGE (n2:{quote(tail)} {{name: row.node2}}) "
+                f"MERGE (n1)-[:{quote(relationship)}]->(n2)",
+                group,
+            )
+            for (head, tail, relationship), group in groups.items()
+        ]
+
+    # ER_statements of the partition of one writer when several writers share the tail nodes: the nodes of the rows are first
+    # write-locked in (label, name) order, so every transaction takes the locks it shares with the others in the same order
+    # and two writers cannot each wait for a node the other holds. The rows are sorted by node key as well.
+    def locked_ER_statements(self, rows):
+        rows = sorted(rows, key=lambda row: (str(row[0]), str(row[1]), str(row[3]), str(row[4]), str(row[2])))
+        nodes = sorted({(head, key1) for head, key1, *_ in rows} | {(tail, key2) for _, _, _, tail, key2 in rows}, key=lambda node: (str(node[0]), str(node[1])))
+        groups = {}
+        for label, name in nodes:
+            groups.setdefault(label, []).append({"name": name})
+        locks = [(f"UNWIND $rows AS row MATCH (n:{quote(label)} {{name: row.name}}) SET n._lock = true REMOVE n._lock", group) for label, group in groups.items()]
+        return locks + self.ER_statements(rows)
+
+    # One UNWIND statement per (entity label, attribute) found in the batch
+    def EA_statements(self, rows):
+        groups = {}
+        for head, key1, attribute, tail, key2 in rows:
+            groups.setdefault((head, attribute), []).append({"node": key1, "value": key2})
+        return [
+            (
+                "UNWIND $rows AS row "
+                f"MERGE (n:{quote(head)} {{name: row.node}}) "
+                f"SET n.{quote(attribute)} = row.value",
+                group,
+            )
+            for (head, attribute), group in groups.items()
+        ]
+
+    # Create the uniqueness constraint of every label not bootstrapped yet and check with EXPLAIN that the MERGE
+    # of its nodes seeks the index. Existing constraints are kept (IF NOT EXISTS), so this is idempotent. When the
+    # constraint cannot be created (the label already holds duplicate names, or the user may not change the
+    # schema), a plain index on name is tried instead.
+    def ensure_schema(self, labels):
+        if self.schema is None:
+            return
+        labels = sorted({str(label) for label in labels} - set(self.schema))
+        if not labels:
+            return
+        with self.get_driver().session() as session:
+            for label in labels:
+                entry = self.schema[label] = {"constraint": "created", "operators": [], "indexed": False}
+                try:
+                    session.run(constraint_statement(label)).consume()
+                except Exception as e:
+                    self.log(f"Could not create the uniqueness constraint of {label} ({e}), creating an index instead")
+                    try:
+                        session.run(index_statement(label)).consume()
+                        entry["constraint"] = "index"
+                    except Exception as e:
+                        entry["constraint"] = "failed"
+                        self.log(f"Could not create an index on the name of {label}: {e}")
+                try:
+                    summary = session.run(f"EXPLAIN UNWIND $rows AS row MERGE (n:{quote(label)} {{name: row.name}})", rows=[]).consume()
+                    entry["operators"] = plan_operators(summary.plan)
+                except Exception as e:
+                    self.log(f"Could not explain the MERGE of {label}: {e}")
+                entry["indexed"] = any(INDEX_SEEK_OPERATOR in operator for operator in entry["operators"])
+                if not entry["indexed"]:
+                    self.log(f"The MERGE of {label} nodes does not use an index (plan: {' > '.join(entry['operators']) or 'unknown'}); loading slows down as the graph grows")
+        indexed = sum(1 for label in labels if self.schema[label]["indexed"])
+        self.log(f"Bootstrapped the schema of {len(labels)} labels: {indexed} MERGE statements use an index")
+
+    # One UNWIND statement per label merging the (label, name) nodes
+    def node_statements(self, nodes):
+        groups = {}
+        for label, name in nodes:
+            groups.setdefault(label, []).append({"name": name})
+        return [(f"UNWIND $rows AS row MERGE (n:{quote(label)} {{name: row.name}})", group) for label, group in groups.items()]
+
+    def write_batch(self, tx, statements):
+        for query, rows in statements:
+            tx.run(query, rows=rows).consume()
+
+    # Commit the rows of one writer in one transaction. Returns the seconds spent (backoff included) and the retries.
+    def commit_partition(self, session, to_statements, rows, writer):
+        start = time.perf_counter()
+        statements = to_statements(rows)
+        retries = 0
+        while True:
+            try:
+                session.execute_write(self.write_batch, statements)
+                return time.perf_counter() - start, retries
+            except Exception as e:
+                if retries >= self.max_retries or not is_transient(e):
+                    raise
+                delay = min(self.retry_delay * 2 ** retries, MAX_RETRY_DELAY) * random.uniform(0.5, 1.5)
+                retries += 1
+                self.log(f"Writer {writer} hit a transient error ({getattr(e, 'code', None) or type(e).__name__}), retry {retries} in {delay:.2f}s")
+                time.sleep(delay)
+
+    # Commit the rows partitioned over the writers at the same time and add the time and retries of every
+    # writer to stats. Returns the number of writers that had rows.
+    def write_partitioned(self, pool, to_statements, rows, stats, count_rows=True):
+        partitions = [(writer, part) for writer, part in enumerate(partition_rows(rows, self.writers)) if part]
+        results = pool.map(lambda session, partition: self.commit_partition(session, to_statements, partition[1], partition[0]), partitions)
+        for (writer, part), (seconds, retries) in zip(partitions, results):
+            writer_stats = stats["writers"][writer]
+            writer_stats["rows"] += len(part) if count_rows else 0
+            writer_stats["transactions"] += 1
+            writer_stats["seconds"] += seconds
+            writer_stats["retries"] += retries
+            stats["retries"] += retries
+            if self.metrics:
+                self.metrics.observe("neo4j_transaction_seconds", seconds)
+                self.metrics.count("neo4j_retries", retries)
+        return len(partitions)
+
+    # Split an iterable of (head, key1, relationship/attribute, tail, key2) rows into batches
+    def batches(self, rows):
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    # Write rows to Neo4j batch by batch and log the commit time of every batch.
+    # With a journal, the rows read up to each committed batch are recorded and skipped by the next run.
+    def load_rows(self, pool, ontology, rows, name=""):
+        if isinstance(ontology, EROntology):
+            to_statements = self.ER_statements
+        elif isinstance(ontology, EAOntology):
+            to_statements = self.EA_statements
+        else:
+            raise ValueError("Unsupported or Invalid Ontology Type")
+        stats = {"rows": 0, "skipped": 0, "duplicates": 0, "batches": 0, "seconds": 0.0, "resumed_rows": 0, "retries": 0,
+                 "writers": {writer: {"rows": 0, "transactions": 0, "seconds": 0.0, "retries": 0} for writer in range(self.writers)}}
+        labels_seen = set(ontology_labels(ontology))
+        self.ensure_schema(labels_seen)
+        # Keys of the triples of these rows only: the workbooks materialized from the triple store are already
+        # deduplicated, so the set lives as long as one workbook instead of growing over the whole run
+        seen = set() if self.dedup else None
+        journal = self.journal
+        consumed = journal.committed(name) if journal else 0
+        if consumed:
+            stats["resumed_rows"] = consumed
+            rows = islice(rows, consumed, None)
+            self.log(f"Resuming {name} after the {consumed} rows committed by an earlier run")
+        for batch in self.batches(rows):
+            consumed += len(batch)
+            valid = [row for row in batch if not any(is_missing(value) for value in row)]
+            stats["skipped"] += len(batch) - len(valid)
+            if seen is not None:
+                unique = []
+                for row in valid:
+                    key = triple_key(row)
+                    if key not in seen:
+                        seen.add(key)
+                        unique.append(row)
+                stats["duplicates"] += len(valid) - len(unique)
+                valid = unique
+            if not valid:
+                if journal:
+                    journal.commit(name, consumed)
+                continue
+            # Labels met for the first time (not in the ontology) are indexed before their nodes are written
+            labels = {row[0] for row in valid} | ({row[3] for row in valid} if to_statements == self.ER_statements else set())
+            self.ensure_schema(labels)
+            labels_seen.update(labels)
+            start = time.perf_counter()
+            if self.writers > 1 and to_statements == self.ER_statements:
+                # Two writers merging the same missing node at the same time could both create it: the nodes of
+                # the batch are first merged by the writer owning each node, then the relationships by head node, each
+                # transaction locking its nodes in the same order
+                nodes = sorted({(head, key1) for head, key1, *_ in valid} | {(tail, key2) for _, _, _, tail, key2 in valid})
+                self.write_partitioned(pool, self.node_statements, nodes, stats, count_rows=False)
+                writers = self.write_partitioned(pool, self.locked_ER_statements, valid, stats)
+            else:
+                writers = self.write_partitioned(pool, to_statements, valid, stats)
+            elapsed = time.perf_counter() - start
+            stats["rows"] += len(valid)
+            stats["batches"] += 1
+            stats["seconds"] += elapsed
+            if self.metrics:
+                self.metrics.add_stage("neo4j_commit", elapsed)
+                self.metrics.observe("neo4j_batch_seconds", elapsed)
+                self.metrics.count("triples_written", len(valid))
+            # Every writer has committed its partition of the batch
+            if journal:
+                journal.commit(name, consumed)
+            self.log(f"Committed batch {stats['batches']} of {name} ({len(valid)} triples, {writers} writers) in {elapsed:.3f}s")
+        for writer_stats in stats["writers"].values():
+            writer_stats["rows_per_second"] = round(writer_stats["rows"] / writer_stats["seconds"], 1) if writer_stats["seconds"] else 0.0
+        if self.schema is not None:
+            stats["schema"] = {label: self.schema[label] for label in sorted(labels_seen)}
+        return stats
+
+    # Write the triples of a workbook to Neo4j according to the defined ontology model
+    def graph_to_neo4j(self, ontology, graphfile):
+        rows = iter_workbook_rows(graphfile)
+        next(rows, None)
+        return self.rows_to_neo4j(ontology, rows, graphfile)
+
+    def rows_to_neo4j(self, ontology, rows, name=""):
+        pool = WriterPool(self.get_driver(), self.writers)
+        try:
+            stats = self.load_rows(pool, ontology, rows, name)
+        finally:
+            pool.close()
+        if self.writers > 1:
+            for writer, writer_stats in stats["writers"].items():
+                self.log(f"Writer {writer} of {name}: {writer_stats['rows']} triples in {writer_stats['transactions']} transactions, "
+                         f"{writer_stats['rows_per_second']} triples/s, {writer_stats['retries']} retries")
+        if stats["skipped"]:
+            self.log(f"Skipped {stats['skipped']} triples of {name} with empty cells")
+        if stats["duplicates"]:
+            self.log(f"Skipped {stats['duplicates']} duplicate triples of {name}")
+        return stats
+
+    # Parse a workbook once: the header row tells which ontology it holds, the other rows are streamed in batches.
+    # Returns the kind of triples ('relationship', 'attribute' or None when unknown) and the load statistics.
+    def workbook_to_neo4j(self, graphfile, erontology, eaontology):
+        rows = iter_workbook_rows(graphfile)
+        try:
+            kind = triples_kind(next(rows, ()))
+            if kind is None:
+                return None, None
+            ontology = erontology if kind == 'relationship' else eaontology
+            return kind, self.rows_to_neo4j(ontology, rows, graphfile)
+        finally:
+            rows.close()
+
+
+# Load every triples workbook of a directory into Neo4j. Returns {filename: {"kind": ..., load statistics}}.
+def load_directory(loader, directory, erontology, eaontology, log=print):
+    summary = {}
+    for filename in sorted(os.listdir(directory)):
+        file_path = os.path.join(directory, filename)
+        if os.path.isfile(file_path) and filename.endswith(('.xlsx', '.xls')):
+            # The header row decides the ontology, the rows are then streamed into Neo4j in batches
+            kind, stats = loader.workbook_to_neo4j(file_path, erontology, eaontology)
+            summary[filename] = {"kind": kind, **(stats or {})}
+            if kind == 'relationship':
+                log(f"Successfully passed Entity relationship triples into the Neo4j database for file {filename}.")
+            elif kind == 'attribute':
+                log(f"Successfully passed Entity attribute triples into the Neo4j database for file {filename}.")
+            else:
+                log(f"Unknown ontology type for file {filename}.")
+        else:
+            log(f"Skipped non-Excel file {filename}.")
+    # Every workbook is loaded, the next load starts over
+    if loader.journal:
+        loader.journal.clear()
+    return summary
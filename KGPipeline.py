@@ -0,0 +1,136 @@
+# Import related packages
+from knowledge_graph_builder import KnowledgeGraphBuilder
+from KGCache import CachedLLMClient, LLM_CACHE_FILENAME
+from KGScheduler import RateLimitedLLMClient, DEFAULT_REQUESTS_PER_MINUTE, DEFAULT_TOKENS_PER_MINUTE
+from KGAsync import AsyncLLMClient, AsyncRunner, DEFAULT_MAX_IN_FLIGHT
+from KGNeo4j import BatchKGToNeo4j, DEFAULT_BATCH_SIZE, DEFAULT_WRITERS, load_directory
+from KGGenerate import extract_directory, DEFAULT_MAX_WORKERS, DEFAULT_CHUNK_TOKENS, JointKnowledgeGraphBuilder
+from KGMetrics import RunMetrics, MeteredLLMClient, timed
+from KGJournal import LoadJournal
+from KGBulkImport import bulk_export_directory, DEFAULT_DATABASE
+from contextlib import contextmanager
+import os
+
+
+# Extract the knowledge graph of every .txt file of inputdir_path into save_path, the way the UI does:
+# entity relationships then entity attributes (or both in one pass with joint), through the rate-limited
+# and cached LLM client, or from one event loop with use_async. progress(label, done bytes, total bytes)
+# follows each pass. The metrics of the run (a KGMetrics.RunMetrics) are written to save_path as a JSON run report.
+# Returns the statistics of the run.
+def extract_knowledge_graph(inputdir_path, save_path, erontology, eaontology, llm, log=print, max_workers=DEFAULT_MAX_WORKERS, joint=False,
+                            use_cache=True, prefilter=True, prune=False, chunk_tokens=DEFAULT_CHUNK_TOKENS, chunk_overlap=0,
+                            requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+                            use_async=False, max_in_flight=DEFAULT_MAX_IN_FLIGHT, progress=None, metrics=None):
+    metrics = metrics or RunMetrics("extract")
+    summary = {}
+    options = {"prefilter": prefilter, "prune": prune, "chunk_tokens": chunk_tokens, "chunk_overlap": chunk_overlap, "progress": progress, "metrics": metrics}
+    try:
+        with extraction_clients(llm, save_path, summary, metrics, log, max_workers, use_cache, requests_per_minute, tokens_per_minute,
+                                use_async, max_in_flight) as (extraction_llm, runner):
+            summary["passes"] = extract_passes(inputdir_path, save_path, erontology, eaontology, extraction_llm, log, max_workers, joint, runner=runner, **options)
+    finally:
+        summary["metrics"] = metrics.report()
+        for path in metrics.save(save_path):
+            log(f"Run report written to {path}")
+    return summary
+
+
+# The LLM client the builders of a run use and the AsyncRunner of use_async (None otherwise).
+# The statistics of the scheduler, async client and cache are added to summary when the run ends.
+@contextmanager
+def extraction_clients(llm, save_path, summary, metrics, log=print, max_workers=DEFAULT_MAX_WORKERS, use_cache=True,
+                       requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+                       use_async=False, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+    # Keep the requests within the provider quota and retry the throttled ones instead of losing the file;
+    # the latency is measured beneath the scheduler, so waiting for quota is not counted as LLM latency
+    scheduled_llm = RateLimitedLLMClient(MeteredLLMClient(llm, metrics), requests_per_minute, tokens_per_minute, max_workers, log=log)
+    # Cache LLM responses in the save directory so that a re-run never pays for the same chunk twice.
+    # The cache key looks through the scheduler, so the threaded and async paths share the cached responses.
+    cache = CachedLLMClient(scheduled_llm, os.path.join(save_path, LLM_CACHE_FILENAME)) if save_path and use_cache else None
+    try:
+        if use_async:
+            # Drive all the LLM requests from a single event loop with pooled HTTP connections instead of a thread per request
+            client = AsyncLLMClient(llm, max_in_flight, requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute,
+                                    cache=cache, metrics=metrics)
+            runner = AsyncRunner(client)
+            try:
+                yield llm, runner
+            finally:
+                runner.close()
+                summary["async"] = client.stats()
+                log(f"Async LLM client statistics: {summary['async']}")
+        else:
+            try:
+                yield cache or scheduled_llm, None
+            finally:
+                summary["scheduler"] = scheduled_llm.stats()
+                metrics.count("llm_retries", summary["scheduler"]["retries"])
+                metrics.count("llm_throttled", summary["scheduler"]["throttled"])
+                log(f"LLM request scheduler statistics: {summary['scheduler']}")
+    finally:
+        if cache:
+            summary["cache"] = cache.stats()
+            metrics.count("llm_cache_hits", summary["cache"]["hits"])
+            log(f"LLM response cache statistics: {summary['cache']}")
+            cache.close()
+
+
+def extract_passes(inputdir_path, save_path, erontology, eaontology, llm, log, max_workers, joint, **options):
+    metrics = options.get("metrics")
+    if joint:
+        log("Received user input file: Start extracting the Entity Relationship and Entity Attributes Knowledge Graph in a single pass")
+        builder = JointKnowledgeGraphBuilder(erontology, eaontology, llm)
+        with timed(metrics, "extract_joint"):
+            summary = {"joint": extract_directory(builder, inputdir_path, save_path, log, max_workers, "Entity relationship and entity attributes", **options)}
+        log("All entity relationship and entity attributes triples have been extracted and successfully exported to the Excel file.")
+        return summary
+    log("Received user input file: Start extracting the Entity Relationship Knowledge Graph")
+    builder = KnowledgeGraphBuilder(ontology=erontology, llm_client=llm)
+    with timed(metrics, "extract_relationship"):
+        summary = {"relationship": extract_directory(builder, inputdir_path, save_path, log, max_workers, "Entity relationship", **options)}
+    log("All entity relationship triples have been extracted and successfully exported to the Excel file.")
+    log("Received user input file: Start extracting Entity Attributes Knowledge Graph")
+    builder = KnowledgeGraphBuilder(ontology=eaontology, llm_client=llm)
+    with timed(metrics, "extract_attribute"):
+        summary["attribute"] = extract_directory(builder, inputdir_path, save_path, log, max_workers, "Entity attributes", **options)
+    log("All entity attributes triples have been extracted and successfully exported to the Excel file.")
+    return summary
+
+
+# Load the triples workbooks of inputdir_path into Neo4j, the way the UI does, with `writers` sessions writing
+# the partitions of every batch at the same time. Unless schema is False, a uniqueness constraint on the name of
+# every node label is created first (KGNeo4j.BatchKGToNeo4j.ensure_schema). The run report is written next to the workbooks. loader replaces the BatchKGToNeo4j built from uri, username and password (the benchmark
+# passes a stand-in that does not need a database). Returns the statistics per workbook.
+def load_knowledge_graph(inputdir_path, uri, username, password, erontology, eaontology, log=print, batch_size=DEFAULT_BATCH_SIZE, metrics=None,
+                         loader=None, writers=DEFAULT_WRITERS, schema=True):
+    metrics = metrics or RunMetrics("load")
+    log("Start passing user-supplied triples into the Neo4j database")
+    # The batches committed by a load that stopped partway are not written again
+    loader = loader or BatchKGToNeo4j(uri, username, password, batch_size, log, metrics=metrics, journal=LoadJournal(inputdir_path, uri), writers=writers,
+                                      schema=schema)
+    try:
+        with timed(metrics, "load"):
+            summary = load_directory(loader, inputdir_path, erontology, eaontology, log)
+    finally:
+        loader.close()
+        for path in metrics.save(inputdir_path):
+            log(f"Run report written to {path}")
+    log("All files have been successfully imported into the Neo4j database, please check in Neo4j.")
+    return summary
+
+
+# Write the triples workbooks of inputdir_path as neo4j-admin import files (to inputdir_path/neo4j-import by default)
+# for the first load of a large graph, the way the UI does, and check them without a database.
+# Returns the number of nodes and relationships written and the problems found.
+def bulk_export_knowledge_graph(inputdir_path, erontology, output_dir=None, log=print, database=DEFAULT_DATABASE, metrics=None):
+    metrics = metrics or RunMetrics("bulk_export")
+    log("Start writing the user-supplied triples as neo4j-admin import files")
+    try:
+        with timed(metrics, "bulk_export"):
+            summary = bulk_export_directory(inputdir_path, erontology, output_dir, log, database)
+        metrics.count("nodes_written", summary["nodes"])
+        metrics.count("relationships_written", summary["relationships"])
+    finally:
+        for path in metrics.save(inputdir_path):
+            log(f"Run report written to {path}")
+    return summary
@@ -0,0 +1,221 @@
+# Import related packages
+from knowledge_graph_builder import LLMClient
+from KGMatcher import estimate_tokens
+import threading
+import random
+import time
+import re
+
+
+# Default quota of llama3-70b-8192 on the Groq free tier
+DEFAULT_REQUESTS_PER_MINUTE = 30
+DEFAULT_TOKENS_PER_MINUTE = 6000
+# Tokens reserved for the completion of every request, on top of the prompt
+DEFAULT_COMPLETION_TOKENS = 512
+DEFAULT_MAX_RETRIES = 6
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 60.0
+# HTTP statuses worth retrying: throttling and temporary server errors
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# Groq and OpenAI report the remaining quota and its reset time in these headers. On Groq the requests headers
+# describe the requests per day and the tokens headers the tokens per minute
+RATE_LIMIT_HEADERS = {
+    "remaining_requests": "x-ratelimit-remaining-requests",
+    "remaining_tokens": "x-ratelimit-remaining-tokens",
+    "reset_requests": "x-ratelimit-reset-requests",
+    "reset_tokens": "x-ratelimit-reset-tokens",
+}
+
+
+# Parse a reset time such as "2m59.56s", "7.66s", "120ms" or "3" into seconds
+def parse_duration(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = re.findall(r"(\d+(?:\.\d+)?)(ms|h|m|s)", value)
+    if not parts:
+        return None
+    units = {"h": 3600, "m": 60, "s": 1, "ms": 0.001}
+    return sum(float(number) * units[unit] for number, unit in parts)
+
+
+# HTTP status of an exception raised by an LLM client, if it carries one
+def error_status(error):
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status
+
+
+# Rate limit headers of the response of an exception: retry_after, remaining and reset values
+def rate_limit_info(error):
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    info = {"retry_after": parse_duration(headers.get("retry-after"))}
+    for name, header in RATE_LIMIT_HEADERS.items():
+        value = headers.get(header)
+        if name.startswith("reset"):
+            info[name] = parse_duration(value)
+        else:
+            info[name] = int(float(value)) if value is not None else None
+    return info
+
+
+# Throttling, server errors, timeouts and dropped connections are retried; anything else is raised at once
+def is_retryable(error):
+    status = error_status(error)
+    if status is not None:
+        return status in RETRY_STATUSES
+    return isinstance(error, (ConnectionError, TimeoutError)) or type(error).__name__ in ("APIConnectionError", "APITimeoutError")
+
+
+# Token bucket refilled continuously at rate_per_minute, holding at most one minute of quota
+class TokenBucket:
+    def __init__(self, rate_per_minute, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Reserve amount tokens and return how long the caller has to wait for them. The bucket may go
+    # negative, so reservations are served in order; a request larger than the bucket waits for a full one.
+    def reserve(self, amount=1):
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self.refill()
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+    def acquire(self, amount=1):
+        time.sleep(self.reserve(amount))
+
+    # Align the bucket with the quota reported by the provider: what is left and when it is full again.
+    # A reset beyond the minute the bucket refills in belongs to a longer window and is capped to it.
+    def sync(self, remaining, reset=None):
+        with self._lock:
+            self.refill()
+            if remaining is not None:
+                self.tokens = min(self.tokens, remaining)
+            if reset:
+                # Nothing is left until the reset time
+                reset = min(reset, self.capacity / self.rate)
+                self.tokens = min(self.tokens, self.capacity - reset * self.rate)
+
+
+# Limits the number of requests in flight. The limit is halved after throttling and raised by one
+# after as many successes in a row as the current limit (additive increase, multiplicative decrease).
+class AdaptiveLimiter:
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max(1, max_concurrency)
+        self.limit = self.max_concurrency
+        self.active = 0
+        self.successes = 0
+        self.decreases = 0
+        self._condition = threading.Condition()
+
+    def __enter__(self):
+        with self._condition:
+            while self.active >= self.limit:
+                self._condition.wait()
+            self.active += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    def success(self):
+        with self._condition:
+            self.successes += 1
+            if self.successes >= self.limit and self.limit < self.max_concurrency:
+                self.limit += 1
+                self.successes = 0
+                self._condition.notify_all()
+
+    def throttled(self):
+        with self._condition:
+            self.limit = max(1, self.limit // 2)
+            self.successes = 0
+            self.decreases += 1
+
+
+# Scheduler in front of an LLM client (GroqClient, OpenAIClient, ...): every request waits for the
+# requests/minute and tokens/minute buckets and for a free slot, and throttled or failed requests are
+# retried with exponential backoff and jitter, honouring the retry-after and x-ratelimit-* headers.
+class RateLimitedLLMClient(LLMClient):
+    def __init__(self, llm_client, requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, tokens_per_minute=DEFAULT_TOKENS_PER_MINUTE,
+                 max_concurrency=4, completion_tokens=DEFAULT_COMPLETION_TOKENS, max_retries=DEFAULT_MAX_RETRIES,
+                 base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY, log=print):
+        self.llm_client = llm_client
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.limiter = AdaptiveLimiter(max_concurrency)
+        self.completion_tokens = completion_tokens
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.log = log
+        self.calls = 0
+        self.throttled = 0
+        self.retries = 0
+        self.waited = 0.0
+        self._lock = threading.Lock()
+
+    # Full jitter: a random delay up to base_delay * 2^attempt, but never shorter than retry-after
+    def backoff(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, retry_after or 0)
+
+    def generate_response(self, user_message, system_message):
+        cost = estimate_tokens(system_message) + estimate_tokens(user_message) + self.completion_tokens
+        for attempt in range(self.max_retries + 1):
+            with self.limiter:
+                start = time.monotonic()
+                self.requests.acquire()
+                self.tokens.acquire(cost)
+                with self._lock:
+                    self.waited += time.monotonic() - start
+                    self.calls += 1
+                try:
+                    response = self.llm_client.generate_response(user_message, system_message)
+                except Exception as e:
+                    error = e
+                else:
+                    self.limiter.success()
+                    return response
+            if attempt == self.max_retries or not is_retryable(error):
+                raise error
+            info = rate_limit_info(error)
+            if error_status(error) == 429:
+                self.limiter.throttled()
+                # The requests headers are a daily quota, not the requests/minute of self.requests: the wait for
+                # them is the retry-after of the response
+                self.tokens.sync(info["remaining_tokens"], info["reset_tokens"])
+                with self._lock:
+                    self.throttled += 1
+            delay = self.backoff(attempt, info["retry_after"])
+            with self._lock:
+                self.retries += 1
+            self.log(f"LLM request failed ({error_status(error) or type(error).__name__}), retry {attempt + 1} of {self.max_retries} "
+                     f"in {delay:.1f}s with {self.limiter.limit} concurrent requests")
+            time.sleep(delay)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "seconds_waiting_for_quota": round(self.waited, 3),
+                "concurrency": self.limiter.limit,
+            }
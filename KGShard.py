@@ -0,0 +1,352 @@
+# Import related packages
+from KGCache import llm_settings
+from KGDedup import TripleIndex, TRIPLE_INDEX_FILENAME
+from KGStore import TripleStore, STORE_DIRNAME, ER_FILENAME, EA_FILENAME
+from KGManifest import file_hash
+from KGMetrics import RunMetrics
+from KGGenerate import DEFAULT_MAX_WORKERS, DEFAULT_CHUNK_TOKENS
+from KGPipeline import extraction_clients, extract_passes
+import threading
+import hashlib
+import sqlite3
+import socket
+import shutil
+import json
+import time
+import re
+import os
+
+
+# Work queue of a sharded extraction, stored in the save directory shared by the workers
+WORK_QUEUE_FILENAME = "work_queue.sqlite"
+# Directory of the save directory holding one output directory per worker
+SHARDS_DIRNAME = "shards"
+# A worker that has not renewed its lease for this long is considered dead and its files are claimed again
+DEFAULT_LEASE_SECONDS = 300
+# Files claimed at once: the per-claim overhead (manifest, index, prefilter) is paid once per batch
+DEFAULT_FILES_PER_CLAIM = 4
+# A file whose extraction failed this many times is left out of the merge
+DEFAULT_MAX_ATTEMPTS = 3
+# Seconds an SQLite connection waits for the lock of another worker
+QUEUE_TIMEOUT = 60
+
+
+# Identifier of a worker process, unique across the machines sharing the save directory
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+# Worker identifiers are used as directory names
+def shard_dirname(worker_id):
+    return re.sub(r"[^\w.-]", "_", worker_id)
+
+
+def shard_path(save_path, worker_id):
+    return os.path.join(save_path, SHARDS_DIRNAME, shard_dirname(worker_id))
+
+
+# Version of a sharded extraction: files done with another ontology, model, chunking, pruning or pre-filter are queued again
+def sharding_version(erontology, eaontology, llm, joint, **chunking):
+    payload = json.dumps(
+        {"joint": joint, "erontology": erontology.dump(), "eaontology": eaontology.dump(), **llm_settings(llm), **chunking},
+        ensure_ascii=False, sort_keys=True, default=str,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# SQLite work queue over the .txt files of an input directory. Workers claim files under a lease that
+# they renew with heartbeats; a lease that expires (the worker died or lost the shared filesystem) makes
+# the file claimable again. The queue records which worker completed each file, so the merge only reads
+# the output of the worker that owns the file, even if a slow worker finishes it a second time.
+# Every state change is one IMMEDIATE transaction, so several processes and machines can share the queue.
+class WorkQueue:
+    def __init__(self, save_path, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        if not os.path.exists(save_path):
+            os.makedirs(save_path)
+        self.path = os.path.join(save_path, WORK_QUEUE_FILENAME)
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+        self._conn = sqlite3.connect(self.path, timeout=QUEUE_TIMEOUT, isolation_level=None, check_same_thread=False)
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "filename TEXT PRIMARY KEY, sha256 TEXT NOT NULL, version TEXT NOT NULL, status TEXT NOT NULL, "
+            "worker TEXT, lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT, updated REAL NOT NULL);"
+            "CREATE INDEX IF NOT EXISTS tasks_status ON tasks (status, lease_expires);"
+        )
+
+    def transaction(self, function, *args):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = function(*args)
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+            return result
+
+    # Queue the files of the input directory: new files, changed files and files done with another version
+    # become pending, the tasks of deleted files are removed. Safe to call from every worker.
+    def populate(self, inputdir_path, version):
+        files = {
+            filename: file_hash(os.path.join(inputdir_path, filename))
+            for filename in sorted(os.listdir(inputdir_path)) if filename.endswith(".txt")
+        }
+        return self.transaction(self._populate, files, version)
+
+    def _populate(self, files, version):
+        now = time.time()
+        tasks = {filename: (sha256, task_version) for filename, sha256, task_version in self._conn.execute("SELECT filename, sha256, version FROM tasks")}
+        added = 0
+        for filename, sha256 in files.items():
+            if tasks.get(filename) == (sha256, version):
+                continue
+            self._conn.execute(
+                "INSERT INTO tasks (filename, sha256, version, status, updated) VALUES (?, ?, ?, 'pending', ?) "
+                "ON CONFLICT (filename) DO UPDATE SET sha256 = excluded.sha256, version = excluded.version, status = 'pending', "
+                "worker = NULL, lease_expires = NULL, attempts = 0, error = NULL, updated = excluded.updated",
+                (filename, sha256, version, now),
+            )
+            added += 1
+        removed = [filename for filename in tasks if filename not in files]
+        self._conn.executemany("DELETE FROM tasks WHERE filename = ?", [(filename,) for filename in removed])
+        return {"queued": added, "removed": len(removed)}
+
+    # Claim up to limit pending files or files whose lease expired
+    def claim(self, worker_id, limit=DEFAULT_FILES_PER_CLAIM, lease_seconds=DEFAULT_LEASE_SECONDS):
+        return self.transaction(self._claim, worker_id, limit, lease_seconds)
+
+    def _claim(self, worker_id, limit, lease_seconds):
+        now = time.time()
+        # A file whose lease expired counts as a failed attempt, so a file that kills its worker is eventually given up
+        self._conn.execute(
+            "UPDATE tasks SET status = 'failed', attempts = attempts + 1, worker = NULL, lease_expires = NULL, error = 'lease expired', updated = ? "
+            "WHERE status = 'leased' AND lease_expires < ? AND attempts + 1 >= ?",
+            (now, now, self.max_attempts),
+        )
+        rows = self._conn.execute(
+            "SELECT filename, status FROM tasks WHERE (status = 'pending' OR (status = 'leased' AND lease_expires < ?)) AND attempts < ? "
+            "ORDER BY filename LIMIT ?",
+            (now, self.max_attempts, limit),
+        ).fetchall()
+        for filename, status in rows:
+            self._conn.execute(
+                "UPDATE tasks SET status = 'leased', worker = ?, lease_expires = ?, updated = ?, "
+                "attempts = attempts + (CASE WHEN status = 'leased' THEN 1 ELSE 0 END) WHERE filename = ?",
+                (worker_id, now + lease_seconds, now, filename),
+            )
+        return [filename for filename, _ in rows]
+
+    # Renew the leases of a worker; returns the files whose lease it still holds
+    def heartbeat(self, worker_id, filenames, lease_seconds=DEFAULT_LEASE_SECONDS):
+        return self.transaction(self._heartbeat, worker_id, filenames, lease_seconds)
+
+    def _heartbeat(self, worker_id, filenames, lease_seconds):
+        now = time.time()
+        held = []
+        for filename in filenames:
+            cursor = self._conn.execute(
+                "UPDATE tasks SET lease_expires = ?, updated = ? WHERE filename = ? AND worker = ? AND status = 'leased'",
+                (now + lease_seconds, now, filename, worker_id),
+            )
+            if cursor.rowcount:
+                held.append(filename)
+        return held
+
+    # Mark a file done by the worker; False when the lease was lost to another worker meanwhile
+    def complete(self, worker_id, filename):
+        return self.transaction(self._finish, worker_id, filename, None)
+
+    # Give a failed file back to the queue, or give it up after max_attempts
+    def fail(self, worker_id, filename, error):
+        return self.transaction(self._finish, worker_id, filename, str(error))
+
+    def _finish(self, worker_id, filename, error):
+        now = time.time()
+        if error is None:
+            cursor = self._conn.execute(
+                "UPDATE tasks SET status = 'done', lease_expires = NULL, error = NULL, updated = ? "
+                "WHERE filename = ? AND worker = ? AND status = 'leased'",
+                (now, filename, worker_id),
+            )
+        else:
+            cursor = self._conn.execute(
+                "UPDATE tasks SET status = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END, "
+                "attempts = attempts + 1, lease_expires = NULL, error = ?, updated = ? "
+                "WHERE filename = ? AND worker = ? AND status = 'leased'",
+                (self.max_attempts, error, now, filename, worker_id),
+            )
+        return bool(cursor.rowcount)
+
+    # Files that are pending or leased and can still be extracted
+    def remaining(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM tasks WHERE status IN ('pending', 'leased') AND attempts < ?", (self.max_attempts,)
+            ).fetchone()[0]
+
+    # Seconds until the first lease of another worker expires, None when no file is leased
+    def next_expiry(self):
+        with self._lock:
+            expires = self._conn.execute("SELECT MIN(lease_expires) FROM tasks WHERE status = 'leased'").fetchone()[0]
+        return None if expires is None else max(expires - time.time(), 0)
+
+    # (filename, worker) of the completed files, in filename order
+    def done(self):
+        with self._lock:
+            return self._conn.execute("SELECT filename, worker FROM tasks WHERE status = 'done' ORDER BY filename").fetchall()
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._conn.execute("SELECT status, COUNT(*) FROM tasks GROUP BY status").fetchall())
+            workers = self._conn.execute("SELECT COUNT(DISTINCT worker) FROM tasks WHERE status = 'done'").fetchone()[0]
+        return {**{status: counts.get(status, 0) for status in ("pending", "leased", "done", "failed")}, "workers": workers}
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+# Renews the leases of the claimed files from a background thread while they are extracted
+class Heartbeat:
+    def __init__(self, queue, worker_id, filenames, lease_seconds=DEFAULT_LEASE_SECONDS, log=print):
+        self.queue = queue
+        self.worker_id = worker_id
+        self.filenames = list(filenames)
+        self.lease_seconds = lease_seconds
+        self.interval = max(lease_seconds / 3, 1)
+        self.log = log
+        self.lost = set()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, name="lease-heartbeat", daemon=True)
+
+    def run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                held = set(self.queue.heartbeat(self.worker_id, self.filenames, self.lease_seconds))
+            except sqlite3.Error as e:
+                # The lease only expires after lease_seconds, a missed heartbeat is retried at the next interval
+                self.log(f"Lease heartbeat failed: {e}")
+                continue
+            for filename in self.filenames:
+                if filename not in held and filename not in self.lost:
+                    self.lost.add(filename)
+                    self.log(f"Lost the lease of {filename}, another worker extracts it again")
+
+    # The extraction of a file whose lease was lost stops: the merge reads it from the worker that holds the lease
+    def is_lost(self, filename):
+        return filename in self.lost
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+# Run one worker of a sharded extraction: claim files of inputdir_path from the queue of save_path,
+# extract them (both passes, or the joint pass) into the worker's own directory under save_path/shards,
+# and mark them done. The worker waits for the leases of other workers while files remain, so the files
+# of a dead worker are claimed again once its leases expire. Returns the statistics of the worker.
+def run_worker(inputdir_path, save_path, erontology, eaontology, llm, log=print, worker_id=None, max_workers=DEFAULT_MAX_WORKERS,
+               joint=False, lease_seconds=DEFAULT_LEASE_SECONDS, files_per_claim=DEFAULT_FILES_PER_CLAIM, max_attempts=DEFAULT_MAX_ATTEMPTS,
+               use_cache=True, prefilter=True, prune=False, chunk_tokens=DEFAULT_CHUNK_TOKENS, chunk_overlap=0, metrics=None, **llm_options):
+    worker_id = worker_id or default_worker_id()
+    output_dir = shard_path(save_path, worker_id)
+    metrics = metrics or RunMetrics("worker")
+    queue = WorkQueue(save_path, max_attempts)
+    summary = {"worker": worker_id, "output": output_dir, "claimed": 0, "completed": 0, "failed": 0, "lost": 0}
+    # A worker keeps every triple of each file: a file extracted again by another worker replaces its rows in the merge,
+    # so a triple must not be dropped because an earlier file of the same worker produced it. merge_shards deduplicates.
+    options = {"prefilter": prefilter, "prune": prune, "chunk_tokens": chunk_tokens, "chunk_overlap": chunk_overlap, "metrics": metrics,
+               "materialize": False, "dedup": False}
+    try:
+        version = sharding_version(erontology, eaontology, llm, joint, chunk_tokens=chunk_tokens, chunk_overlap=chunk_overlap, **({"prune": True} if prune else {}),
+                                   **({} if prefilter else {"prefilter": False}))
+        summary["queue"] = queue.populate(inputdir_path, version)
+        log(f"Worker {worker_id} joined the queue: {queue.stats()}")
+        with extraction_clients(llm, output_dir, summary, metrics, log, max_workers, use_cache, **llm_options) as (extraction_llm, runner):
+            while True:
+                batch = queue.claim(worker_id, files_per_claim, lease_seconds)
+                if not batch:
+                    if not queue.remaining():
+                        break
+                    # Every remaining file is leased by another worker: wait for it to finish or for its lease to expire
+                    time.sleep(min(queue.next_expiry() or 1.0, lease_seconds / 3) + 0.1)
+                    continue
+                summary["claimed"] += len(batch)
+                log(f"Worker {worker_id} claimed {', '.join(batch)}")
+                with Heartbeat(queue, worker_id, batch, lease_seconds, log) as heartbeat:
+                    try:
+                        passes = extract_passes(inputdir_path, output_dir, erontology, eaontology, extraction_llm, log, max_workers, joint,
+                                                runner=runner, only=batch, cancelled=heartbeat.is_lost, **options)
+                        failed = {filename for stats in passes.values() for filename in stats["failed_files"]}
+                        error = "chunks failed"
+                    except Exception as e:
+                        failed = set(batch)
+                        error = f"{type(e).__name__}: {e}"
+                        log(f"Worker {worker_id} failed to extract {', '.join(batch)}: {error}")
+                for filename in batch:
+                    if heartbeat.is_lost(filename):
+                        summary["lost"] += 1
+                    elif filename in failed:
+                        queue.fail(worker_id, filename, error)
+                        summary["failed"] += 1
+                    elif queue.complete(worker_id, filename):
+                        summary["completed"] += 1
+                    else:
+                        summary["lost"] += 1
+                        log(f"{filename} was completed by another worker after the lease of {worker_id} expired")
+        summary["queue"] = queue.stats()
+        log(f"Worker {worker_id} finished: {summary['completed']} files completed, queue {summary['queue']}")
+    finally:
+        queue.close()
+        summary["metrics"] = metrics.report()
+        metrics.save(output_dir)
+    return summary
+
+
+# Combine the outputs of the workers into the ERTriples/EATriples workbooks of save_path. The triples of
+# each completed file are read from the shard of the worker that completed it and deduplicated across files
+# and workers here (the workers keep every triple of a file); the triple store and index of save_path are rebuilt from scratch. Returns the statistics of the merge.
+def merge_shards(save_path, log=print):
+    queue = WorkQueue(save_path)
+    try:
+        stats = queue.stats()
+        done = queue.done()
+    finally:
+        queue.close()
+    if stats["pending"] or stats["leased"]:
+        log(f"Merging while {stats['pending'] + stats['leased']} files are not extracted yet")
+    shutil.rmtree(os.path.join(save_path, STORE_DIRNAME), ignore_errors=True)
+    index_path = os.path.join(save_path, TRIPLE_INDEX_FILENAME)
+    if os.path.exists(index_path):
+        os.remove(index_path)
+    store = TripleStore(save_path)
+    index = TripleIndex(save_path)
+    outputs = [ER_FILENAME, EA_FILENAME]
+    summary = {"files": len(done), "rows": {output: 0 for output in outputs}, "queue": stats}
+    try:
+        for filename, worker_id in done:
+            shard_store = TripleStore(shard_path(save_path, worker_id))
+            for output in outputs:
+                # Files without triples have no shard
+                if os.path.isfile(shard_store.shard_path(output, filename)):
+                    rows = index.add(output, filename, shard_store.read_shard(output, filename))
+                    summary["rows"][output] += store.append(output, filename, rows)
+        summary["deduplication"] = index.stats()
+    finally:
+        index.close()
+    order = [filename for filename, _ in done]
+    for output in outputs:
+        store.materialize(output, order)
+        # The merged workbooks come from the store, a later extraction into save_path must not import them as legacy rows
+        store.mark_imported(output)
+    log(f"Merged the triples of {len(done)} files from {stats['workers']} workers into {save_path}: {summary['rows']}")
+    if stats["failed"]:
+        log(f"{stats['failed']} files failed too many times and were left out")
+    return summary
@@ -0,0 +1,143 @@
+# Import related packages
+from openpyxl import Workbook
+import csv
+import os
+
+
+# Directory of the save directory holding the append-only triple shards
+STORE_DIRNAME = "triples"
+# Shard holding the rows of a workbook written before the store existed
+LEGACY_SOURCE = "_legacy"
+# Shard used when the caller does not name the source file of the triples
+DEFAULT_SOURCE = "_default"
+# Written next to the shards of an output once its workbook has been imported, so the workbook is never split again
+IMPORTED_MARKER = ".imported"
+
+# Names of the workbooks the triples are exported to and their column layout
+ER_FILENAME = "ERTriples.xlsx"
+EA_FILENAME = "EATriples.xlsx"
+ER_COLUMNS = ['head', 'key1', 'relationship', 'tail', 'key2']
+EA_COLUMNS = ['head', 'key1', 'attribute', 'tail', 'key2']
+OUTPUT_COLUMNS = {ER_FILENAME: ER_COLUMNS, EA_FILENAME: EA_COLUMNS}
+
+
+# Append-only store of extracted triples, one CSV shard per output workbook and source file.
+# Writing the triples of a file costs O(new rows); the workbooks are materialized from the shards once.
+class TripleStore:
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.root = os.path.join(output_dir, STORE_DIRNAME)
+
+    def output_dir_of(self, output):
+        return os.path.join(self.root, os.path.splitext(output)[0])
+
+    def shard_path(self, output, source):
+        return os.path.join(self.output_dir_of(output), source + ".csv")
+
+    # Source files that have a shard for the output workbook
+    def sources(self, output):
+        shard_dir = self.output_dir_of(output)
+        if not os.path.isdir(shard_dir):
+            return []
+        return sorted(name[:-len(".csv")] for name in os.listdir(shard_dir) if name.endswith(".csv"))
+
+    def has_shards(self, output):
+        return bool(self.sources(output))
+
+    # Append rows to the shard of a source file
+    def append(self, output, source, rows):
+        if not rows:
+            return 0
+        path = self.shard_path(output, source)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a', encoding='utf-8', newline='') as file:
+            csv.writer(file).writerows(rows)
+        return len(rows)
+
+    def remove(self, output, source):
+        path = self.shard_path(output, source)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def read_shard(self, output, source):
+        return list(self.iter_shard(output, source))
+
+    def iter_shard(self, output, source):
+        with open(self.shard_path(output, source), 'r', encoding='utf-8', newline='') as file:
+            yield from csv.reader(file)
+
+    def is_imported(self, output):
+        return os.path.isfile(os.path.join(self.output_dir_of(output), IMPORTED_MARKER))
+
+    def mark_imported(self, output):
+        os.makedirs(self.output_dir_of(output), exist_ok=True)
+        open(os.path.join(self.output_dir_of(output), IMPORTED_MARKER), 'w').close()
+
+    # Split a workbook written before the store existed into shards, once per save directory: the marker stays
+    # when the shards of every file are dropped, so a workbook materialized from the store is never imported again.
+    # sources lists (source file, row count) in the order their rows were appended to the workbook;
+    # the rows in front of them go to the legacy shard. With a TripleIndex, duplicate rows are dropped.
+    def import_workbook(self, output, sources=(), index=None):
+        workbook = os.path.join(self.output_dir, output)
+        if self.is_imported(output):
+            return
+        # Shards written before the marker existed already hold the rows of the workbook
+        if self.has_shards(output) or not os.path.isfile(workbook):
+            self.mark_imported(output)
+            return
+        import pandas as pd
+        rows = pd.read_excel(workbook, dtype=str, keep_default_na=False).values.tolist()
+        end = len(rows)
+        slices = []
+        for source, count in reversed(list(sources)):
+            start = max(end - count, 0)
+            slices.append((source, rows[start:end]))
+            end = start
+        slices.append((LEGACY_SOURCE, rows[:end]))
+        # Index in workbook order so that the first occurrence of a triple is the one kept
+        for source, source_rows in reversed(slices):
+            self.append(output, source, index.add(output, source, source_rows) if index else source_rows)
+        self.mark_imported(output)
+
+    # Replace the rows of a shard
+    def write(self, output, source, rows):
+        self.remove(output, source)
+        return self.append(output, source, rows)
+
+    # Shards in the order they were written: legacy and unnamed shards first, then the given source order
+    def ordered_sources(self, output, order=()):
+        sources = self.sources(output)
+        ordered = [source for source in sources if source not in order]
+        return ordered + [source for source in order if source in sources]
+
+    # Add the shards written before the deduplication index existed to the index, dropping their duplicates
+    def reindex(self, output, index, order=()):
+        for source in self.ordered_sources(output, order):
+            rows = self.read_shard(output, source)
+            kept = index.add(output, source, rows)
+            if len(kept) != len(rows):
+                self.write(output, source, kept)
+
+    # Write the output workbook from its shards. The shards are streamed into a write-only workbook,
+    # so memory does not grow with the number of triples.
+    def materialize(self, output, order=()):
+        workbook_path = os.path.join(self.output_dir, output)
+        # Shards are only created for non-empty rows, so no shard means no triples
+        sources = self.ordered_sources(output, order)
+        if not sources:
+            if os.path.isfile(workbook_path):
+                os.remove(workbook_path)
+            return 0
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet()
+        sheet.append(OUTPUT_COLUMNS[output])
+        count = 0
+        for source in sources:
+            for row in self.iter_shard(output, source):
+                sheet.append(row)
+                count += 1
+        # Written next to the workbook first, so a crash never leaves a truncated workbook behind
+        temp_path = workbook_path + ".tmp"
+        workbook.save(temp_path)
+        os.replace(temp_path, workbook_path)
+        return count
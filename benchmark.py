@@ -0,0 +1,485 @@
+# End-to-end throughput benchmark of the extraction, export and load stages without Groq or Neo4j: a deterministic
+# fake LLM client answers with triples of the ontology entities found in each chunk, and a stand-in Neo4j driver
+# records the batches written to it. The corpus is generated from example-data/example-input at any scale.
+#   python benchmark.py --files 10000 --workers 16
+#   python benchmark.py --files 1000 --llm-latency 0.2 --llm-jitter 0.05 --llm-error-rate 0.01 --save benchmark_baseline.json
+#   python benchmark.py --files 1000 --baseline benchmark_baseline.json --tolerance 0.2
+# With --baseline the exit code is 1 when a measurement is worse than the baseline by more than the tolerance.
+import argparse
+import logging
+import threading
+import tracemalloc
+import resource
+import shutil
+import random
+import json
+import time
+import zlib
+import re
+import sys
+import os
+from knowledge_graph_builder import LLMClient
+from KGMatcher import AhoCorasick, ontology_terms
+from KGMetrics import RunMetrics
+from KGNeo4j import BatchKGToNeo4j, DEFAULT_BATCH_SIZE, DEFAULT_WRITERS
+from KGGenerate import define_ERontology, define_EAontology, split_sentences, DEFAULT_MAX_WORKERS, DEFAULT_CHUNK_TOKENS
+from KGPipeline import extract_knowledge_graph, load_knowledge_graph
+
+
+DEFAULT_SOURCE_DIR = os.path.join("example-data", "example-input")
+DEFAULT_FILES = 1000
+DEFAULT_WORKDIR = "benchmark-data"
+DEFAULT_TOLERANCE = 0.2
+# Parameters of the corpus, so that an existing corpus is reused only when it was generated the same way
+CORPUS_FILENAME = "corpus.json"
+# Most triples the fake LLM returns for one chunk
+DEFAULT_TRIPLES_PER_CHUNK = 8
+# Quota large enough that the scheduler never throttles the fake LLM
+UNLIMITED_PER_MINUTE = 10 ** 9
+
+
+# Error of the fake LLM, a temporary server error that the scheduler retries
+class FakeLLMError(Exception):
+    status_code = 503
+
+
+# Deterministic LLM stand-in: the answer, latency and errors of a request only depend on its messages, the
+# attempt and the seed, never on the order in which the worker threads send them. Relationships link the ontology entities
+# found in a chunk, attributes give each entity a value taken from the text.
+class FakeLLMClient(LLMClient):
+    def __init__(self, erontology, eaontology, latency=0.0, jitter=0.0, error_rate=0.0, triples_per_chunk=DEFAULT_TRIPLES_PER_CHUNK, seed=0):
+        self._model = "fake-llm"
+        self._temperature = 0.0
+        self._top_p = 1.0
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.triples_per_chunk = triples_per_chunk
+        self.seed = seed
+        self.relationships = list(erontology.relationships)
+        self.attributes = [name for attribute in eaontology.attributes for name in (attribute.keys() if isinstance(attribute, dict) else [attribute])]
+        terms = ontology_terms(erontology)
+        terms.update(ontology_terms(eaontology))
+        # Entity types are not names of entities
+        entity_types = set(terms.values())
+        self.matcher = AhoCorasick({term: entity_type for term, entity_type in terms.items() if term not in entity_types})
+        self.calls = 0
+        self.errors = 0
+        self.attempts = {}
+        self._lock = threading.Lock()
+
+    def entities(self, text):
+        found = {}
+        for term, entity_type in self.matcher.iter_matches(text):
+            found.setdefault(term, entity_type)
+        return list(found.items())[:self.triples_per_chunk + 1]
+
+    def relationship_edges(self, entities, rng):
+        return [
+            {
+                "node_1": {"entity": type1, "name": name1},
+                "node_2": {"entity": type2, "name": name2},
+                "relationship": rng.choice(self.relationships),
+            }
+            for (name1, type1), (name2, type2) in zip(entities, entities[1:])
+        ]
+
+    def attribute_edges(self, entities, text, rng):
+        edges = []
+        for name, entity_type in entities[:self.triples_per_chunk]:
+            attribute = rng.choice(self.attributes)
+            start = rng.randrange(max(len(text) - 20, 1))
+            edges.append({
+                "node_1": {"entity": entity_type, "name": name},
+                "node_2": {"attribute": attribute, "name": text[start:start + 20]},
+                "relationship": attribute,
+            })
+        return edges
+
+    def generate_response(self, user_message, system_message):
+        key = zlib.crc32((system_message + user_message).encode("utf-8")) ^ self.seed
+        with self._lock:
+            self.calls += 1
+            # A retry of the same request draws its latency and error again
+            attempt = self.attempts.get(key, 0)
+            self.attempts[key] = attempt + 1
+        draw = random.Random(key * 1000003 + attempt)
+        delay = max(self.latency + draw.uniform(-self.jitter, self.jitter), 0)
+        if delay:
+            time.sleep(delay)
+        failed = draw.random() < self.error_rate
+        if failed:
+            with self._lock:
+                self.errors += 1
+        if failed:
+            raise FakeLLMError("fake LLM: 503 Service Unavailable")
+        # The chunk is delimited by ``` in the extraction prompts, and sent as is to be summarised
+        text = user_message.split("```")[1].strip() if user_message.count("```") >= 2 else user_message
+        if "Succinctly summarise" in system_message:
+            return text[:50]
+        rng = random.Random(key)
+        entities = self.entities(text)
+        has_relationships = "'relationships':" in system_message
+        has_attributes = "'attributes':" in system_message
+        if has_relationships and has_attributes:
+            answer = {"relationships": self.relationship_edges(entities, rng), "attributes": self.attribute_edges(entities, text, rng)}
+        elif has_attributes:
+            answer = self.attribute_edges(entities, text, rng)
+        else:
+            answer = self.relationship_edges(entities, rng)
+        return json.dumps(answer, ensure_ascii=False)
+
+    def stats(self):
+        return {"calls": self.calls, "errors": self.errors}
+
+
+# Result of tx.run and session.run; the summary of an EXPLAIN carries its plan
+class FakeResult:
+    def __init__(self, plan=None):
+        self.plan = plan
+
+    def consume(self):
+        return FakeSummary(self.plan)
+
+
+class FakeSummary:
+    def __init__(self, plan=None):
+        self.plan = plan
+
+
+# Nodes a MERGE statement locks: (label, parameter) of every (n:`Label` {name: row.parameter}) pattern
+NODE_PATTERN = re.compile(r"\(\w+:`((?:[^`]|``)*)` \{name: row\.(\w+)\}\)")
+
+
+class FakeTransaction:
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+        # (label, name) of the nodes locked, in the order they are first locked
+        self.locks = {}
+
+    def run(self, query, **parameters):
+        self.statements += 1
+        rows = parameters.get("rows", ())
+        self.rows += len(rows)
+        patterns = [(label.replace("``", "`"), field) for label, field in NODE_PATTERN.findall(query)]
+        for row in rows:
+            for label, field in patterns:
+                self.locks.setdefault((label, row[field]), len(self.locks))
+        return FakeResult()
+
+
+# Two transactions deadlock when each locks a node the other locked earlier: shared nodes taken in opposite orders
+def lock_cycle(first, second):
+    shared = sorted((position, second[node]) for node, position in first.items() if node in second)
+    return any(earlier[1] > later[1] for earlier, later in zip(shared, shared[1:]))
+
+
+# Deadlock reported by the fake Neo4j, with the code of the real one
+class FakeTransientError(Exception):
+    code = "Neo.TransientError.Transaction.DeadlockDetected"
+
+
+# Neo4j driver stand-in: every write transaction takes commit_latency seconds (plus jitter) and row_latency
+# seconds per row, and its statements and rows are counted instead of written. A transaction that locks nodes
+# in the opposite order of a transaction still running fails with a deadlock, as does a share deadlock_rate of
+# the others; lock_waits counts the transactions that lock a node a running transaction holds.
+class FakeNeo4jDriver:
+    def __init__(self, commit_latency=0.0, jitter=0.0, seed=0, deadlock_rate=0.0, row_latency=0.0):
+        self.commit_latency = commit_latency
+        self.row_latency = row_latency
+        self.jitter = jitter
+        self.deadlock_rate = deadlock_rate
+        self.rng = random.Random(seed)
+        self.commits = 0
+        self.deadlocks = 0
+        self.lock_waits = 0
+        self.statements = 0
+        self.rows = 0
+        # Labels with a constraint or an index on name: their MERGE is planned as an index seek
+        self.indexed_labels = set()
+        # Transactions being committed
+        self.running = []
+        self._lock = threading.Lock()
+
+    def session(self):
+        return FakeNeo4jSession(self)
+
+    def commit(self, transaction):
+        with self._lock:
+            delay = max(self.commit_latency + self.rng.uniform(-self.jitter, self.jitter), 0) + transaction.rows * self.row_latency
+            if self.rng.random() < self.deadlock_rate or any(lock_cycle(transaction.locks, other.locks) for other in self.running):
+                self.deadlocks += 1
+                raise FakeTransientError("Deadlock detected while trying to acquire locks")
+            if any(not other.locks.keys().isdisjoint(transaction.locks) for other in self.running):
+                self.lock_waits += 1
+            self.commits += 1
+            self.statements += transaction.statements
+            self.rows += transaction.rows
+            self.running.append(transaction)
+        try:
+            if delay:
+                time.sleep(delay)
+        finally:
+            with self._lock:
+                self.running.remove(transaction)
+
+    def close(self):
+        pass
+
+    # Schema statements and EXPLAIN, run outside of a write transaction
+    def run(self, query, **parameters):
+        match = re.search(r"\(n:`((?:[^`]|``)*)`", query)
+        label = match.group(1).replace("``", "`") if match else None
+        if query.startswith(("CREATE CONSTRAINT", "CREATE INDEX")):
+            with self._lock:
+                self.indexed_labels.add(label)
+            return FakeResult()
+        if query.startswith("EXPLAIN"):
+            seek = "NodeUniqueIndexSeek" if label in self.indexed_labels else "NodeByLabelScan"
+            return FakeResult({"operatorType": "ProduceResults@neo4j", "children": [
+                {"operatorType": "EmptyResult@neo4j", "children": [{"operatorType": "Merge@neo4j", "children": [{"operatorType": f"{seek}@neo4j", "children": []}]}]}
+            ]})
+        raise ValueError(f"Unexpected query outside of a transaction: {query}")
+
+    def stats(self):
+        return {"commits": self.commits, "deadlocks": self.deadlocks, "lock_waits": self.lock_waits, "statements": self.statements, "rows": self.rows,
+                "indexed_labels": len(self.indexed_labels)}
+
+
+class FakeNeo4jSession:
+    def __init__(self, driver):
+        self.driver = driver
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def close(self):
+        pass
+
+    def run(self, query, **parameters):
+        return self.driver.run(query, **parameters)
+
+    def execute_write(self, transaction_function, *args, **kwargs):
+        transaction = FakeTransaction()
+        result = transaction_function(transaction, *args, **kwargs)
+        self.driver.commit(transaction)
+        return result
+
+
+# BatchKGToNeo4j writing to a FakeNeo4jDriver: the batching, grouping and deduplication are the real ones
+class FakeBatchKGToNeo4j(BatchKGToNeo4j):
+    def __init__(self, driver, batch_size=DEFAULT_BATCH_SIZE, log=print, metrics=None, writers=DEFAULT_WRITERS):
+        super().__init__("fake://neo4j", None, None, batch_size, log, metrics=metrics, writers=writers, retry_delay=0.01)
+        self.fake_driver = driver
+
+    def get_driver(self):
+        return self.fake_driver
+
+
+# Write files .txt files to target_dir, made of the sentences of the example texts shuffled with the seed.
+# The files are about as long as the example files; an existing corpus generated the same way is reused.
+def generate_corpus(source_dir, target_dir, files, seed=0, log=print):
+    parameters = {"source_dir": os.path.abspath(source_dir), "files": files, "seed": seed}
+    marker = os.path.join(target_dir, CORPUS_FILENAME)
+    if os.path.exists(marker):
+        with open(marker, "r", encoding="utf-8") as file:
+            if json.load(file) == parameters:
+                log(f"Reusing the corpus of {files} files in {target_dir}")
+                return target_dir
+    shutil.rmtree(target_dir, ignore_errors=True)
+    os.makedirs(target_dir)
+    sentences = []
+    sizes = []
+    for filename in sorted(os.listdir(source_dir)):
+        if filename.endswith(".txt"):
+            with open(os.path.join(source_dir, filename), "r", encoding="utf-8") as file:
+                text = file.read()
+            sizes.append(len(text))
+            for line in text.splitlines():
+                sentences.extend(split_sentences(line.strip()))
+    if not sentences:
+        raise ValueError(f"No .txt file to generate the corpus from in {source_dir}")
+    rng = random.Random(seed)
+    width = len(str(files))
+    for number in range(files):
+        size = rng.choice(sizes)
+        lines = []
+        line = ""
+        length = 0
+        while length < size:
+            sentence = rng.choice(sentences)
+            line += sentence
+            length += len(sentence)
+            # A paragraph break every few sentences, like the example texts
+            if rng.random() < 0.2:
+                lines.append(line)
+                line = ""
+        lines.append(line)
+        with open(os.path.join(target_dir, f"text{number:0{width}d}.txt"), "w", encoding="utf-8") as file:
+            file.write("\n".join(lines))
+    with open(marker, "w", encoding="utf-8") as file:
+        json.dump(parameters, file)
+    log(f"Generated a corpus of {files} files in {target_dir}")
+    return target_dir
+
+
+# Peak resident set size of the process so far, in MB
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes on Linux
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+# Run a stage, returning its result, wall time and (with trace_memory) peak of the Python allocations
+def run_stage(function, trace_memory):
+    if trace_memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        result = function()
+    finally:
+        seconds = time.perf_counter() - start
+        peak = tracemalloc.get_traced_memory()[1] if trace_memory else None
+        if trace_memory:
+            tracemalloc.stop()
+    timing = {"seconds": round(seconds, 3), "peak_rss_mb": peak_rss_mb()}
+    if peak is not None:
+        timing["peak_traced_mb"] = round(peak / (1024 * 1024), 1)
+    return result, timing
+
+
+def run_benchmark(args, log):
+    erontology, eaontology = define_ERontology(), define_EAontology()
+    corpus_dir = generate_corpus(args.source, os.path.join(args.workdir, "corpus"), args.files, args.seed, log)
+    output_dir = os.path.join(args.workdir, "output")
+    # Every run starts from an empty output directory: no manifest, cache or triple index of a previous run
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+    llm = FakeLLMClient(erontology, eaontology, args.llm_latency, args.llm_jitter, args.llm_error_rate, args.triples_per_chunk, args.seed)
+    extract_metrics = RunMetrics("extract")
+    extract_summary, extract_timing = run_stage(lambda: extract_knowledge_graph(
+        corpus_dir, output_dir, erontology, eaontology, llm, log, args.workers, args.joint, use_cache=False, prefilter=not args.no_prefilter, prune=args.prune,
+        chunk_tokens=args.chunk_tokens or None, requests_per_minute=UNLIMITED_PER_MINUTE, tokens_per_minute=UNLIMITED_PER_MINUTE,
+        use_async=args.use_async, metrics=extract_metrics,
+    ), args.trace_memory)
+
+    driver = FakeNeo4jDriver(args.commit_latency, args.commit_jitter, args.seed, args.deadlock_rate, args.row_latency)
+    load_metrics = RunMetrics("load")
+    loader = FakeBatchKGToNeo4j(driver, args.batch_size, log, load_metrics, args.writers)
+    load_summary, load_timing = run_stage(lambda: load_knowledge_graph(
+        output_dir, None, None, None, erontology, eaontology, log, args.batch_size, load_metrics, loader,
+    ), args.trace_memory)
+
+    extract_report = extract_metrics.report()
+    load_report = load_metrics.report()
+    counters = extract_report["counters"]
+    extract_stages = extract_report["stages"]
+    # Export and materialization run inside the extraction passes; the extraction stage is the rest
+    export_seconds = extract_stages.get("export", {}).get("seconds", 0.0) + extract_stages.get("materialize", {}).get("seconds", 0.0)
+    stages = {
+        "extract": {**extract_timing, "seconds": round(extract_timing["seconds"] - export_seconds, 3)},
+        "export": {"seconds": round(export_seconds, 3)},
+        "load": load_timing,
+    }
+    timings = {
+        "extract_seconds": stages["extract"]["seconds"],
+        "export_seconds": stages["export"]["seconds"],
+        "load_seconds": stages["load"]["seconds"],
+        # Commit time of the relationship and of the attribute workbooks, to compare --writers on each
+        "relationship_load_seconds": round(sum(stats.get("seconds", 0.0) for stats in load_summary.values() if stats["kind"] == "relationship"), 3),
+        "attribute_load_seconds": round(sum(stats.get("seconds", 0.0) for stats in load_summary.values() if stats["kind"] == "attribute"), 3),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    throughput = {
+        "files_per_second": round(args.files / extract_timing["seconds"], 3) if extract_timing["seconds"] else 0.0,
+        "chunks_per_second": round(counters.get("chunks_extracted", 0) / extract_timing["seconds"], 3) if extract_timing["seconds"] else 0.0,
+        "triples_extracted_per_second": extract_report["triples_per_second"],
+        "triples_loaded_per_second": round(load_report["counters"].get("triples_written", 0) / load_timing["seconds"], 3) if load_timing["seconds"] else 0.0,
+    }
+    return {
+        "parameters": {name: value for name, value in vars(args).items() if name not in ("save", "baseline", "tolerance", "quiet")},
+        "throughput": throughput,
+        "timings": timings,
+        "stages": stages,
+        "extract": {"stages": extract_stages, "counters": counters, "histograms": extract_report["histograms"],
+                    "llm": llm.stats(), "failed_chunks": sum(stats["failed_chunks"] for stats in extract_summary["passes"].values())},
+        "load": {"stages": load_report["stages"], "counters": load_report["counters"], "histograms": load_report["histograms"], "neo4j": driver.stats()},
+    }
+
+
+# Measurements worse than the baseline by more than the tolerance: slower timings, more memory, lower throughput
+def regressions(report, baseline, tolerance):
+    worse = {}
+    for name, value in report["timings"].items():
+        reference = baseline.get("timings", {}).get(name)
+        if reference and value > reference * (1 + tolerance):
+            worse[name] = {"baseline": reference, "current": value}
+    for name, value in report["throughput"].items():
+        reference = baseline.get("throughput", {}).get(name)
+        if reference and value < reference * (1 - tolerance):
+            worse[name] = {"baseline": reference, "current": value}
+    return worse
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Throughput benchmark of extraction, export and loading with a fake LLM and a fake Neo4j.")
+    parser.add_argument("--files", type=int, default=DEFAULT_FILES, help="Files of the generated corpus.")
+    parser.add_argument("--source", default=DEFAULT_SOURCE_DIR, help="Directory of the .txt files the corpus is generated from.")
+    parser.add_argument("--workdir", default=DEFAULT_WORKDIR, help="Directory of the corpus and of the extracted triples.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS)
+    parser.add_argument("--joint", action="store_true")
+    parser.add_argument("--async", dest="use_async", action="store_true")
+    parser.add_argument("--no-prefilter", action="store_true")
+    parser.add_argument("--prune", action="store_true")
+    parser.add_argument("--chunk-tokens", type=int, default=DEFAULT_CHUNK_TOKENS, help="0 for one chunk per line.")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds per fake LLM request.")
+    parser.add_argument("--llm-jitter", type=float, default=0.0, help="Uniform jitter in seconds around --llm-latency.")
+    parser.add_argument("--llm-error-rate", type=float, default=0.0, help="Share of fake LLM requests failing with a retryable 503.")
+    parser.add_argument("--triples-per-chunk", type=int, default=DEFAULT_TRIPLES_PER_CHUNK)
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--commit-latency", type=float, default=0.0, help="Seconds per fake Neo4j transaction.")
+    parser.add_argument("--commit-jitter", type=float, default=0.0)
+    parser.add_argument("--row-latency", type=float, default=0.0, help="Seconds per row written by a fake Neo4j transaction.")
+    parser.add_argument("--writers", type=int, default=DEFAULT_WRITERS, help="Concurrent Neo4j writer sessions.")
+    parser.add_argument("--deadlock-rate", type=float, default=0.0, help="Share of fake Neo4j transactions failing with a deadlock.")
+    parser.add_argument("--trace-memory", action="store_true", help="Also report the peak Python allocations of each stage (slower).")
+    parser.add_argument("--quiet", action="store_true", help="Do not print the log lines of the pipeline and of knowledge_graph_builder.")
+    parser.add_argument("--save", help="Write the report to this JSON file.")
+    parser.add_argument("--baseline", help="Compare with a report written by --save.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+    log = (lambda message: None) if args.quiet else (lambda message: print(message, file=sys.stderr, flush=True))
+    if args.quiet:
+        # The knowledge_graph_builder loggers print every prompt and response
+        logging.disable(logging.CRITICAL)
+
+    report = run_benchmark(args, log)
+    for name, value in report["throughput"].items():
+        print(f"{name}: {value:.1f}")
+    for name, stage in report["stages"].items():
+        print(f"{name}: {stage['seconds']:.3f} s" + "".join(f", {key} {value}" for key, value in stage.items() if key != "seconds"))
+    print(f"relationship load: {report['timings']['relationship_load_seconds']:.3f} s, attribute load: {report['timings']['attribute_load_seconds']:.3f} s")
+    print(f"peak_rss_mb: {report['timings']['peak_rss_mb']:.1f}")
+    print(f"LLM requests: {report['extract']['llm']['calls']}, errors: {report['extract']['llm']['errors']}, "
+          f"failed chunks: {report['extract']['failed_chunks']}, Neo4j commits: {report['load']['neo4j']['commits']}, deadlocks: {report['load']['neo4j']['deadlocks']}, "
+          f"lock waits: {report['load']['neo4j']['lock_waits']}, rows: {report['load']['neo4j']['rows']}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            worse = regressions(report, json.load(file), args.tolerance)
+        for name, values in worse.items():
+            print(f"Regression: {name} {values['current']:.3f}, baseline {values['baseline']:.3f}")
+        return 1 if worse else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
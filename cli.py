@@ -0,0 +1,177 @@
+# Headless entry point: extract knowledge graph triples and load them into Neo4j without the Qt UI.
+#   python cli.py extract --input example-data/example-input --output example-data/example-output
+#   python cli.py load --input example-data/example-output --uri bolt://localhost:7687
+# First load of a large graph: write neo4j-admin import files instead, then run the script written next to them.
+#   python cli.py bulk-export --input example-data/example-output
+# Sharded extraction: start workers on any machine sharing the output directory, then merge their outputs.
+#   python cli.py work --input /shared/input --output /shared/output --processes 4
+#   python cli.py merge --input /shared/output
+# Log lines go to stderr; the summary statistics of the run are printed to stdout as JSON.
+import argparse
+import subprocess
+import json
+import sys
+import os
+from dotenv import load_dotenv
+from knowledge_graph_builder import GroqClient
+from KGScheduler import DEFAULT_REQUESTS_PER_MINUTE, DEFAULT_TOKENS_PER_MINUTE
+from KGAsync import DEFAULT_MAX_IN_FLIGHT
+from KGNeo4j import DEFAULT_BATCH_SIZE, DEFAULT_WRITERS
+from KGGenerate import define_ERontology, define_EAontology, DEFAULT_MAX_WORKERS, DEFAULT_CHUNK_TOKENS
+from KGPipeline import extract_knowledge_graph, load_knowledge_graph, bulk_export_knowledge_graph
+from KGBulkImport import DEFAULT_DATABASE
+from KGMetrics import RunMetrics
+from KGShard import run_worker, merge_shards, DEFAULT_LEASE_SECONDS, DEFAULT_FILES_PER_CLAIM, DEFAULT_MAX_ATTEMPTS
+
+
+# Same model and sampling parameters as the UI
+DEFAULT_MODEL = "llama3-70b-8192"
+DEFAULT_URI = "bolt://localhost:7687"
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Knowledge graph generator without the UI.")
+    parser.add_argument("--quiet", action="store_true", help="Only print the JSON summary.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    extract = subparsers.add_parser("extract", help="Extract triples from the .txt files of a directory into EXCEL files.")
+    add_extraction_arguments(extract)
+    extract.add_argument("--prometheus", help="Also write the run metrics to this Prometheus textfile (.prom).")
+
+    work = subparsers.add_parser("work", help="Run workers of a sharded extraction sharing the work queue of the output directory.")
+    add_extraction_arguments(work)
+    work.add_argument("--processes", type=int, default=1, help="Worker processes started on this machine.")
+    work.add_argument("--worker-id", help="Unique name of the worker, defaults to <hostname>-<pid>; with --processes, <id>-<n> for child n.")
+    work.add_argument("--lease-seconds", type=float, default=DEFAULT_LEASE_SECONDS, help="Files of a worker silent for this long are claimed again.")
+    work.add_argument("--files-per-claim", type=int, default=DEFAULT_FILES_PER_CLAIM)
+    work.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS)
+
+    merge = subparsers.add_parser("merge", help="Combine the outputs of the workers into the ERTriples/EATriples EXCEL files.")
+    merge.add_argument("--input", required=True, help="Output directory shared by the workers.")
+
+    load = subparsers.add_parser("load", help="Load the triples EXCEL files of a directory into Neo4j.")
+    load.add_argument("--input", required=True, help="Directory of the ERTriples/EATriples EXCEL files.")
+    load.add_argument("--uri", default=os.getenv("NEO4J_URI") or DEFAULT_URI)
+    load.add_argument("--username", default=os.getenv("NEO4J_USERNAME"))
+    load.add_argument("--password", default=os.getenv("NEO4J_PASSWORD"), help="Defaults to NEO4J_PASSWORD of the environment or .env.")
+    load.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    load.add_argument("--writers", type=int, default=DEFAULT_WRITERS, help="Sessions writing to Neo4j at the same time, about the number of database cores.")
+    load.add_argument("--no-schema", action="store_true", help="Do not create the uniqueness constraints of the node labels before loading.")
+    load.add_argument("--prometheus", help="Also write the run metrics to this Prometheus textfile (.prom).")
+
+    bulk_export = subparsers.add_parser("bulk-export", help="Write the triples EXCEL files of a directory as neo4j-admin database import files.")
+    bulk_export.add_argument("--input", required=True, help="Directory of the ERTriples/EATriples EXCEL files.")
+    bulk_export.add_argument("--output", help="Directory of the import files, defaults to neo4j-import in the input directory.")
+    bulk_export.add_argument("--database", default=DEFAULT_DATABASE, help="Database created by the import script.")
+    bulk_export.add_argument("--prometheus", help="Also write the run metrics to this Prometheus textfile (.prom).")
+    return parser
+
+
+def add_extraction_arguments(parser):
+    parser.add_argument("--input", required=True, help="Directory of the .txt files to extract.")
+    parser.add_argument("--output", required=True, help="Directory the triples are saved to.")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS, help="Concurrent LLM requests.")
+    parser.add_argument("--model", default=DEFAULT_MODEL, help="Groq model name.")
+    parser.add_argument("--temperature", type=float, default=0.1)
+    parser.add_argument("--top-p", type=float, default=0.5)
+    parser.add_argument("--joint", action="store_true", help="Extract relationships and attributes in one LLM call per chunk.")
+    parser.add_argument("--no-cache", action="store_true", help="Do not cache the LLM responses in the output directory.")
+    parser.add_argument("--no-prefilter", action="store_true", help="Also send the chunks that mention no ontology entity.")
+    parser.add_argument("--prune", action="store_true", help="Send every chunk with only the relationships and attributes it mentions instead of the whole ontology.")
+    parser.add_argument("--chunk-tokens", type=int, default=DEFAULT_CHUNK_TOKENS, help="Token budget of a chunk, 0 for one chunk per line.")
+    parser.add_argument("--chunk-overlap", type=int, default=0)
+    parser.add_argument("--requests-per-minute", type=int, default=DEFAULT_REQUESTS_PER_MINUTE)
+    parser.add_argument("--tokens-per-minute", type=int, default=DEFAULT_TOKENS_PER_MINUTE)
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Send the requests from one asyncio event loop.")
+    parser.add_argument("--max-in-flight", type=int, default=DEFAULT_MAX_IN_FLIGHT, help="Requests in flight with --async.")
+
+
+def run_extract(args, log):
+    llm = GroqClient(model=args.model, temperature=args.temperature, top_p=args.top_p)
+    summary = extract_knowledge_graph(
+        args.input, args.output, define_ERontology(), define_EAontology(), llm, log, args.workers, args.joint,
+        use_cache=not args.no_cache, prefilter=not args.no_prefilter, prune=args.prune, chunk_tokens=args.chunk_tokens or None,
+        chunk_overlap=args.chunk_overlap, requests_per_minute=args.requests_per_minute, tokens_per_minute=args.tokens_per_minute,
+        use_async=args.use_async, max_in_flight=args.max_in_flight, metrics=RunMetrics("extract", args.prometheus),
+    )
+    failed = sum(stats["failed_chunks"] for stats in summary["passes"].values())
+    return summary, failed == 0
+
+
+# With --processes N, N copies of this command are started with --processes 1 and their summaries collected.
+# The quota options apply to every worker, so divide the provider quota by the number of workers.
+def run_work(args, log):
+    if args.processes > 1:
+        argv = without_option(without_option(args.argv, "--processes"), "--worker-id") + ["--processes", "1"]
+        # Each child needs its own worker id (and output directory): a given id gets a -<n> suffix, otherwise the default id uses the pid
+        worker_ids = [[f"--worker-id={args.worker_id}-{number}"] if args.worker_id else [] for number in range(args.processes)]
+        processes = [subprocess.Popen([sys.executable, os.path.abspath(__file__)] + argv + worker_id, stdout=subprocess.PIPE, text=True) for worker_id in worker_ids]
+        results = [json.loads(process.communicate()[0] or "{}") for process in processes]
+        return {"workers": results}, all(process.returncode == 0 for process in processes)
+    llm = GroqClient(model=args.model, temperature=args.temperature, top_p=args.top_p)
+    summary = run_worker(
+        args.input, args.output, define_ERontology(), define_EAontology(), llm, log, args.worker_id, args.workers, args.joint,
+        args.lease_seconds, args.files_per_claim, args.max_attempts, use_cache=not args.no_cache, prefilter=not args.no_prefilter,
+        prune=args.prune, chunk_tokens=args.chunk_tokens or None, chunk_overlap=args.chunk_overlap, requests_per_minute=args.requests_per_minute,
+        tokens_per_minute=args.tokens_per_minute, use_async=args.use_async, max_in_flight=args.max_in_flight,
+    )
+    return summary, summary["failed"] == 0
+
+
+# Command line arguments without an option and its value, given as "--name value" or "--name=value"
+def without_option(argv, name):
+    kept = []
+    skip = False
+    for arg in argv:
+        if skip:
+            skip = False
+        elif arg == name:
+            skip = True
+        elif not arg.startswith(name + "="):
+            kept.append(arg)
+    return kept
+
+
+def run_merge(args, log):
+    summary = merge_shards(args.input, log)
+    return summary, summary["queue"]["failed"] == 0
+
+
+def run_load(args, log):
+    metrics = RunMetrics("load", args.prometheus)
+    summary = load_knowledge_graph(args.input, args.uri, args.username, args.password, define_ERontology(), define_EAontology(), log, args.batch_size, metrics,
+                                   writers=args.writers, schema=not args.no_schema)
+    summary = {"workbooks": summary, "metrics": metrics.report()}
+    return summary, all(stats["kind"] is not None for stats in summary["workbooks"].values())
+
+
+def run_bulk_export(args, log):
+    metrics = RunMetrics("bulk_export", args.prometheus)
+    summary = bulk_export_knowledge_graph(args.input, define_ERontology(), args.output, log, args.database, metrics)
+    return summary, not summary["problems"]
+
+
+# Exit code 0 when everything was extracted, merged, loaded or exported, 1 when chunks or files failed, workbooks were not recognized
+# or the import files did not pass the check, 2 on errors
+def main(argv=None):
+    load_dotenv()
+    args = build_parser().parse_args(argv)
+    args.argv = sys.argv[1:] if argv is None else list(argv)
+    log = (lambda message: None) if args.quiet else (lambda message: print(message, file=sys.stderr, flush=True))
+    if not os.path.isdir(args.input):
+        print(json.dumps({"command": args.command, "ok": False, "error": f"{args.input} is not a directory"}))
+        return 2
+    try:
+        summary, ok = COMMANDS[args.command](args, log)
+    except Exception as e:
+        print(json.dumps({"command": args.command, "ok": False, "error": f"{type(e).__name__}: {e}"}))
+        return 2
+    print(json.dumps({"command": args.command, "ok": ok, "summary": summary}, ensure_ascii=False, default=str))
+    return 0 if ok else 1
+
+
+COMMANDS = {"extract": run_extract, "work": run_work, "merge": run_merge, "load": run_load, "bulk-export": run_bulk_export}
+
+
+if __name__ == "__main__":
+    sys.exit(main())
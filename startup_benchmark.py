@@ -0,0 +1,149 @@
+# Measure the cold start of the UI: the time from a fresh interpreter to the first paint of the main window,
+# and the import time of ui.py and KGGenerate.py broken down by top-level package (python -X importtime).
+#   python startup_benchmark.py --runs 5
+#   python startup_benchmark.py --save startup_baseline.json
+#   python startup_benchmark.py --baseline startup_baseline.json --tolerance 0.2
+# With --baseline the exit code is 1 when a measurement is slower than the baseline by more than the tolerance.
+import argparse
+import statistics
+import subprocess
+import json
+import sys
+import os
+
+
+# Modules whose import time is measured
+MODULES = ["ui", "KGGenerate"]
+DEFAULT_RUNS = 5
+DEFAULT_TOLERANCE = 0.2
+
+# Run in a fresh interpreter: import ui, show the main window and stop at its first paint event
+FIRST_PAINT_SCRIPT = """
+import time
+start = time.perf_counter()
+import ui
+from PyQt5.QtCore import QObject, QEvent, QTimer, QCoreApplication, Qt
+from PyQt5.QtWidgets import QApplication
+imported = time.perf_counter()
+QCoreApplication.setAttribute(Qt.AA_ShareOpenGLContexts)
+app = QApplication([])
+
+class FirstPaint(QObject):
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint and not hasattr(self, "painted"):
+            self.painted = time.perf_counter()
+            QTimer.singleShot(0, app.quit)
+        return False
+
+window = ui.MyWindow()
+first_paint = FirstPaint()
+window.installEventFilter(first_paint)
+window.show()
+QTimer.singleShot(10000, app.quit)
+app.exec_()
+print(f"{(imported - start) * 1000:.1f} {(getattr(first_paint, 'painted', time.perf_counter()) - start) * 1000:.1f}")
+"""
+
+
+def package_dir():
+    return os.path.dirname(os.path.abspath(__file__))
+
+
+def run_python(args, env=None):
+    return subprocess.run([sys.executable] + args, cwd=package_dir(), capture_output=True, text=True, env=env)
+
+
+# Import time of a module in milliseconds, and the cumulative import time of each module it imports directly
+def import_breakdown(module):
+    result = run_python(["-X", "importtime", "-c", f"import {module}"])
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed: {result.stderr.strip().splitlines()[-1]}")
+    total = 0.0
+    packages = {}
+    for line in result.stderr.splitlines():
+        parts = line[len("import time:"):].split("|")
+        if not line.startswith("import time:") or len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2][1:]
+        level = (len(name) - len(name.lstrip())) // 2
+        ms = int(parts[1]) / 1000
+        # Nested imports are printed before the module importing them, two spaces deeper
+        if level == 0:
+            if name.strip() == module:
+                total = ms
+                break
+            packages = {}
+        elif level == 1:
+            packages[name.strip()] = packages.get(name.strip(), 0) + ms
+    return total, packages
+
+
+def first_paint(runs, platform):
+    env = dict(os.environ)
+    if platform:
+        env["QT_QPA_PLATFORM"] = platform
+    imports, paints = [], []
+    for _ in range(runs):
+        result = run_python(["-c", FIRST_PAINT_SCRIPT], env)
+        if result.returncode != 0:
+            raise RuntimeError(f"first paint run failed: {result.stderr.strip().splitlines()[-1]}")
+        imported, painted = map(float, result.stdout.split()[-2:])
+        imports.append(imported)
+        paints.append(painted)
+    return {"ui_import_ms": statistics.median(imports), "first_paint_ms": statistics.median(paints)}
+
+
+def measure(runs, platform, paint=True):
+    report = {"imports": {}, "timings": {}}
+    for module in MODULES:
+        total, packages = import_breakdown(module)
+        report["imports"][module] = dict(sorted(packages.items(), key=lambda item: -item[1]))
+        report["timings"][f"{module}_import_ms"] = round(total, 1)
+    if paint:
+        report["timings"].update(first_paint(runs, platform))
+    return report
+
+
+# Timings slower than the baseline by more than the tolerance
+def regressions(report, baseline, tolerance):
+    slower = {}
+    for name, value in report["timings"].items():
+        reference = baseline.get("timings", {}).get(name)
+        if reference and value > reference * (1 + tolerance):
+            slower[name] = {"baseline": reference, "current": value}
+    return slower
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cold start benchmark of ui.py and KGGenerate.py.")
+    parser.add_argument("--runs", type=int, default=DEFAULT_RUNS, help="Fresh interpreters started for the first paint measurement.")
+    parser.add_argument("--platform", default="offscreen", help="QT_QPA_PLATFORM of the first paint runs, empty for the default.")
+    parser.add_argument("--no-paint", action="store_true", help="Only measure the import times.")
+    parser.add_argument("--top", type=int, default=10, help="Packages shown per module.")
+    parser.add_argument("--save", help="Write the report to this JSON file.")
+    parser.add_argument("--baseline", help="Compare with a report written by --save.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    report = measure(args.runs, args.platform, not args.no_paint)
+    for module, packages in report["imports"].items():
+        print(f"import {module}: {report['timings'][f'{module}_import_ms']:.1f} ms")
+        for name, ms in list(packages.items())[:args.top]:
+            print(f"    {ms:8.1f} ms  {name}")
+    for name, value in report["timings"].items():
+        print(f"{name}: {value:.1f}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as file:
+            slower = regressions(report, json.load(file), args.tolerance)
+        for name, values in slower.items():
+            print(f"Regression: {name} {values['current']:.1f} ms, baseline {values['baseline']:.1f} ms")
+        return 1 if slower else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
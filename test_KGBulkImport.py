@@ -0,0 +1,52 @@
+# Tests of the neo4j-admin import files: run with python -m pytest
+from KGBulkImport import BULK_IMPORT_MANIFEST, bulk_export_directory, verify_bulk_import
+from KGGenerate import define_ERontology
+from openpyxl import Workbook
+import json
+import csv
+import os
+
+
+def write_workbook(path, kind, rows):
+    workbook = Workbook()
+    workbook.active.append(["head", "key1", kind, "tail", "key2"])
+    for row in rows:
+        workbook.active.append(row)
+    workbook.save(path)
+
+
+def read_rows(output_dir, entries):
+    rows = []
+    for entry in entries:
+        with open(os.path.join(output_dir, entry["file"]), "r", encoding="utf-8", newline="") as file:
+            rows += list(csv.reader(file))[1:]
+    return sorted(rows)
+
+
+def test_bulk_export_writes_the_graph_of_the_loader(tmp_path):
+    write_workbook(tmp_path / "ERTriples.xlsx", "relationship", [
+        ["植物", "樟", "界", "界", "植物界"],
+        ["植物", "楠木", "界", "界", "植物界"],
+        # A duplicate once normalized, an empty cell and a relationship type outside the ontology
+        ["植物", "樟 ", "界", "界", "植物界"],
+        ["植物", "松", "界", "界", None],
+        ["植物", "樟", "伴生", "植物", "楠木"],
+    ])
+    write_workbook(tmp_path / "EATriples.xlsx", "attribute", [
+        ["植物", "樟", "花期", "花期", "4-5月"],
+        ["植物", "樟", "花期", "花期", "5月"],
+    ])
+    output = tmp_path / "neo4j-import"
+    summary = bulk_export_directory(str(tmp_path), define_ERontology(), str(output), log=lambda message: None)
+    assert summary["problems"] == []
+    assert summary["stats"] == {"rows": 7, "skipped": 1, "duplicates": 1, "unknown_relationships": 1}
+    assert verify_bulk_import(str(output)) == []
+    # The temporary graph and deduplication index are removed
+    assert not [name for name in os.listdir(output) if name.startswith(".")]
+
+    with open(output / BULK_IMPORT_MANIFEST, "r", encoding="utf-8") as file:
+        manifest = json.load(file)
+    # The relationship outside the ontology is written, as BatchKGToNeo4j writes it
+    assert read_rows(output, manifest["relationships"]) == sorted([["樟", "植物界", "界"], ["楠木", "植物界", "界"], ["樟", "楠木", "伴生"]])
+    # The last value of an attribute wins, like SET; the row with an empty cell adds no node
+    assert read_rows(output, manifest["nodes"]) == sorted([["樟", "植物", "5月"], ["楠木", "植物", ""], ["植物界", "界"]])
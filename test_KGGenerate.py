@@ -0,0 +1,60 @@
+# Tests of the chunking of the input files: run with python -m pytest
+from KGGenerate import iter_chunks, iter_usertext, split_sentences
+from KGMatcher import estimate_tokens
+import random
+import os
+
+
+EXAMPLE_INPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "example-data", "example-input")
+
+
+def example_sentences():
+    sentences = []
+    for filename in sorted(os.listdir(EXAMPLE_INPUT)):
+        if filename.endswith(".txt"):
+            with open(os.path.join(EXAMPLE_INPUT, filename), "r", encoding="utf-8") as file:
+                for line in file:
+                    sentences.extend(split_sentences(line.strip()))
+    return sentences
+
+
+# Random texts made of the example sentences, a few of them glued into sentences longer than any budget
+def random_texts(count, seed=0):
+    rng = random.Random(seed)
+    sentences = example_sentences()
+    for _ in range(count):
+        lines = []
+        for _ in range(rng.randint(1, 12)):
+            line = "".join(rng.choice(sentences) for _ in range(rng.randint(1, 6)))
+            if rng.random() < 0.1:
+                line = line.replace("。", "，")
+            lines.append(line)
+        yield lines, rng.randint(20, 300), rng.choice([0, 0, 10, 50, 400])
+
+
+def test_chunks_stay_within_the_token_budget():
+    for lines, max_tokens, overlap_tokens in random_texts(300):
+        for chunk in iter_chunks(lines, max_tokens, overlap_tokens):
+            assert estimate_tokens(chunk.strip()) <= max_tokens
+
+
+def test_chunks_without_overlap_keep_the_whole_text_in_order():
+    for lines, max_tokens, _ in random_texts(300, seed=1):
+        chunks = list(iter_chunks(lines, max_tokens, 0))
+        # Only the whitespace around the chunks is stripped
+        assert "".join("".join(chunks).split()) == "".join("".join(lines).split())
+
+
+def test_overlap_repeats_the_last_sentences_of_the_previous_chunk():
+    chunks = list(iter_chunks(["第一句。第二句。第三句。第四句。"], max_tokens=estimate_tokens("第一句。第二句。"), overlap_tokens=estimate_tokens("第二句。")))
+    assert [chunk.strip() for chunk in chunks] == ["第一句。第二句。", "第二句。第三句。", "第三句。第四句。"]
+
+
+def test_positions_count_the_bytes_read_for_each_chunk(tmp_path):
+    path = tmp_path / "text.txt"
+    path.write_text("\n".join(["樟树是樟科植物。" * 20] * 10), encoding="utf-8")
+    positions = []
+    chunks = list(iter_usertext(str(path), 50, 0, positions))
+    assert len(positions) == len(chunks)
+    assert positions == sorted(positions)
+    assert positions[-1] == os.path.getsize(path)
@@ -0,0 +1,51 @@
+# Tests of the chunk journal: run with python -m pytest
+from knowledge_graph_builder import EREdge, ERNode
+from KGJournal import ChunkJournal
+from KGManifest import ExtractionManifest
+
+
+def edge(head, tail):
+    return EREdge(node_1=ERNode(entity="植物", name=head), node_2=ERNode(entity="科", name=tail), relationship="属于")
+
+
+def test_replays_the_chunks_of_the_same_file_and_version(tmp_path):
+    journal = ChunkJournal(str(tmp_path), "v1", ["ERTriples.xlsx"], fsync=False)
+    journal.append("text1.txt", "aaa", 0, [edge("樟", "樟科")])
+    journal.append("text1.txt", "aaa", 1, [edge("楠木", "樟科")])
+    journal.close()
+    # Another version or another content never replays the chunks
+    assert ChunkJournal(str(tmp_path), "v2", ["ERTriples.xlsx"]).chunks("text1.txt", "aaa") == {}
+    assert ChunkJournal(str(tmp_path), "v1", ["ERTriples.xlsx"]).chunks("text1.txt", "bbb") == {}
+    replay = ChunkJournal(str(tmp_path), "v1", ["ERTriples.xlsx"])
+    chunks = replay.chunks("text1.txt", "aaa")
+    assert sorted(chunks) == [0, 1]
+    assert chunks[1][0].node_1.name == "楠木"
+    assert replay.stats()["replayed"] == 2
+
+
+def test_compact_drops_deleted_changed_and_old_version_records(tmp_path):
+    old = ChunkJournal(str(tmp_path), "v0", ["ERTriples.xlsx"], fsync=False)
+    old.append("text1.txt", "aaa", 0, [edge("樟", "樟科")])
+    old.close()
+    attribute = ChunkJournal(str(tmp_path), "ea", ["EATriples.xlsx"], fsync=False)
+    attribute.append("text1.txt", "aaa", 0, [])
+    attribute.close()
+    journal = ChunkJournal(str(tmp_path), "v1", ["ERTriples.xlsx"], fsync=False)
+    journal.append("text1.txt", "aaa", 0, [edge("樟", "樟科")])
+    journal.append("text2.txt", "bbb", 0, [edge("楠木", "樟科")])
+    journal.append("text3.txt", "ccc", 0, [edge("松", "松科")])
+    journal.append("text4.txt", "ddd", 0, [edge("柏", "柏科")])
+    manifest = ExtractionManifest(str(tmp_path))
+    manifest.record("ERTriples.xlsx", "text4.txt", "ddd", "v1", 1)
+    # text2.txt changed, text3.txt was deleted and text4.txt is complete
+    journal.compact(manifest, ["text1.txt", "text2.txt", "text4.txt"], {"text1.txt": "aaa", "text2.txt": "zzz", "text4.txt": "ddd"})
+    records = list(ChunkJournal(str(tmp_path), "v1", ["ERTriples.xlsx"]).records())
+    # The records of the attribute pass stay for its own run
+    assert sorted((record["version"], record["file"]) for record in records) == [("ea", "text1.txt"), ("v1", "text1.txt")]
+
+
+def test_compact_removes_an_empty_journal(tmp_path):
+    journal = ChunkJournal(str(tmp_path), "v1", ["ERTriples.xlsx"], fsync=False)
+    journal.append("text1.txt", "aaa", 0, [])
+    journal.compact(ExtractionManifest(str(tmp_path)), [], {})
+    assert not (tmp_path / "chunk_journal.jsonl").exists()
@@ -0,0 +1,81 @@
+# Tests of the batched Neo4j loader: run with python -m pytest
+from benchmark import FakeBatchKGToNeo4j, FakeNeo4jDriver, FakeTransientError, NODE_PATTERN
+from KGGenerate import define_ERontology
+from KGNeo4j import iter_workbook_rows, partition_rows, triples_kind, writer_of
+from openpyxl import Workbook
+import pytest
+
+
+def write_workbook(path, rows):
+    workbook = Workbook()
+    for row in rows:
+        workbook.active.append(row)
+    workbook.save(path)
+
+
+def test_workbook_columns_are_read_by_header_name(tmp_path):
+    path = str(tmp_path / "ERTriples.xlsx")
+    write_workbook(path, [["note", "key2", "tail", "relationship", "key1", "head"], ["checked", "植物界", "界", "界", "樟", "植物"], [None] * 6])
+    rows = iter_workbook_rows(path)
+    assert triples_kind(next(rows)) == "relationship"
+    assert list(rows) == [("植物", "樟", "界", "界", "植物界")]
+
+
+def test_workbook_without_a_triple_column_is_an_error(tmp_path):
+    path = str(tmp_path / "EATriples.xlsx")
+    write_workbook(path, [["head", "key1", "attribute", "tail"], ["植物", "樟", "花期", "花期"]])
+    rows = iter_workbook_rows(path)
+    assert triples_kind(next(rows)) == "attribute"
+    with pytest.raises(ValueError, match="key2"):
+        next(rows)
+
+
+# Relationship rows around two hubs (a kingdom and a few families), the shape of taxonomy triples
+def hub_rows(count):
+    return [("植物", f"植物{number}", "科", "科", f"科{number % 3}") for number in range(count)] + \
+        [("植物", f"植物{number}", "界", "界", "植物界") for number in range(count)]
+
+
+def test_rows_of_a_head_node_always_go_to_the_same_writer():
+    rows = hub_rows(40)
+    partitions = partition_rows(rows, 4)
+    assert sorted(row for part in partitions for row in part) == sorted(rows)
+    assert all(len(part) < len(rows) / 2 for part in partitions)
+    for row in rows:
+        assert row in partitions[writer_of(row, 4)]
+
+
+def test_relationship_transactions_lock_their_nodes_in_one_order():
+    loader = FakeBatchKGToNeo4j(FakeNeo4jDriver(), writers=4, log=lambda message: None)
+    statements = loader.locked_ER_statements(list(reversed(hub_rows(5))))
+    locks = [(query, [row["name"] for row in rows]) for query, rows in statements if "_lock" in query]
+    nodes = [(NODE_PATTERN.search(query).group(1), name) for query, names in locks for name in names]
+    assert nodes == sorted(nodes)
+    assert len(nodes) == len(set(nodes)) == 5 + 3 + 1
+    # The locks come before the relationships
+    assert all("_lock" in query for query, _ in statements[:len(locks)])
+
+
+def test_concurrent_writers_do_not_deadlock_on_hub_nodes():
+    driver = FakeNeo4jDriver(row_latency=0.0005)
+    loader = FakeBatchKGToNeo4j(driver, batch_size=200, log=lambda message: None, writers=4)
+    stats = loader.rows_to_neo4j(define_ERontology(), iter(hub_rows(300)), "ERTriples.xlsx")
+    assert driver.deadlocks == 0 and stats["retries"] == 0
+    assert stats["rows"] == 600
+    assert all(writer["rows"] for writer in stats["writers"].values())
+
+
+# Fails its first transaction with a deadlock
+class DeadlockOnceDriver(FakeNeo4jDriver):
+    def commit(self, transaction):
+        if not self.deadlocks:
+            self.deadlocks += 1
+            raise FakeTransientError("Deadlock detected while trying to acquire locks")
+        super().commit(transaction)
+
+
+def test_transient_deadlocks_are_retried():
+    driver = DeadlockOnceDriver()
+    loader = FakeBatchKGToNeo4j(driver, log=lambda message: None, writers=1)
+    stats = loader.rows_to_neo4j(define_ERontology(), iter(hub_rows(5)), "ERTriples.xlsx")
+    assert stats["retries"] == 1 and driver.rows == 10
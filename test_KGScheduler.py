@@ -0,0 +1,65 @@
+# Tests of the request scheduler: run with python -m pytest
+from KGScheduler import RateLimitedLLMClient, TokenBucket, rate_limit_info
+import KGScheduler
+
+
+# Headers of a 429 of the Groq API: the requests headers count the requests per day, the tokens headers the tokens per minute
+GROQ_429_HEADERS = {
+    "retry-after": "2",
+    "x-ratelimit-limit-requests": "14400",
+    "x-ratelimit-limit-tokens": "6000",
+    "x-ratelimit-remaining-requests": "0",
+    "x-ratelimit-remaining-tokens": "0",
+    "x-ratelimit-reset-requests": "50m0s",
+    "x-ratelimit-reset-tokens": "7.66s",
+}
+
+
+class FakeResponse:
+    def __init__(self, status_code, headers):
+        self.status_code = status_code
+        self.headers = headers
+
+
+class FakeRateLimitError(Exception):
+    def __init__(self, headers):
+        super().__init__("Rate limit reached")
+        self.status_code = 429
+        self.response = FakeResponse(429, headers)
+
+
+# Fails with the given errors, then answers
+class FlakyLLMClient:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def generate_response(self, user_message, system_message):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "ok"
+
+
+def test_rate_limit_info_parses_groq_headers():
+    info = rate_limit_info(FakeRateLimitError(GROQ_429_HEADERS))
+    assert info == {"retry_after": 2.0, "remaining_requests": 0, "remaining_tokens": 0, "reset_requests": 3000.0, "reset_tokens": 7.66}
+
+
+def test_daily_request_quota_does_not_stall_the_minute_bucket(monkeypatch):
+    sleeps = []
+    monkeypatch.setattr(KGScheduler.time, "sleep", sleeps.append)
+    client = RateLimitedLLMClient(FlakyLLMClient([FakeRateLimitError(GROQ_429_HEADERS)]), requests_per_minute=30, tokens_per_minute=6000,
+                                  base_delay=0.01, log=lambda message: None)
+    assert client.generate_response("user", "system") == "ok"
+    # The retry waits for retry-after and the tokens/minute reset, not for the 50 minutes of the daily reset
+    assert max(sleeps) < 60
+    assert client.requests.reserve() < 60
+    assert client.stats()["throttled"] == 1
+
+
+def test_sync_caps_the_reset_to_the_refill_window():
+    bucket = TokenBucket(30)
+    bucket.sync(0, 3000.0)
+    # At most one minute to wait for a request, whatever the reported reset
+    assert bucket.reserve() <= 60 + 2
@@ -0,0 +1,119 @@
+# Tests of the sharded extraction: run with python -m pytest
+from benchmark import FakeLLMClient, generate_corpus, UNLIMITED_PER_MINUTE
+from knowledge_graph_builder import KnowledgeGraphBuilder
+from KGGenerate import define_ERontology, define_EAontology, extract_directory
+from KGManifest import ExtractionManifest
+from KGPipeline import extract_knowledge_graph
+from KGShard import WorkQueue, Heartbeat, run_worker, merge_shards
+from openpyxl import load_workbook
+import logging
+import time
+import os
+
+
+EXAMPLE_INPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "example-data", "example-input")
+OPTIONS = {"requests_per_minute": UNLIMITED_PER_MINUTE, "tokens_per_minute": UNLIMITED_PER_MINUTE, "use_cache": False}
+
+
+def quiet(message):
+    pass
+
+
+def write_files(directory, files):
+    os.makedirs(directory, exist_ok=True)
+    for filename, text in files.items():
+        with open(os.path.join(directory, filename), "w", encoding="utf-8") as file:
+            file.write(text)
+
+
+def workbook_rows(path):
+    return set(load_workbook(path).active.iter_rows(values_only=True)) if os.path.exists(path) else set()
+
+
+def test_workers_claim_disjoint_files_and_only_the_lease_holder_completes(tmp_path):
+    write_files(tmp_path / "input", {"a.txt": "樟。", "b.txt": "楠木。", "c.txt": "松。"})
+    queue = WorkQueue(str(tmp_path / "save"))
+    assert queue.populate(str(tmp_path / "input"), "v1") == {"queued": 3, "removed": 0}
+    assert queue.claim("w1", limit=1) == ["a.txt"]
+    # A lease that expired (here at once) makes the file claimable by another worker
+    assert queue.claim("w1", limit=1, lease_seconds=-1) == ["b.txt"]
+    assert queue.claim("w2", limit=2) == ["b.txt", "c.txt"]
+    assert queue.complete("w1", "a.txt")
+    # Only the worker holding the lease completes a file or renews its lease
+    assert not queue.complete("w1", "b.txt")
+    assert queue.heartbeat("w1", ["b.txt"]) == []
+    assert queue.complete("w2", "b.txt")
+    assert queue.done() == [("a.txt", "w1"), ("b.txt", "w2")]
+    queue.close()
+
+
+def test_populate_requeues_changed_files_and_new_versions(tmp_path):
+    write_files(tmp_path / "input", {"a.txt": "樟。", "b.txt": "楠木。"})
+    queue = WorkQueue(str(tmp_path / "save"))
+    queue.populate(str(tmp_path / "input"), "v1")
+    for filename in queue.claim("w1"):
+        queue.complete("w1", filename)
+    assert queue.populate(str(tmp_path / "input"), "v1") == {"queued": 0, "removed": 0}
+    write_files(tmp_path / "input", {"a.txt": "樟树。"})
+    os.remove(tmp_path / "input" / "b.txt")
+    assert queue.populate(str(tmp_path / "input"), "v1") == {"queued": 1, "removed": 1}
+    assert queue.populate(str(tmp_path / "input"), "v2") == {"queued": 1, "removed": 0}
+    queue.close()
+
+
+def test_a_file_failing_max_attempts_times_is_given_up(tmp_path):
+    write_files(tmp_path / "input", {"a.txt": "樟。"})
+    queue = WorkQueue(str(tmp_path / "save"), max_attempts=2)
+    queue.populate(str(tmp_path / "input"), "v1")
+    for _ in range(2):
+        assert queue.claim("w1") == ["a.txt"]
+        queue.fail("w1", "a.txt", "LLM error")
+    assert queue.claim("w1") == []
+    assert queue.stats()["failed"] == 1 and queue.remaining() == 0
+    queue.close()
+
+
+# A queue that no longer knows the worker: every heartbeat loses the leases
+class StolenQueue:
+    def heartbeat(self, worker_id, filenames, lease_seconds):
+        return []
+
+
+def test_heartbeat_reports_the_lost_leases():
+    heartbeat = Heartbeat(StolenQueue(), "w1", ["a.txt"], log=quiet)
+    heartbeat.interval = 0.01
+    with heartbeat:
+        deadline = time.monotonic() + 5
+        while not heartbeat.is_lost("a.txt") and time.monotonic() < deadline:
+            time.sleep(0.01)
+    assert heartbeat.is_lost("a.txt") and not heartbeat.is_lost("b.txt")
+
+
+def test_cancelled_files_are_not_recorded_as_extracted(tmp_path):
+    logging.disable(logging.CRITICAL)
+    corpus = generate_corpus(EXAMPLE_INPUT, str(tmp_path / "corpus"), 2, log=quiet)
+    erontology, eaontology = define_ERontology(), define_EAontology()
+    builder = KnowledgeGraphBuilder(ontology=erontology, llm_client=FakeLLMClient(erontology, eaontology))
+    summary = extract_directory(builder, corpus, str(tmp_path / "save"), quiet, 1, cancelled=lambda filename: filename == "text0.txt")
+    assert summary["cancelled_files"] == ["text0.txt"] and summary["extracted"] == 1
+    assert ExtractionManifest(str(tmp_path / "save")).filenames("ERTriples.xlsx") == ["text1.txt"]
+
+
+# Worker w1 extracts two files with the same text, then the first file changes and worker w2 extracts it again:
+# the merge keeps the triples of the unchanged file that w1 produced for both, like a single process does
+def test_merged_shards_match_a_single_process_extraction(tmp_path):
+    logging.disable(logging.CRITICAL)
+    erontology, eaontology = define_ERontology(), define_EAontology()
+    corpus = generate_corpus(EXAMPLE_INPUT, str(tmp_path / "corpus"), 2, seed=1, log=quiet)
+    with open(os.path.join(corpus, "text0.txt"), "r", encoding="utf-8") as file:
+        write_files(corpus, {"text1.txt": file.read()})
+    sharded = str(tmp_path / "sharded")
+    run_worker(corpus, sharded, erontology, eaontology, FakeLLMClient(erontology, eaontology), quiet, "w1", **OPTIONS)
+    write_files(corpus, {"text0.txt": "獐毛群落分布于潮间带。\n"})
+    run_worker(corpus, sharded, erontology, eaontology, FakeLLMClient(erontology, eaontology), quiet, "w2", **OPTIONS)
+    merge_shards(sharded, quiet)
+    single = str(tmp_path / "single")
+    extract_knowledge_graph(corpus, single, erontology, eaontology, FakeLLMClient(erontology, eaontology), quiet, 1, **OPTIONS)
+    for output in ("ERTriples.xlsx", "EATriples.xlsx"):
+        assert workbook_rows(os.path.join(sharded, output)) == workbook_rows(os.path.join(single, output))
+    assert workbook_rows(os.path.join(single, "ERTriples.xlsx"))
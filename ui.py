@@ -1,127 +1,129 @@
 import sys
-from tkinter.tix import TEXT
-from PyQt5.QtWebEngineWidgets import QWebEngineView
 from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QHBoxLayout,
                              QLabel, QPushButton, QListWidget, QStackedWidget,
                              QFileDialog, QLineEdit, QSizePolicy, QFormLayout,
-                             QDialog,QTextEdit,QListWidgetItem)
+                             QDialog,QListWidgetItem,QPlainTextEdit,QProgressBar,QCheckBox)
 from PyQt5.QtGui import QPalette, QBrush, QColor, QPixmap,QPainter
-from PyQt5.QtCore import Qt,QThread, pyqtSignal,QCoreApplication
+from PyQt5.QtCore import Qt,QThread, pyqtSignal,QCoreApplication,QTimer
 from PyQt5 import QtCore
-from PyQt5 import uic
-from QCandyUi.CandyWindow import colorful
 from Dictionary import EN_to_CN, CN_to_EN  
-from dotenv import load_dotenv
-from knowledge_graph_builder import KnowledgeGraphBuilder, GroqClient, KGToNeo4j
-from KGGenerate import define_ERontology,define_EAontology,export_to_directory
-import pandas as pd
-import os
-# Load the configuration in the .env 
-load_dotenv()
+import threading
+# QtWebEngine, pandas and the LLM and Neo4j stack are imported when the page or the task that needs them starts,
+# so that the first window appears quickly
+
+# The log lines of a worker thread are sent to the progress dialog in one batch every 100 ms
+LOG_FLUSH_INTERVAL = 100
+# The progress dialog keeps the most recent lines only
+LOG_MAX_LINES = 2000
+
+
+# The ontologies and the LLM client are built in the worker thread when the extraction starts
+def load_extraction_stack(model):
+    from dotenv import load_dotenv
+    from knowledge_graph_builder import GroqClient
+    from KGGenerate import define_ERontology, define_EAontology
+    # Load the configuration in the .env 
+    load_dotenv()
+    return define_ERontology(), define_EAontology(), GroqClient(model=model, temperature=0.1, top_p=0.5)
+
+
+# Worker thread whose log lines are buffered and emitted in batches by a timer of the GUI thread,
+# so that a busy worker never floods the event loop with one signal per line
+class BufferedLogThread(QThread):
+    log_signal = pyqtSignal(list)
+    # label, chunks done, total chunks
+    # Python ints: the byte counts of a large corpus do not fit in a C int
+    progress_signal = pyqtSignal(str, object, object)
+    # One line summary of the run metrics, refreshed with every batch of log lines
+    metrics_signal = pyqtSignal(str)
 
-
-class ExtractionThread(QThread):
-    log_signal = pyqtSignal(str)  
-
-    def __init__(self, inputdir_path, save_path, erontology, eaontology, llm):
+    def __init__(self):
+        super().__init__()
+        # KGMetrics.RunMetrics of the run, created by run() in the worker thread
+        self.metrics = None
+        self.pending_lines = []
+        self.pending_lock = threading.Lock()
+        # The thread object lives in the GUI thread, so its timer fires there
+        self.flush_timer = QTimer()
+        self.flush_timer.setInterval(LOG_FLUSH_INTERVAL)
+        self.flush_timer.timeout.connect(self.flush)
+        self.started.connect(self.flush_timer.start)
+        self.finished.connect(self.flush_timer.stop)
+        self.finished.connect(self.flush)
+
+    # Called from the worker thread
+    def log(self, message):
+        with self.pending_lock:
+            self.pending_lines.append(message)
+
+    def flush(self):
+        with self.pending_lock:
+            lines, self.pending_lines = self.pending_lines, []
+        if lines:
+            self.log_signal.emit(lines)
+        if self.metrics is not None:
+            self.metrics_signal.emit(self.metrics.summary_line())
+
+    def progress(self, label, done, total):
+        self.progress_signal.emit(label, done, total)
+
+
+class ExtractionThread(BufferedLogThread):
+    # options are passed on to KGPipeline.extract_knowledge_graph: max_workers, joint, prefilter, use_async, ...
+    def __init__(self, inputdir_path, save_path, model, **options):
         super().__init__()
         self.inputdir_path = inputdir_path
         self.save_path = save_path
-        self.erontology = erontology
-        self.eaontology = eaontology
-        self.llm = llm
+        self.model = model
+        self.options = options
 
     def run(self):
-        self.log_signal.emit("Received user input file: Start extracting the Entity Relationship Knowledge Graph")
-        QApplication.processEvents()  
-        self.ERKGgenerate(self.inputdir_path)
-        self.log_signal.emit("Received user input file: Start extracting Entity Attributes Knowledge Graph")
-        QApplication.processEvents()  
-        self.EAKGgenerate(self.inputdir_path)
-
-    def ERKGgenerate(self, inputdir_path):
-        ERKGBuilder = KnowledgeGraphBuilder(ontology=self.erontology, llm_client=self.llm)
-        for filename in os.listdir(inputdir_path):
-            if filename.endswith(".txt"):
-                input_file = os.path.join(inputdir_path, filename)
-                with open(input_file, 'r', encoding='utf-8') as f:
-                    lines = f.readlines()
-                    user_text = ["\n" + line.strip() + "\n" for line in lines if line.strip()]
-                docs = ERKGBuilder.create_docs(user_text)
-                
-                ERKnowledgeGraph = ERKGBuilder.documents_to_graph(list(docs), delay=0)
-                for item in ERKnowledgeGraph:
-                    self.log_signal.emit(str(item))
-                    QApplication.processEvents()  
-                if self.save_path:
-                    export_to_directory(ERKnowledgeGraph, self.erontology, self.save_path)
-                    self.log_signal.emit(f"Entity relationship triples have been extracted from {filename} to {self.save_path}")
-                else:
-                    self.log_signal.emit("The save path is not selected, please select the save path.")
-                QApplication.processEvents()  
-        self.log_signal.emit("All entity relationship triples have been extracted and successfully exported to the Excel file.")
-
-    def EAKGgenerate(self, inputdir_path):
-        EAKGBuilder = KnowledgeGraphBuilder(ontology=self.eaontology, llm_client=self.llm)
-        for filename in os.listdir(inputdir_path):
-            if filename.endswith(".txt"):
-                input_file = os.path.join(inputdir_path, filename)
-                with open(input_file, 'r', encoding='utf-8') as f:
-                    lines = f.readlines()
-                    user_text = ["\n" + line.strip() + "\n" for line in lines if line.strip()]
-                docs = EAKGBuilder.create_docs(user_text)
-                
-                EAKnowledgeGraph = EAKGBuilder.documents_to_graph(list(docs), delay=0)
-                for item in EAKnowledgeGraph:
-                    self.log_signal.emit(str(item))
-                    QApplication.processEvents()  
-                if self.save_path:
-                    export_to_directory(EAKnowledgeGraph, self.eaontology, self.save_path)
-                    self.log_signal.emit(f"Entity attributes triples have been extracted from {filename} to {self.save_path}")
-                else:
-                    self.log_signal.emit("The save path is not selected, please select the save path.")
-                QApplication.processEvents()  
-        self.log_signal.emit("All entity attributes triples have been extracted and successfully exported to the Excel file.")
-
-
-class GenerateThread(QThread):
-    log_signal = pyqtSignal(str)  
-
-    def __init__(self, selected_inputdir_path, uri, username, password, erontology, eaontology):
+        from KGPipeline import extract_knowledge_graph
+        from KGMetrics import RunMetrics
+        erontology, eaontology, llm = load_extraction_stack(self.model)
+        self.metrics = RunMetrics("extract")
+        extract_knowledge_graph(self.inputdir_path, self.save_path, erontology, eaontology, llm, self.log, progress=self.progress,
+                                metrics=self.metrics, **self.options)
+
+
+class GenerateThread(BufferedLogThread):
+    # options are passed on to KGPipeline.load_knowledge_graph: batch_size, writers
+    def __init__(self, selected_inputdir_path, uri, username, password, **options):
         super().__init__()
         self.selected_inputdir_path = selected_inputdir_path
         self.uri = uri
         self.username = username
         self.password = password
-        self.erontology = erontology
-        self.eaontology = eaontology
+        self.options = options
 
     def run(self):
-        self.log_signal.emit("Start passing user-supplied triples into the Neo4j database")
-        QCoreApplication.processEvents()  
-        self.start_generation(self.selected_inputdir_path)
-
-    def start_generation(self, selected_inputdir_path):
-        KGNeo4j = KGToNeo4j(self.uri, self.username, self.password)
-        if selected_inputdir_path:  
-            for filename in os.listdir(selected_inputdir_path):
-                file_path = os.path.join(selected_inputdir_path, filename)
-                if os.path.isfile(file_path) and filename.endswith(('.xlsx', '.xls')):
-                    df = pd.read_excel(file_path)
-                    if 'relationship' in df.columns[2]:  
-                        KGNeo4j.graph_to_neo4j(self.erontology, file_path)
-                        self.log_signal.emit(f"Successfully passed Entity relationship triples into the Neo4j database for file {filename}.")
-                    elif 'attribute' in df.columns[2]:
-                        KGNeo4j.graph_to_neo4j(self.eaontology, file_path)
-                        self.log_signal.emit(f"Successfully passed Entity attribute triples into the Neo4j database for file {filename}.")
-                    else:
-                        self.log_signal.emit(f"Unknown ontology type for file {filename}.")
-                else:
-                    self.log_signal.emit(f"Skipped non-Excel file {filename}.")
-            self.log_signal.emit("All files have been successfully imported into the Neo4j database, please check in Neo4j.")
+        if self.selected_inputdir_path:
+            from KGPipeline import load_knowledge_graph
+            from KGGenerate import define_ERontology, define_EAontology
+            from KGMetrics import RunMetrics
+            self.metrics = RunMetrics("load")
+            load_knowledge_graph(self.selected_inputdir_path, self.uri, self.username, self.password, define_ERontology(), define_EAontology(),
+                                 self.log, metrics=self.metrics, **self.options)
         else:
-            self.log_signal("No directory path selected.")
-    
+            self.log("No directory path selected.")
+
+
+# Writes the selected triples as neo4j-admin import files (into its neo4j-import directory) instead of loading them
+class BulkExportThread(BufferedLogThread):
+    def __init__(self, selected_inputdir_path):
+        super().__init__()
+        self.selected_inputdir_path = selected_inputdir_path
+
+    def run(self):
+        if self.selected_inputdir_path:
+            from KGPipeline import bulk_export_knowledge_graph
+            from KGGenerate import define_ERontology
+            from KGMetrics import RunMetrics
+            self.metrics = RunMetrics("bulk_export")
+            bulk_export_knowledge_graph(self.selected_inputdir_path, define_ERontology(), log=self.log, metrics=self.metrics)
+        else:
+            self.log("No directory path selected.")
+
 
 class MyWindow(QWidget):
     def __init__(self):
@@ -199,9 +201,13 @@ class SecondWindow(QWidget):
         self.initUI()
         self.uri = "bolt://localhost:7687"
         self.model = "llama3-70b-8192"
-        self.erontology = define_ERontology()
-        self.eaontology = define_EAontology()
-        self.LLM = GroqClient(model=self.model, temperature=0.1, top_p=0.5)
+        # joint and use_async are set from the check boxes of the extraction page
+        self.extraction_options = {
+            # Skip the chunks that mention none of the ontology entities
+            "prefilter": True,
+            # Send every chunk with the whole ontology; pruning (cli.py --prune) changes the extraction version
+            "prune": False,
+        }
         self.selected_file_path = ""
         self.save_path=""
    
@@ -256,7 +262,9 @@ class SecondWindow(QWidget):
         use_method_label = QLabel(self.get_label_text("Usage Instructions"), home_page)
         use_method_label.setStyleSheet("font-family: Times New Roman; font-weight: bold;font-size: 28px; text-shadow: 2px 2px 4px rgba(0, 0, 0, 0.3);")
 
+        from PyQt5.QtWebEngineWidgets import QWebEngineView
         web_view = QWebEngineView()
+        self.web_view = web_view
         web_view.setStyleSheet("background: transparent; border: none;")  
         web_view.setWindowOpacity(0)
 
@@ -349,6 +357,20 @@ class SecondWindow(QWidget):
         extraction_layout.addLayout(path_selection_Vlayout)
         #extraction_layout.addLayout(path_selection_layout2)  
 
+        # Extraction options
+        options_layout = QHBoxLayout()
+        # Extract entity relationship and entity attribute triples with one LLM call per chunk
+        self.joint_checkbox = QCheckBox(self.get_label_text("Joint Extraction"))
+        self.joint_checkbox.setStyleSheet("font-size: 16px;")
+        options_layout.addWidget(self.joint_checkbox)
+        options_layout.addSpacing(20)
+        # Send the chunks from one asyncio event loop instead of a pool of threads
+        self.async_checkbox = QCheckBox(self.get_label_text("Asynchronous Requests"))
+        self.async_checkbox.setStyleSheet("font-size: 16px;")
+        options_layout.addWidget(self.async_checkbox)
+        options_layout.addStretch()
+        extraction_layout.addLayout(options_layout)
+
         
 
         # Bottom Start Extraction button centered
@@ -470,8 +492,16 @@ class SecondWindow(QWidget):
         generate_button.setStyleSheet(self.get_style_sheet())
         generate_button.clicked.connect(self.start_generation)  
 
-        # Add a button to the layout
+        # Add a button to write neo4j-admin import files for the first load of a large graph
+        bulk_export_button = QPushButton(self.get_label_text("Export Import Files"))
+        bulk_export_button.setFixedWidth(220)
+        bulk_export_button.setFixedHeight(40)
+        bulk_export_button.setStyleSheet(self.get_style_sheet())
+        bulk_export_button.clicked.connect(self.start_bulk_export)
+
+        # Add the buttons to the layout
         generation_layout.addWidget(generate_button, alignment=Qt.AlignmentFlag.AlignCenter)
+        generation_layout.addWidget(bulk_export_button, alignment=Qt.AlignmentFlag.AlignCenter)
 
         # Set the main layout of the generated page
         generation_page.setLayout(generation_layout)
@@ -583,25 +613,55 @@ class SecondWindow(QWidget):
             return
 
         # Show Extraction Progress dialog box
+        self.show_progress_dialog()
+
+        # Create a background thread and start it
+        options = {**self.extraction_options, "joint": self.joint_checkbox.isChecked(), "use_async": self.async_checkbox.isChecked()}
+        self.extraction_thread = ExtractionThread(inputdir_path, self.save_path_line_edit.text(), self.model, **options)
+        self.connect_progress(self.extraction_thread)
+        self.extraction_thread.start()
+
+    # Progress dialog: a progress bar driven by the bytes extracted and a view of the most recent log lines
+    def show_progress_dialog(self):
         self.progress_dialog = QDialog(self)
         self.progress_dialog.setWindowTitle("extraction progress")
         self.progress_dialog.setGeometry(200, 200, 600, 400)
         layout = QVBoxLayout()
-        self.log_text_edit = QTextEdit()
+        self.progress_bar = QProgressBar()
+        # Busy indicator until the first progress report
+        self.progress_bar.setRange(0, 0)
+        layout.addWidget(self.progress_bar)
+        # Live run metrics: LLM latency, errors and triples per second
+        self.metrics_label = QLabel()
+        self.metrics_label.setStyleSheet("font-size: 14px; color: black;")
+        layout.addWidget(self.metrics_label)
+        self.log_text_edit = QPlainTextEdit()
         self.log_text_edit.setReadOnly(True)
+        # Older lines are dropped once the view holds LOG_MAX_LINES lines
+        self.log_text_edit.setMaximumBlockCount(LOG_MAX_LINES)
         layout.addWidget(self.log_text_edit)
         self.progress_dialog.setLayout(layout)
         self.progress_dialog.show()
 
-        # Create a background thread and start it
-        self.extraction_thread = ExtractionThread(inputdir_path, self.save_path_line_edit.text(), self.erontology, self.eaontology, self.LLM)
-        self.extraction_thread.log_signal.connect(self.log_message)
-        self.extraction_thread.start()
+    def connect_progress(self, thread):
+        thread.log_signal.connect(self.log_message)
+        thread.progress_signal.connect(self.update_progress)
+        thread.metrics_signal.connect(self.metrics_label.setText)
+        thread.finished.connect(self.finish_progress)
 
-   
-    def log_message(self, message):
-        self.log_text_edit.append(message)
-        QApplication.processEvents()  
+    def log_message(self, lines):
+        self.log_text_edit.appendPlainText("\n".join(lines))
+
+    # done and total are bytes of the input files; the bar shows per mille of them
+    def update_progress(self, label, done, total):
+        self.progress_bar.setRange(0, 1000)
+        self.progress_bar.setValue(done * 1000 // max(total, 1))
+        self.progress_bar.setFormat(f"{label}: %p%")
+
+    def finish_progress(self):
+        if self.progress_bar.maximum() == 0:
+            self.progress_bar.setRange(0, 1)
+        self.progress_bar.setValue(self.progress_bar.maximum())
 
     # Generate Knowledge Graph interface, user-supplied triple files
     def choose_generation_dir(self):
@@ -630,19 +690,18 @@ class SecondWindow(QWidget):
 
         
         # Show Extraction Progress dialog box
-        self.progress_dialog = QDialog(self)
-        self.progress_dialog.setWindowTitle("extraction progress")
-        self.progress_dialog.setGeometry(200, 200, 600, 400)
-        layout = QVBoxLayout()
-        self.log_text_edit = QTextEdit()
-        self.log_text_edit.setReadOnly(True)
-        layout.addWidget(self.log_text_edit)
-        self.progress_dialog.setLayout(layout)
-        self.progress_dialog.show()
+        self.show_progress_dialog()
 
         # Create a background thread and start it
-        self.extraction_thread = GenerateThread(self.selected_inputdir_path, self.uri, username, password, self.erontology, self.eaontology)
-        self.extraction_thread.log_signal.connect(self.log_message) 
+        self.extraction_thread = GenerateThread(self.selected_inputdir_path, self.uri, username, password)
+        self.connect_progress(self.extraction_thread)
+        self.extraction_thread.start()
+
+    # Write the user-supplied triple files as neo4j-admin import files, no database connection needed
+    def start_bulk_export(self):
+        self.show_progress_dialog()
+        self.extraction_thread = BulkExportThread(getattr(self, "selected_inputdir_path", ""))
+        self.connect_progress(self.extraction_thread)
         self.extraction_thread.start()
         
         
@@ -659,7 +718,7 @@ class SecondWindow(QWidget):
         # Update the text of the homepage
         home_page = self.stacked_widget.widget(0)  
         home_page.findChild(QLabel).setText(self.get_label_text("Usage Instructions"))
-        home_page.findChild(QWebEngineView).setHtml(self.get_html_content())
+        self.web_view.setHtml(self.get_html_content())
         # Update extraction page
         extraction_page = self.stacked_widget.widget(1)
         extraction_label = extraction_page.findChild(QLabel)
@@ -669,6 +728,8 @@ class SecondWindow(QWidget):
         extraction_page.findChildren(QPushButton)[0].setText(self.get_label_text("Choose InputDir..."))
         extraction_page.findChildren(QPushButton)[1].setText(self.get_label_text("Choose Save Path..."))
         extraction_page.findChildren(QPushButton)[2].setText(self.get_label_text("Start Extraction"))
+        self.joint_checkbox.setText(self.get_label_text("Joint Extraction"))
+        self.async_checkbox.setText(self.get_label_text("Asynchronous Requests"))
 
         # Update the Generated Knowledge Graph page
         generation_page = self.stacked_widget.widget(2)
@@ -691,6 +752,7 @@ class SecondWindow(QWidget):
         # Update Start generating the text of the button
         start_generation_button = generation_page.findChildren(QPushButton)[1]  
         start_generation_button.setText(self.get_label_text("Start Generating"))
+        generation_page.findChildren(QPushButton)[2].setText(self.get_label_text("Export Import Files"))
 
         # Update the database information section
         database_info_label = generation_page.findChildren(QLabel)[2]  
@@ -922,6 +984,8 @@ x                            }
 
 
 if __name__ == '__main__':
+    # Lets QtWebEngine be imported after the QApplication exists, when the operation window is opened
+    QCoreApplication.setAttribute(Qt.AA_ShareOpenGLContexts)
     app = QApplication(sys.argv)
     window = MyWindow()
     window.show()